@@ -0,0 +1,48 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable
+
+from the_spymaster_util.logger import get_logger
+
+log = get_logger(__name__)
+
+Task = Callable[[], Any]
+
+
+class ChatScheduler:
+    """
+    Runs tasks on a bounded worker pool. Tasks of different chats run concurrently,
+    while tasks of the same chat run one at a time, in the order they were submitted.
+    """
+
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-scheduler")
+        self._lock = threading.Lock()
+        # Chats with a running drain task, and the tasks waiting for it.
+        self._queues: Dict[Hashable, Deque[Task]] = {}
+
+    def submit(self, chat_id: Hashable, task: Task):
+        with self._lock:
+            queue = self._queues.get(chat_id)
+            if queue is not None:
+                queue.append(task)
+                return
+            self._queues[chat_id] = deque([task])
+        self._executor.submit(self._drain, chat_id)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _drain(self, chat_id: Hashable):
+        while True:
+            with self._lock:
+                queue = self._queues[chat_id]
+                if not queue:
+                    del self._queues[chat_id]
+                    return
+                task = queue.popleft()
+            try:
+                task()
+            except Exception:
+                log.exception("Scheduled task failed", extra={"chat_id": chat_id})
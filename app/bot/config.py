@@ -1,6 +1,6 @@
 import logging
 from logging.config import dictConfig
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from the_spymaster_util.config import LazyConfig
 from the_spymaster_util.logger import get_dict_config, get_logger
@@ -40,6 +40,34 @@ class Config(LazyConfig):
     def persistence_db_table_name(self) -> str:
         return self.get("persistence_db_table_name") or f"{self.service_prefix}-persistence-table"
 
+    @property
+    def persistence_cache_trust_seconds(self) -> float:
+        return float(self.get("PERSISTENCE_CACHE_TRUST_SECONDS", 0))
+
+    @property
+    def persistence_compression(self) -> bool:
+        return self.get("PERSISTENCE_COMPRESSION", False)
+
+    @property
+    def persistence_single_item_per_chat(self) -> bool:
+        return self.get("PERSISTENCE_SINGLE_ITEM_PER_CHAT", False)
+
+    @property
+    def persistence_ttl_seconds(self) -> Dict[str, int]:
+        return self.get("PERSISTENCE_TTL_SECONDS", {})
+
+    @property
+    def persistence_sqlite_path(self) -> Optional[str]:
+        return self.get("PERSISTENCE_SQLITE_PATH")
+
+    @property
+    def persistence_write_behind(self) -> bool:
+        return self.get("PERSISTENCE_WRITE_BEHIND", False)
+
+    @property
+    def persistence_write_behind_queue_size(self) -> int:
+        return int(self.get("PERSISTENCE_WRITE_BEHIND_QUEUE_SIZE", 1000))
+
     @property
     def base_backend_url(self) -> str:
         return self.get("BASE_BACKEND_URL")
@@ -48,6 +76,54 @@ class Config(LazyConfig):
     def base_parser_url(self) -> str:
         return self.get("BASE_PARSER_URL")
 
+    @property
+    def warmup_reload_seconds(self) -> int:
+        return int(self.get("WARMUP_RELOAD_SECONDS", 600))
+
+    @property
+    def batch_workers(self) -> int:
+        return int(self.get("BATCH_WORKERS", 8))
+
+    @property
+    def update_queue_url(self) -> Optional[str]:
+        return self.get("UPDATE_QUEUE_URL")
+
+    @property
+    def update_dedup_ttl_seconds(self) -> int:
+        return int(self.get("UPDATE_DEDUP_TTL_SECONDS", 3600))
+
+    @property
+    def update_claim_seconds(self) -> int:
+        return int(self.get("UPDATE_CLAIM_SECONDS", 60))
+
+    @property
+    def lazy_handlers(self) -> bool:
+        return self.get("LAZY_HANDLERS", False)
+
+    @property
+    def photo_min_resolution(self) -> Dict[str, int]:
+        return self.get("PHOTO_MIN_RESOLUTION", {})
+
+    @property
+    def photo_max_resolution(self) -> Dict[str, int]:
+        return self.get("PHOTO_MAX_RESOLUTION", {})
+
+    @property
+    def photo_grayscale(self) -> Dict[str, bool]:
+        return self.get("PHOTO_GRAYSCALE", {})
+
+    @property
+    def polling_workers(self) -> int:
+        return int(self.get("POLLING_WORKERS", 8))
+
+    @property
+    def parser_timeouts(self) -> Dict[str, float]:
+        return self.get("PARSER_TIMEOUTS", {})
+
+    @property
+    def parser_pool_size(self) -> int:
+        return int(self.get("PARSER_POOL_SIZE", 4))
+
     @property
     def bot_log_level(self) -> str:
         return self.get("BOT_LOG_LEVEL")
@@ -14,7 +14,7 @@ class ConfigDifficultyHandler(EventHandler):
         difficulty = parse_difficulty(text)
         self.update_game_config(difficulty=difficulty)
         keyword = build_models_keyboard(language=self.session.config.language)
-        self.send_text("🧠 Pick language model:", reply_markup=keyword)
+        self.send_keyboard("🧠 Pick language model:", reply_markup=keyword)
         return BotState.CONFIG_MODEL
 
 
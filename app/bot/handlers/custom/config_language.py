@@ -14,7 +14,7 @@ class ConfigLanguageHandler(EventHandler):
         language = parse_language(text)
         self.update_game_config(language=language)
         keyboard = build_solver_keyboard()
-        self.send_text("🧮 Pick solver:", reply_markup=keyboard)
+        self.send_keyboard("🧮 Pick solver:", reply_markup=keyboard)
         return BotState.CONFIG_SOLVER
 
 
@@ -21,7 +21,7 @@ class ConfigSolverHandler(EventHandler):
         if solver == Solver.GPT:
             return self.trigger(StartEventHandler)
         keyboard = build_difficulty_keyboard()
-        self.send_text("🥵 Pick difficulty:", reply_markup=keyboard)
+        self.send_keyboard("🥵 Pick difficulty:", reply_markup=keyboard)
         return BotState.CONFIG_DIFFICULTY
 
 
@@ -11,7 +11,7 @@ class CustomHandler(EventHandler):
         session = Session(config=game_config)
         self.set_session(session=session)
         keyboard = build_language_keyboard()
-        self.send_text("🌍 Pick language:", reply_markup=keyboard)
+        self.send_keyboard("🌍 Pick language:", reply_markup=keyboard)
         return BotState.CONFIG_LANGUAGE
 
 
@@ -22,7 +22,7 @@ class ProcessMessageHandler(EventHandler):
         self.remove_keyboard(last_keyboard_message_id=self.session.last_keyboard_message_id)
         if not self.session.is_game_active:
             return self.trigger(HelpMessageHandler)
-        state = self._get_game_state(game_id=self.game_id)
+        state = self.get_game_state()
         if state and not is_blue_operative_turn(state):
             return self.fast_forward(state)
         try:
@@ -46,6 +46,7 @@ class ProcessMessageHandler(EventHandler):
 
     def _guess(self, card_index: int) -> ClassicGuessResponse:
         assert self.game_id
+        self.forget_game_state()
         request = GuessRequest(game_id=self.game_id, card_index=card_index)
         return self.api_client.classic.guess(request)
 
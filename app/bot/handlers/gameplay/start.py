@@ -9,13 +9,13 @@ log = get_logger(__name__)
 
 class StartEventHandler(EventHandler):
     def handle(self):
-        log.update_context(username=self.username, full_name=self.user_full_name)
+        log.update_thread_context(username=self.username, full_name=self.user_full_name)
         log.info(f"Got start event from {self.user_full_name}")
         game_config = self.config or GameConfig()
         language = SupportedLanguage(game_config.language)
         request = ClassicStartGameRequest(language=language, first_team=game_config.first_team)
         response = self.api_client.classic.start_game(request)
-        log.update_context(game_id=response.game_id)
+        log.update_thread_context(game_id=response.game_id)
         log.debug("Game starting", extra={"game_id": response.game_id, "game_config": game_config.dict()})
         session = Session(game_id=response.game_id, config=game_config)
         self.set_session(session=session)
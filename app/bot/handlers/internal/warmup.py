@@ -1,21 +1,34 @@
 import logging
+import threading
 import time
+from collections import defaultdict, deque
 from concurrent.futures.thread import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import wraps
-from typing import TYPE_CHECKING, Dict, List
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterable, List
 
-import requests
 from bot.config import get_config
 from bot.handlers.other.event_handler import EventHandler
 from bot.models import AVAILABLE_MODELS
-from the_spymaster_solvers_api.structs import LoadModelsRequest, LoadModelsResponse
+from dynamo_persistence.persistence import DynamoPersistence
+from requests import Session
+from the_spymaster_solvers_api.structs import (
+    APIModelIdentifier,
+    LoadModelsRequest,
+    LoadModelsResponse,
+)
 
 if TYPE_CHECKING:
     from bot.the_spymaster_bot import TheSpymasterBot
 
 log = logging.getLogger(__name__)
 
+PARSER_LANGUAGES = ["heb", "eng"]
+WARMUP_WORKERS = 5
+HISTORY_SIZE = 20
+PRIME_TIMEOUT_SECONDS = 5
+WARMUP_ITEM_ID = "warmup::ping"
+
 
 @dataclass
 class WarmupTaskResult:
@@ -25,6 +38,7 @@ class WarmupTaskResult:
 
 
 WarmupResult = Dict[str, str]
+WarmupTask = Callable[["Warmup"], WarmupTaskResult]
 
 
 class WarmupHandler(EventHandler):
@@ -33,25 +47,58 @@ class WarmupHandler(EventHandler):
         sent_ts = self.update.message.date.timestamp()
         receive_delta = round(receive_ts - sent_ts, 3)
         self.send_markdown(f"Receive warmup command took `{receive_delta}` seconds")
-        results = handle_warmup(self.bot)
+        results = self.bot.warmup.run()
         self._send_results(results)
 
     def _send_results(self, results: List[WarmupTaskResult]):
+        history = self.bot.warmup.history
         message = "Warmup complete. Results:\n"
         for result in results:
+            durations = history[result.name]
+            average = round(sum(durations) / len(durations), 3)
             message += f"\n🐇 *{result.name}*: {result.message} in `{result.duration}` sec"
+            message += f" (average `{average}` sec over `{len(durations)}` runs)"
         self.send_markdown(message)
 
 
-def handle_warmup(bot: "TheSpymasterBot") -> List[WarmupTaskResult]:
-    worker = ThreadPoolExecutor(max_workers=5)
-    tasks = [
-        worker.submit(load_solvers_models, bot),
-        worker.submit(load_parser_languages, bot),
-    ]
-    worker.shutdown()
-    task_results = [task.result() for task in tasks]
-    return task_results
+class Warmup:
+    """
+    Runs the warmup tasks of a (warm) Lambda container. Tasks run on a persistent executor, remote resources that
+    were reported loaded are not loaded again for `warmup_reload_seconds`, and the durations of recent runs are kept.
+    """
+
+    def __init__(self, bot: "TheSpymasterBot"):
+        self.bot = bot
+        self._executor = ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup")
+        self._lock = threading.Lock()
+        # Remote resources (models and parser languages) by name, and the time they were reported loaded.
+        self._loaded_at: Dict[str, float] = {}
+        self._history: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+
+    @property
+    def history(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {name: list(durations) for name, durations in self._history.items()}
+
+    def run(self) -> List[WarmupTaskResult]:
+        futures = [self._executor.submit(task, self) for task in WARMUP_TASKS]
+        results = [future.result() for future in futures]
+        with self._lock:
+            for result in results:
+                self._history[result.name].append(result.duration)
+        return results
+
+    def get_cold(self, names: Iterable[str]) -> List[str]:
+        reload_seconds = get_config().warmup_reload_seconds
+        now = time.monotonic()
+        with self._lock:
+            return [name for name in names if now - self._loaded_at.get(name, -reload_seconds) >= reload_seconds]
+
+    def mark_loaded(self, names: Iterable[str]):
+        now = time.monotonic()
+        with self._lock:
+            for name in names:
+                self._loaded_at[name] = now
 
 
 def warmup_task(func):
@@ -71,29 +118,66 @@ def warmup_task(func):
 
 
 @warmup_task
-def load_solvers_models(bot: "TheSpymasterBot") -> str:
-    response = _send_load_models_request(bot)
+def load_solvers_models(warmup: Warmup) -> str:
+    models_by_name = {_model_name(model): model for model in AVAILABLE_MODELS}
+    cold_models = warmup.get_cold(models_by_name)
+    if not cold_models:
+        return f"All `{len(models_by_name)}` models are loaded"
+    response = _send_load_models_request(warmup.bot, models=[models_by_name[name] for name in cold_models])
+    if response.fail_count == 0:
+        warmup.mark_loaded(cold_models)
     return f"Loaded `{response.success_count}` models"
 
 
 @warmup_task
-def load_parser_languages(bot: "TheSpymasterBot") -> str:
-    languages = _send_load_languages_request()
+def load_parser_languages(warmup: Warmup) -> str:
+    cold_languages = warmup.get_cold(PARSER_LANGUAGES)
+    if not cold_languages:
+        return f"All `{len(PARSER_LANGUAGES)}` languages are loaded"
+    languages = warmup.bot.parser_client.load_languages(languages=cold_languages)
+    warmup.mark_loaded(languages)
     return f"Loaded `{len(languages)}` languages"
 
 
-def _send_load_languages_request() -> List[str]:
-    env_config = get_config()
-    url = f"{env_config.base_parser_url}/load-languages"
-    payload = {"languages": ["heb", "eng"]}
-    response = requests.put(url=url, json=payload, timeout=30)
-    response.raise_for_status()
-    response_json = response.json()
-    languages = response_json.get("loaded")
-    return languages
+@warmup_task
+def prime_connections(warmup: Warmup) -> str:
+    """
+    Open the pooled connections of the update hot path, so the next update does not pay for the handshakes.
+    """
+    bot = warmup.bot
+    # The API client's internals are not part of its interface, so they might be missing.
+    classic_client = getattr(bot.api_client, "classic", None)
+    session, base_url = getattr(classic_client, "session", None), getattr(classic_client, "base_url", None)
+    if session is not None and base_url is not None:
+        _prime_session(session=session, url=base_url)
+    else:
+        log.warning("API client session not found, skipping its connection")
+    _prime_session(session=bot.parser_client.session, url=bot.parser_client.base_url)
+    bot.dispatcher.bot.get_me(timeout=PRIME_TIMEOUT_SECONDS)
+    if isinstance(bot.persistence, DynamoPersistence):
+        bot.persistence.backend.get_version(WARMUP_ITEM_ID)
+    return "Primed connections"
+
+
+@warmup_task
+def import_handlers(warmup: Warmup) -> str:
+    count = warmup.bot.import_handlers()
+    return f"Imported `{count}` handlers"
+
+
+WARMUP_TASKS: List[WarmupTask] = [load_solvers_models, load_parser_languages, prime_connections, import_handlers]
+
+
+def _prime_session(session: Session, url: str):
+    # Any response will do, the connection is kept in the session pool.
+    session.head(url, timeout=PRIME_TIMEOUT_SECONDS)
+
+
+def _model_name(model: APIModelIdentifier) -> str:
+    return f"{model.language}/{model.model_name}"
 
 
-def _send_load_models_request(bot: "TheSpymasterBot") -> LoadModelsResponse:
-    request = LoadModelsRequest(model_identifiers=AVAILABLE_MODELS, load_default_models=False)
+def _send_load_models_request(bot: "TheSpymasterBot", models: List[APIModelIdentifier]) -> LoadModelsResponse:
+    request = LoadModelsRequest(model_identifiers=models, load_default_models=False)
     response = bot.api_client.load_models(request)
     return response
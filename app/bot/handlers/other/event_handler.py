@@ -1,14 +1,16 @@
 from collections import defaultdict
+from concurrent.futures import Future
+from functools import lru_cache, partial
 from random import random
-from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Type
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple, Type
 
 import sentry_sdk
-from beautifultable import BeautifulTable
 from bot.handlers.other.common import (
     enrich_sentry_context,
     get_given_guess_result_message_text,
     is_blue_operative_turn,
 )
+from bot.handlers.other.message_buffer import MARKDOWN, MessageBuffer
 from bot.models import (
     BLUE_EMOJI,
     COMMAND_TO_INDEX,
@@ -17,22 +19,25 @@ from bot.models import (
     BadMessageError,
     BotState,
     GameConfig,
+    GameStateSnapshot,
     ParsingState,
     Session,
 )
+from bot.send_pipeline import SendPriority, wait_for_sends
 from codenames.classic.board import ClassicBoard
 from codenames.classic.color import ClassicColor
 from codenames.classic.state import ClassicGameState
 from codenames.classic.team import ClassicTeam
 from codenames.classic.types import ClassicCard
+from codenames.generic.board import Board, two_integer_factors
 from codenames.generic.move import PASS_GUESS, Clue
 from codenames.generic.player import PlayerRole
 from requests import HTTPError
-from telegram import Message, ReplyKeyboardMarkup, Update
+from telegram import Bot, Message, ReplyKeyboardMarkup, ReplyMarkup, Update
 from telegram import User as TelegramUser
 from telegram.error import BadRequest as TelegramBadRequest
 from telegram.error import Unauthorized
-from telegram.ext import CallbackContext
+from telegram.ext import CallbackContext, ConversationHandler
 from the_spymaster_api import TheSpymasterClient
 from the_spymaster_api.structs import (
     APIGameRuleError,
@@ -48,12 +53,49 @@ if TYPE_CHECKING:
 
 log = get_logger(__name__)
 
+SEND_TIMEOUT_SECONDS = 30
+BOARD_KEYBOARD_CACHE_SIZE = 512
+# Session fields that follow changes committed by the backend, they are kept when a session is rolled back.
+BACKEND_SESSION_FIELDS = ("game_id", "move_count")
+
+BoardFingerprint = Tuple[Tuple[Tuple[str, str, bool], ...], bool]
+
 
 class NoneValueError(Exception):
     pass
 
 
+class SessionScope:
+    """
+    The session of a single update, shared by all the handlers it triggers.
+    Changes are written to the chat data once, when the update handling ends, and rolled back if it failed.
+    """
+
+    def __init__(self, session: Optional[Session]):
+        self.initial_session = session
+        self.session = session
+        self.is_dirty = False
+
+    def rollback(self):
+        """
+        Roll back local changes. Fields that follow the backend (e.g. the game started by the failed handler)
+        are kept, the backend already committed their changes.
+        """
+        session = self.initial_session
+        if self.session is not None:
+            backend_fields = {field: getattr(self.session, field) for field in BACKEND_SESSION_FIELDS}
+            session = session.model_copy(update=backend_fields) if session else Session(**backend_fields)
+        # The failed handler might have made a move, so a cached game state can't be trusted anymore.
+        if session and session.game_state:
+            session = session.model_copy(update={"game_state": None})
+        self.session = session
+        self.is_dirty = session != self.initial_session
+
+
 class EventHandler:
+    # Handlers of parsing steps, they can't run once the parsing state expired.
+    requires_parsing_state = False
+
     def __init__(
         self,
         bot: "TheSpymasterBot",
@@ -61,12 +103,19 @@ class EventHandler:
         context: CallbackContext,
         chat_id: Optional[int],
         session: Optional[Session],
+        message_buffer: Optional[MessageBuffer] = None,
+        session_scope: Optional[SessionScope] = None,
     ):
         self.bot = bot
         self.update = update
         self.context = context
         self.chat_id = chat_id
-        self.session = session
+        self.session_scope = session_scope or SessionScope(session=session)
+        self.message_buffer = message_buffer or MessageBuffer()
+
+    @property
+    def session(self) -> Optional[Session]:
+        return self.session_scope.session
 
     @property
     def api_client(self) -> TheSpymasterClient:
@@ -114,26 +163,26 @@ class EventHandler:
     def generate_callback(cls, bot: "TheSpymasterBot") -> Callable[[Update, CallbackContext], Any]:
         def callback(update: Update, context: CallbackContext) -> Any:
             chat_id = update.effective_chat.id if update.effective_chat else None
-            session_data = context.chat_data
-            try:
-                session = Session(**session_data) if session_data else None
-            except Exception as e:
-                log.warning(f"Failed to parse session {session_data}: {e}")
-                session = None
+            session = bot.load_session(chat_id=chat_id, chat_data=context.chat_data)
             instance = cls(bot=bot, update=update, context=context, chat_id=chat_id, session=session)
             handler_name = cls.__name__
             try:
                 game_id = session.game_id if session else None
-                log.update_context(telegram_user_id=instance.user_id, game_id=game_id, handler=handler_name)
+                log.update_thread_context(telegram_user_id=instance.user_id, game_id=game_id, handler=handler_name)
             except Exception as e:
                 log.warning(f"Failed to update context: {e}")
             try:
                 log.debug(f"Dispatching to event handler: {handler_name}")
+                if cls.requires_parsing_state and not (session and session.parsing_state):
+                    return instance.end_expired_parsing()
                 return instance.handle()
             except Exception as e:
+                instance.session_scope.rollback()
                 instance.on_error(e)
             finally:
-                log.reset_context()
+                instance.commit_session()
+                instance.flush_messages_safe()
+                log.reset_thread_context()
             return None
 
         return callback
@@ -141,18 +190,27 @@ class EventHandler:
     def set_session(self, session: Optional[Session]) -> Optional[Session]:
         if not self.chat_id:
             raise NoneValueError("chat_id is not set, cannot set session.")
-        chat_data = session.dict() if session else None
-        self.session = session
-        self.bot.dispatcher.chat_data[self.chat_id] = chat_data
+        self.session_scope.session = session
+        self.session_scope.is_dirty = True
         return session
 
+    def commit_session(self):
+        """
+        Write the final session of the update to the chat data (which is persisted by the dispatcher).
+        """
+        if not self.session_scope.is_dirty or not self.chat_id:
+            return
+        chat_data = self.bot.session_cache.dump(chat_id=self.chat_id, session=self.session)
+        self.bot.dispatcher.chat_data[self.chat_id] = chat_data
+        self.session_scope.is_dirty = False
+
     def reset_session(self) -> None:
         self.set_session(session=None)
 
     def update_session(self, **kwargs) -> Session:
         if self.session is None:
             raise NoneValueError("session is not set, cannot update session.")
-        new_session = self.session.copy(update=kwargs)
+        new_session = self.session.model_copy(update=kwargs)
         self.set_session(new_session)
         return new_session
 
@@ -160,14 +218,23 @@ class EventHandler:
         old_config = self.config
         if not old_config:
             raise NoneValueError("session is not set, cannot update game config.")
-        new_config = old_config.copy(update=kwargs)
+        new_config = old_config.model_copy(update=kwargs)
         return self.update_session(config=new_config)
 
+    def end_expired_parsing(self) -> int:
+        """
+        Parsing data expires sooner than the conversation state (see `persistence_ttl_seconds`), so a chat might
+        return to a parsing step without its parsing state. The conversation is ended, so the user can start over.
+        """
+        log.info("Parsing state expired, ending conversation")
+        self.send_text("⌛ Your board parsing session has expired, send /parse to start over.")
+        return ConversationHandler.END
+
     def update_parsing_state(self, **kwargs) -> ParsingState:
         old_parsing_state = self.parsing_state
         if not old_parsing_state:
             raise NoneValueError("parsing state is not set, cannot update parsing state.")
-        new_parsing_state = old_parsing_state.copy(update=kwargs)
+        new_parsing_state = old_parsing_state.model_copy(update=kwargs)
         self.update_session(parsing_state=new_parsing_state)
         return new_parsing_state
 
@@ -181,25 +248,74 @@ class EventHandler:
             context=self.context,
             chat_id=self.chat_id,
             session=self.session,
+            message_buffer=self.message_buffer,
+            session_scope=self.session_scope,
         ).handle()
 
-    def send_text(self, text: str, put_log: bool = False, **kwargs) -> Message:
+    def send_text(self, text: str, put_log: bool = False, parse_mode: Optional[str] = None) -> None:
+        """
+        Plain messages are buffered, and sent (merged) before the next keyboard message or when the handler ends.
+        """
         if put_log:
             log.info(text)
-        return self.context.bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
+        self.message_buffer.add(text=text, parse_mode=parse_mode)
+
+    def send_markdown(self, text: str, put_log: bool = False) -> None:
+        self.send_text(text=text, put_log=put_log, parse_mode=MARKDOWN)
+
+    def send_keyboard(self, text: str, reply_markup: ReplyMarkup, parse_mode: Optional[str] = None) -> Message:
+        """
+        Blocks until the message is sent (after all previous messages), since its id is usually needed.
+        """
+        self.flush_messages()
+        future = self._submit_send(
+            partial(
+                self.context.bot.send_message,
+                chat_id=self.chat_id,
+                text=text,
+                parse_mode=parse_mode,
+                reply_markup=reply_markup,
+            ),
+            priority=SendPriority.INTERACTIVE,
+        )
+        return future.result(timeout=self.bot.send_pipeline.get_wait_timeout(SEND_TIMEOUT_SECONDS))
+
+    def flush_messages(self):
+        """
+        Submit all buffered messages to the send pipeline, without waiting for them to be sent.
+        """
+        for message in self.message_buffer.drain():
+            send = partial(
+                self.context.bot.send_message, chat_id=self.chat_id, text=message.text, parse_mode=message.parse_mode
+            )
+            self.message_buffer.pending_sends.append(self._submit_send(send))
+
+    def flush_messages_safe(self):
+        """
+        Called when the handler ends. Waits for all pending sends, so no message is lost when a lambda run ends.
+        """
+        try:
+            self.flush_messages()
+        except Exception as e:
+            log.warning(f"Failed to send buffered messages: {e}")
+        pending_sends, self.message_buffer.pending_sends = self.message_buffer.pending_sends, []
+        timeout = self.bot.send_pipeline.get_wait_timeout(SEND_TIMEOUT_SECONDS)
+        for error in wait_for_sends(pending_sends, timeout=timeout):
+            log.warning(f"Failed to send message: {error}")
 
-    def send_markdown(self, text: str, **kwargs) -> Message:
-        return self.send_text(text=text, parse_mode="Markdown", **kwargs)
+    def _submit_send(self, send: Callable[[], Any], priority: SendPriority = SendPriority.INFORMATIONAL) -> Future:
+        return self.bot.send_pipeline.submit(chat_id=self.chat_id, send=send, priority=priority)
 
     def fast_forward(self, state: ClassicGameState):
         if not state:
             raise NoneValueError("state is not set, cannot fast forward.")
         while not state.is_game_over and not is_blue_operative_turn(state=state):
             state = self._next_move(state=state)
+        self.remember_game_state(state=state)
         self.send_board(state=state)
         if state.is_game_over:
             self.send_game_summary(state=state)
-            log.update_context(game_id=None)
+            log.update_thread_context(game_id=None)
             self.reset_session()
             from bot.handlers.other.help import HelpMessageHandler
 
@@ -211,10 +327,10 @@ class EventHandler:
         if last_keyboard_message_id is None:
             return
         log.debug("Removing keyboard")
-        try:
-            self.context.bot.edit_message_reply_markup(chat_id=self.chat_id, message_id=last_keyboard_message_id)
-        except TelegramBadRequest:
-            pass
+        send = partial(
+            _remove_reply_markup, bot=self.context.bot, chat_id=self.chat_id, message_id=last_keyboard_message_id
+        )
+        self.message_buffer.pending_sends.append(self._submit_send(send))
         self.update_session(last_keyboard_message_id=None)
 
     def send_game_summary(self, state: ClassicGameState):
@@ -247,9 +363,12 @@ class EventHandler:
         team = state.current_team.value.title()
         game_id = self.game_id
         assert game_id
+        self.forget_game_state()
         if state.current_player_role == PlayerRole.SPYMASTER:
             self.send_score(state=state)
             self.send_text(f"{team} spymaster is thinking... 🤔")
+            # Let the user know before waiting for the solver.
+            self.flush_messages()
         if _should_skip_turn(current_player_role=state.current_player_role, config=self.config):
             self.send_text(f"{team} operative has skipped the turn.")
             guess_request = GuessRequest(game_id=game_id, card_index=PASS_GUESS)
@@ -275,20 +394,58 @@ class EventHandler:
         self.send_markdown(text)
 
     def send_board(self, state: ClassicGameState, message: Optional[str] = None):
-        board_to_send = state.board if state.is_game_over else state.board.censored
-        table = board_to_send.as_table
-        keyboard = build_board_keyboard(table, is_game_over=state.is_game_over)
+        keyboard = build_board_keyboard(board=state.board, is_game_over=state.is_game_over)
         if message is None:
             message = "Game over!" if state.is_game_over else "Pick your guess!"
         if state.left_guesses == 1:
             message += " (bonus round)"
-        text = self.send_markdown(message, reply_markup=keyboard)
+        text = self.send_keyboard(message, reply_markup=keyboard, parse_mode=MARKDOWN)
         self.update_session(last_keyboard_message_id=text.message_id)
 
+    def get_game_state(self) -> ClassicGameState:
+        """
+        The last known game state, fetched from the backend only if it is missing (or can't be parsed).
+        """
+        if not self.game_id:
+            raise NoneValueError("game_id is not set, cannot get game state.")
+        cached_state = self._load_game_state()
+        if cached_state:
+            log.debug("Using cached game state")
+            return cached_state
+        state = self._get_game_state(game_id=self.game_id)
+        self.remember_game_state(state=state)
+        return state
+
+    def remember_game_state(self, state: ClassicGameState):
+        if not self.session or not self.game_id or state.is_game_over:
+            return
+        snapshot = GameStateSnapshot.from_state(state=state, game_id=self.game_id, move_count=self.session.move_count)
+        self.update_session(game_state=snapshot)
+
+    def forget_game_state(self):
+        """
+        Should be called before any move. Advances the move counter, so a snapshot of an earlier move is never used
+        (even if a failed handler left it behind).
+        """
+        if self.session:
+            self.update_session(game_state=None, move_count=self.session.move_count + 1)
+
+    def _load_game_state(self) -> Optional[ClassicGameState]:
+        snapshot = self.session.game_state if self.session else None
+        if not self.session or not snapshot:
+            return None
+        if snapshot.game_id != self.game_id or snapshot.move_count != self.session.move_count:
+            log.debug("Cached game state is stale", extra={"move_count": snapshot.move_count})
+            return None
+        try:
+            return snapshot.to_state()
+        except Exception as e:
+            log.warning(f"Failed to parse cached game state: {e}")
+            return None
+
     def _get_game_state(self, game_id: str) -> ClassicGameState:
         request = GetGameStateRequest(game_id=game_id)
         return self.api_client.classic.get_game_state(request=request).game_state
-        # self.set_state(new_state=response.game_state)
 
     def on_error(self, error: Exception):
         log.debug(f"Handling error: {error}")
@@ -372,16 +529,23 @@ class EventHandler:
 
     def send_parsing_state(self):
         parsed_board = self.parsed_board()
-        keyboard = build_board_keyboard(table=parsed_board.as_table, is_game_over=True)
+        keyboard = build_board_keyboard(board=parsed_board, is_game_over=True)
         color_stats = _get_color_stats(board=parsed_board)
         color_stats_str = "  ".join(rf"\[{count} {color.emoji}]" for color, count in color_stats.items())
         message = f"""OK! Here's the board.
 Color stats: {color_stats_str}
 Click on any card to fix it. When you are done, click /done."""
-        text = self.send_markdown(text=message, reply_markup=keyboard)
+        text = self.send_keyboard(text=message, reply_markup=keyboard, parse_mode=MARKDOWN)
         self.update_session(last_keyboard_message_id=text.message_id)
 
 
+def _remove_reply_markup(bot: Bot, chat_id: Optional[int], message_id: int):
+    try:
+        bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id)
+    except TelegramBadRequest:
+        pass
+
+
 def _get_color_stats(board: ClassicBoard) -> Dict[ClassicColor | None, int]:
     stats: Dict[ClassicColor | None, int] = defaultdict(int)
     for card in board.cards:
@@ -398,18 +562,40 @@ def _should_skip_turn(current_player_role: PlayerRole, config: GameConfig) -> bo
     return dice < pass_probability
 
 
-def build_board_keyboard(table: BeautifulTable, is_game_over: bool) -> ReplyKeyboardMarkup:
-    reply_keyboard = []
-    for row in table.rows:
-        row_keyboard = []
-        for card in row:
-            card: ClassicCard  # type: ignore
-            if is_game_over:
-                content = f"{card.color.emoji} {card.word}"
-            else:
-                content = card.color.emoji if card.revealed else card.word
-            row_keyboard.append(content)
-        reply_keyboard.append(row_keyboard)
+def build_board_keyboard(board: Board[ClassicColor], is_game_over: bool) -> ReplyKeyboardMarkup:
+    """
+    Colors of unrevealed cards are shown only when the game is over, so the board does not need to be censored.
+    """
+    return _build_board_keyboard(fingerprint=_board_fingerprint(board=board, is_game_over=is_game_over))
+
+
+def _board_fingerprint(board: Board[ClassicColor], is_game_over: bool) -> BoardFingerprint:
+    cards = tuple(
+        (card.word, _card_emoji(color=card.color) if is_game_over or card.revealed else "", card.revealed)
+        for card in board.cards
+    )
+    return cards, is_game_over
+
+
+def _card_emoji(color: Optional[ClassicColor]) -> str:
+    # The color of a hidden card is unknown.
+    if color is None:
+        return ""
+    return color.emoji
+
+
+@lru_cache(maxsize=BOARD_KEYBOARD_CACHE_SIZE)
+def _build_board_keyboard(fingerprint: BoardFingerprint) -> ReplyKeyboardMarkup:
+    cards, is_game_over = fingerprint
+    buttons = []
+    for word, emoji, revealed in cards:
+        if is_game_over:
+            buttons.append(f"{emoji} {word}" if emoji else word)
+        else:
+            buttons.append(emoji if revealed else word)
+    # Same layout as `Board.as_table`.
+    row_size, _ = two_integer_factors(len(buttons))
+    reply_keyboard = [buttons[i : i + row_size] for i in range(0, len(buttons), row_size or 1)]
     reply_keyboard.append(list(COMMAND_TO_INDEX.keys()))
     return ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True)
 
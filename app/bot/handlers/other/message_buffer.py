@@ -0,0 +1,58 @@
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import List, Optional
+
+from telegram.constants import MAX_MESSAGE_LENGTH
+from telegram.utils.helpers import escape_markdown
+
+MARKDOWN = "Markdown"
+
+
+@dataclass
+class BufferedMessage:
+    text: str
+    parse_mode: Optional[str] = None
+
+
+class MessageBuffer:
+    """
+    Collects outgoing text messages, so adjacent messages can be sent as a single Telegram message.
+    Also tracks the sends that were submitted to the `SendPipeline` and did not complete yet.
+    """
+
+    def __init__(self):
+        self.messages: List[BufferedMessage] = []
+        self.pending_sends: List[Future] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.messages)
+
+    def add(self, text: str, parse_mode: Optional[str] = None):
+        self.messages.append(BufferedMessage(text=text, parse_mode=parse_mode))
+
+    def drain(self) -> List[BufferedMessage]:
+        """
+        Merge all buffered messages (as few as possible, within Telegram's message length limit) and clear the buffer.
+        Plain messages merged with Markdown ones are escaped, other parse modes are never merged.
+        """
+        merged: List[BufferedMessage] = []
+        for message in self.messages:
+            last = merged[-1] if merged else None
+            combined = _combine(last, message) if last else None
+            if combined and len(combined.text) <= MAX_MESSAGE_LENGTH:
+                merged[-1] = combined
+            else:
+                merged.append(message)
+        self.messages = []
+        return merged
+
+
+def _combine(first: BufferedMessage, second: BufferedMessage) -> Optional[BufferedMessage]:
+    if first.parse_mode == second.parse_mode:
+        return BufferedMessage(text=f"{first.text}\n{second.text}", parse_mode=first.parse_mode)
+    modes = {first.parse_mode, second.parse_mode}
+    if modes != {None, MARKDOWN}:
+        return None
+    first_text = first.text if first.parse_mode else escape_markdown(first.text)
+    second_text = second.text if second.parse_mode else escape_markdown(second.text)
+    return BufferedMessage(text=f"{first_text}\n{second_text}", parse_mode=MARKDOWN)
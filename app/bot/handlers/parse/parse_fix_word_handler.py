@@ -5,6 +5,8 @@ from bot.models import BotState
 
 
 class ParseFixWordHandler(EventHandler):
+    requires_parsing_state = True
+
     def handle(self):
         text = self.update.message.text.lower().strip()
         parsing_state = self.parsing_state
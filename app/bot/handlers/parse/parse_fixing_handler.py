@@ -6,6 +6,8 @@ from bot.models import BotState
 
 
 class ParseFixesHandler(EventHandler):
+    requires_parsing_state = True
+
     def handle(self):
         text = self.update.message.text.lower().strip()
         if text == "/done":
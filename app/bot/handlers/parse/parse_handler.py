@@ -1,4 +1,5 @@
 from bot.handlers.other.event_handler import EventHandler
+from bot.handlers.other.message_buffer import MARKDOWN
 from bot.models import BotState, ParsingState, Session
 from telegram import ReplyKeyboardMarkup
 from the_spymaster_util.logger import get_logger
@@ -19,7 +20,7 @@ class ParseHandler(EventHandler):
         self.set_session(session=session)
         # Language selection
         keyboard = _build_language_options_keyboard()
-        self.send_markdown("🔤 Pick cards language:", reply_markup=keyboard)
+        self.send_keyboard("🔤 Pick cards language:", reply_markup=keyboard, parse_mode=MARKDOWN)
         return BotState.PARSE_LANGUAGE
 
 
@@ -6,6 +6,8 @@ from bot.models import BotState
 
 
 class ParseLanguageHandler(EventHandler):
+    requires_parsing_state = True
+
     def handle(self):
         text = self.update.message.text.lower()
         language_code = _get_language_code(text)
@@ -1,17 +1,19 @@
-import requests
-from bot.config import get_config
 from bot.handlers.other.event_handler import EventHandler
 from bot.handlers.parse.photos import _get_base64_photo
 from bot.models import BotState
+from bot.parser_client import PARSE_COLOR_MAP_ENDPOINT
 from codenames.classic.color import ClassicColor
 
 # Map -> Board
 
 
 class ParseMapHandler(EventHandler):
+    requires_parsing_state = True
+
     def handle(self):
-        photo_base64 = _get_base64_photo(photos=self.update.message.photo)
-        card_colors = _parse_map_colors(photo_base64)
+        photo_base64 = _get_base64_photo(photos=self.update.message.photo, endpoint=PARSE_COLOR_MAP_ENDPOINT)
+        map_colors = self.bot.parser_client.parse_color_map(photo_base64=photo_base64)
+        card_colors = [ClassicColor(color) for color in map_colors]
         table = self._as_emoji_table(card_colors)
         self.update_parsing_state(card_colors=card_colors)
         # Board parsing
@@ -31,15 +33,3 @@ You will have a chance to fix any mistakes later.
             row_emojis = " ".join(card.emoji for card in row)
             result += f"{row_emojis}\n"
         return result
-
-
-def _parse_map_colors(photo_base64: str) -> list[ClassicColor]:
-    env_config = get_config()
-    url = f"{env_config.base_parser_url}/parse-color-map"
-    payload = {"map_image_b64": photo_base64}
-    response = requests.get(url=url, json=payload, timeout=15)
-    response.raise_for_status()
-    response_json = response.json()
-    map_colors = response_json.get("map_colors")
-    card_colors = [ClassicColor(color) for color in map_colors]
-    return card_colors
@@ -1,21 +1,76 @@
 import base64
+import io
+from typing import Optional
 
+from bot.config import get_config
 from bot.handlers.parse.parse_handler import log
 from bot.models import BadMessageError
+from PIL import Image
 from telegram import PhotoSize
 
+JPEG_QUALITY = 90
 
-def _get_base64_photo(photos: list[PhotoSize]) -> str:
+
+def _get_base64_photo(photos: list[PhotoSize], endpoint: str) -> str:
+    """
+    Download the smallest photo size that meets the parser endpoint's resolution floor (see `photo_min_resolution`),
+    optionally downscale it or convert it to grayscale, and encode it.
+    """
     if not photos:
         raise BadMessageError("No photo found in message")
-    log.info(f"Got {len(photos)} photos, downloading the largest one")
-    photo_meta = _pick_largest_photo(photos)
+    config = get_config()
+    min_resolution = config.photo_min_resolution.get(endpoint, 0)
+    photo_meta = _pick_photo(photos, min_resolution=min_resolution)
+    log.info(f"Got {len(photos)} photos, downloading a {photo_meta.width}x{photo_meta.height} one")
     photo_ptr = photo_meta.get_file()
-    photo_bytes = photo_ptr.download_as_bytearray()
+    photo_bytes = bytes(photo_ptr.download_as_bytearray())
+    photo_bytes = _preprocess_photo(
+        photo_bytes,
+        max_resolution=config.photo_max_resolution.get(endpoint),
+        grayscale=config.photo_grayscale.get(endpoint, False),
+    )
     photo_base64 = base64.b64encode(photo_bytes).decode("utf-8")
-    log.info("Downloaded and encoded photo")
+    largest_size = _pick_largest_photo(photos).file_size
+    bytes_saved = largest_size - len(photo_bytes) if largest_size else None
+    log.info(
+        "Downloaded and encoded photo",
+        extra={"endpoint": endpoint, "photo_size": len(photo_bytes), "bytes_saved": bytes_saved},
+    )
     return photo_base64
 
 
+def _pick_photo(photos: list[PhotoSize], min_resolution: int) -> PhotoSize:
+    """
+    Pick the smallest photo whose longer side is at least `min_resolution`, or the largest one if none is.
+    """
+    large_enough = [photo for photo in photos if max(photo.width, photo.height) >= min_resolution]
+    if not large_enough:
+        return _pick_largest_photo(photos)
+    return min(large_enough, key=_resolution)
+
+
 def _pick_largest_photo(photos: list[PhotoSize]) -> PhotoSize:
-    return max(photos, key=lambda photo: photo.file_size)
+    return max(photos, key=_resolution)
+
+
+def _resolution(photo: PhotoSize) -> int:
+    return photo.width * photo.height
+
+
+def _preprocess_photo(photo_bytes: bytes, max_resolution: Optional[int], grayscale: bool) -> bytes:
+    """
+    Downscale the photo so its longer side is at most `max_resolution`, and convert it to grayscale if requested.
+    The original is kept if the result is not smaller.
+    """
+    if not max_resolution and not grayscale:
+        return photo_bytes
+    with Image.open(io.BytesIO(photo_bytes)) as image:
+        if max_resolution and max(image.size) <= max_resolution and not grayscale:
+            return photo_bytes
+        processed = image.convert("L") if grayscale else image.convert("RGB")
+        if max_resolution:
+            processed.thumbnail((max_resolution, max_resolution))
+        output = io.BytesIO()
+        processed.save(output, format="JPEG", quality=JPEG_QUALITY)
+    processed_bytes = output.getvalue()
+    return processed_bytes if len(processed_bytes) < len(photo_bytes) else photo_bytes
@@ -1,11 +1,15 @@
-from enum import IntEnum
 from typing import List, Optional
 
+from bot.states import BotState  # noqa: F401
+from codenames.classic.board import ClassicBoard
 from codenames.classic.color import ClassicColor
+from codenames.classic.score import Score
+from codenames.classic.state import ClassicGameState
 from codenames.classic.team import ClassicTeam
 from codenames.classic.winner import WinningReason
 from codenames.generic.move import PASS_GUESS, QUIT_GAME
-from pydantic import BaseModel
+from codenames.generic.player import PlayerRole
+from pydantic import BaseModel, field_validator
 from the_spymaster_solvers_api.structs import APIModelIdentifier, Difficulty, Solver
 
 BLUE_EMOJI = ClassicColor.BLUE.emoji
@@ -15,6 +19,8 @@ WIN_REASON_TO_EMOJI = {
     WinningReason.OPPONENT_HIT_ASSASSIN: "😵",
     WinningReason.OPPONENT_QUIT: "🥴",
 }
+# Bump when `GameStateSnapshot` changes, snapshots of other versions are dropped (and the state is fetched again).
+GAME_STATE_SNAPSHOT_VERSION = 1
 COMMAND_TO_INDEX = {"-pass": PASS_GUESS, "-quit": QUIT_GAME}
 AVAILABLE_MODELS = [
     APIModelIdentifier(language="english", model_name="wiki-50", is_stemmed=False),
@@ -33,23 +39,6 @@ class BadMessageError(Exception):
     pass
 
 
-class BotState(IntEnum):
-    PLAYING = 30
-    # Config
-    CONFIG_LANGUAGE = 10
-    CONFIG_SOLVER = 11
-    CONFIG_DIFFICULTY = 12
-    CONFIG_MODEL = 13
-    # Parsing
-    PARSE_LANGUAGE = 40
-    PARSE_MAP = 41
-    PARSE_BOARD = 42
-    PARSE_FIXES = 43
-    PARSE_FIX = 44
-    # Other
-    CONTINUE_GET_ID = 20
-
-
 class GameConfig(BaseModel):  # Move to backend api?
     language: str = "english"
     difficulty: Difficulty = Difficulty.EASY
@@ -68,15 +57,66 @@ class ParsingState(BaseModel):
     fix_index: Optional[int] = None
 
 
+class GameStateSnapshot(BaseModel):
+    """
+    The parts of the last known `ClassicGameState` that handlers read between moves.
+    Taken at move `move_count` of game `game_id`, and only valid while the session is still at that move.
+    """
+
+    version: int = GAME_STATE_SNAPSHOT_VERSION
+    game_id: str
+    move_count: int
+    # Kept as JSON, only parsed when the snapshot is used.
+    board: dict
+    score: dict
+    current_team: ClassicTeam
+    current_player_role: PlayerRole
+    left_guesses: int
+
+    class Config:
+        frozen = True
+
+    @classmethod
+    def from_state(cls, state: ClassicGameState, game_id: str, move_count: int) -> "GameStateSnapshot":
+        return cls(
+            game_id=game_id,
+            move_count=move_count,
+            board=state.board.model_dump(mode="json"),
+            score=state.score.model_dump(mode="json"),
+            current_team=state.current_team,
+            current_player_role=state.current_player_role,
+            left_guesses=state.left_guesses,
+        )
+
+    def to_state(self) -> ClassicGameState:
+        return ClassicGameState(
+            board=ClassicBoard.model_validate(self.board),
+            score=Score.model_validate(self.score),
+            current_team=self.current_team,
+            current_player_role=self.current_player_role,
+            left_guesses=self.left_guesses,
+        )
+
+
 class Session(BaseModel):
     game_id: Optional[str] = None
     config: Optional[GameConfig] = None
     parsing_state: Optional[ParsingState] = None
     last_keyboard_message_id: Optional[int] = None
+    # Moves made in the current game, advanced before every move.
+    move_count: int = 0
+    game_state: Optional[GameStateSnapshot] = None
 
     class Config:
         frozen = True
 
+    @field_validator("game_state", mode="before")
+    @classmethod
+    def _drop_outdated_game_state(cls, value):
+        if isinstance(value, dict) and value.get("version") != GAME_STATE_SNAPSHOT_VERSION:
+            return None
+        return value
+
     @property
     def is_game_active(self) -> bool:
         return self.game_id is not None
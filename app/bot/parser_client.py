@@ -0,0 +1,63 @@
+from typing import Callable, Dict, List, Optional
+
+from requests.adapters import HTTPAdapter
+from the_spymaster_util.http.client import HTTPClient
+from urllib3 import Retry
+
+PARSE_BOARD_ENDPOINT = "parse-board"
+PARSE_COLOR_MAP_ENDPOINT = "parse-color-map"
+LOAD_LANGUAGES_ENDPOINT = "load-languages"
+DEFAULT_TIMEOUTS = {PARSE_BOARD_ENDPOINT: 80, PARSE_COLOR_MAP_ENDPOINT: 15, LOAD_LANGUAGES_ENDPOINT: 30}
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 4
+# All parser endpoints are idempotent. Read timeouts are not retried, since parsing may take long.
+PARSER_RETRY_STRATEGY = Retry(
+    raise_on_status=False,
+    total=2,
+    read=0,
+    backoff_factor=0.3,
+    status_forcelist=[502, 503, 504],
+    allowed_methods=["GET", "PUT"],
+)
+
+
+class ParserClient(HTTPClient):
+    """
+    Client of the board parser service. Connections are pooled (and kept alive across warm lambda invocations),
+    so only the first call pays for the TCP and TLS handshakes.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeouts: Optional[Dict[str, float]] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+    ):
+        self.pool_size = pool_size
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        super().__init__(base_url=base_url, retry_strategy=PARSER_RETRY_STRATEGY)
+
+    def set_retry_strategy(self, retry_strategy: Optional[Retry]):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry_strategy)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def parse_board(self, photo_base64: str, language: str) -> List[str]:
+        payload = {"board_image_b64": photo_base64, "language": language}
+        response = self._call(endpoint=PARSE_BOARD_ENDPOINT, method=self.session.get, payload=payload)
+        return response["words"]
+
+    def parse_color_map(self, photo_base64: str) -> List[str]:
+        payload = {"map_image_b64": photo_base64}
+        response = self._call(endpoint=PARSE_COLOR_MAP_ENDPOINT, method=self.session.get, payload=payload)
+        return response["map_colors"]
+
+    def load_languages(self, languages: List[str]) -> List[str]:
+        payload = {"languages": languages}
+        response = self._call(endpoint=LOAD_LANGUAGES_ENDPOINT, method=self.session.put, payload=payload)
+        return response["loaded"]
+
+    def _call(self, endpoint: str, method: Callable, payload: dict) -> dict:
+        timeout = self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+        # Payloads contain whole images, so they are not logged.
+        return self._http_call(endpoint=endpoint, method=method, json=payload, timeout=timeout, log_http_data=False)
@@ -0,0 +1,107 @@
+import threading
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from dynamo_persistence.persistent_store import ConversationKey
+from the_spymaster_util.logger import get_logger
+
+log = get_logger(__name__)
+
+# Raw update fields (as sent by Telegram) which contain a "chat" and a "from" object.
+CHAT_UPDATE_TYPES = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+# All handlers are message handlers, reacting to text (and commands), or to board photos while parsing.
+HANDLED_UPDATE_TYPE = "message"
+HANDLED_MESSAGE_CONTENT = ("text", "photo")
+UNSUPPORTED_CONTENT = "unsupported_content"
+
+
+def get_chat_id(update: dict) -> Optional[int]:
+    """
+    Extract the effective chat id from a raw update dict, without constructing an `Update` object.
+    """
+    for update_type in CHAT_UPDATE_TYPES:
+        payload = update.get(update_type)
+        if payload:
+            return _get_id(payload.get("chat"))
+    callback_query = update.get("callback_query")
+    if callback_query:
+        return _get_id(callback_query.get("message", {}).get("chat"))
+    return None
+
+
+def get_user_id(update: dict) -> Optional[int]:
+    """
+    Extract the effective user id from a raw update dict, without constructing an `Update` object.
+    """
+    for update_type in (*CHAT_UPDATE_TYPES, "callback_query", "inline_query", "chosen_inline_result"):
+        payload = update.get(update_type)
+        if payload:
+            return _get_id(payload.get("from"))
+    return None
+
+
+def get_conversation_key(update: dict) -> Optional[ConversationKey]:
+    """
+    Build the key `ConversationHandler` (with per_chat=True, per_user=True) uses for this update.
+    """
+    chat_id = get_chat_id(update)
+    if chat_id is None:
+        return None
+    user_id = get_user_id(update)
+    key: Tuple[int, ...] = (chat_id,) if user_id is None else (chat_id, user_id)
+    return key
+
+
+def get_ignore_reason(update: dict) -> Optional[str]:
+    """
+    Return why no handler would handle this raw update (without constructing an `Update` object),
+    or `None` if some handler might.
+    """
+    if "action" in update:
+        # Internal actions (e.g. warmup) are not Telegram updates.
+        return None
+    message = update.get(HANDLED_UPDATE_TYPE)
+    if not message:
+        return next((key for key in update if key != "update_id"), "empty")
+    if not any(content in message for content in HANDLED_MESSAGE_CONTENT):
+        return UNSUPPORTED_CONTENT
+    return None
+
+
+class UpdateFilter:
+    """
+    Drops updates no handler would handle before they are parsed or touch persistence, and counts them by reason.
+    """
+
+    def __init__(self):
+        self._ignored_counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def ignored_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._ignored_counts)
+
+    def should_ignore(self, update: dict) -> bool:
+        reason = get_ignore_reason(update)
+        if reason is None:
+            return False
+        with self._lock:
+            self._ignored_counts[reason] += 1
+            count = self._ignored_counts[reason]
+        log.debug("Ignoring update", extra={"update_id": update.get("update_id"), "reason": reason, "count": count})
+        return True
+
+
+def _get_id(obj: Optional[dict]) -> Optional[int]:
+    if not obj:
+        return None
+    return obj.get("id")
@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, List, Optional
+
+from cachetools import TTLCache
+from telegram.error import RetryAfter
+from the_spymaster_util.logger import get_logger
+
+log = get_logger(__name__)
+
+Send = Callable[[], Any]
+
+# Telegram limits: about 30 messages per second overall, and about 1 message per second in a single chat.
+# Short bursts are allowed (up to 20 messages per minute even in groups), so a single turn is never throttled,
+# only chats that keep sending over the limit are.
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+CHAT_RATE = 1
+CHAT_BURST = 20
+# Global tokens only interactive sends may use, so they are not starved by informational ones under load.
+INTERACTIVE_RESERVE = 5
+MAX_RETRY_AFTER_ATTEMPTS = 5
+MAX_TRACKED_CHATS = 10_000
+# Time kept after the last send before the deadline, for the rest of the update handling.
+DEADLINE_MARGIN_SECONDS = 2
+
+
+class SendDeadlineExceeded(Exception):
+    pass
+
+
+class SendPriority(IntEnum):
+    INTERACTIVE = 0
+    INFORMATIONAL = 1
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def try_acquire(self, reserve: float = 0) -> float:
+        """
+        Take a token if more than `reserve` tokens are left.
+        Returns 0 if a token was taken, otherwise the number of seconds to wait before trying again.
+        """
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1 + reserve:
+            self.tokens -= 1
+            return 0
+        return (1 + reserve - self.tokens) / self.rate
+
+    def release(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+@dataclass
+class OutboundSend:
+    send: Send
+    future: Future
+    priority: SendPriority
+    attempts: int = 0
+
+
+class SendPipeline:
+    """
+    Runs Telegram sends on worker threads, so handlers can keep working (e.g. call the backend) while messages
+    are sent. Sends to the same chat run one at a time, in the order they were submitted.
+    Workers share the bot connection pool (of `workers + 4` connections), so their number is kept small.
+    Sends are rate limited per chat and globally. A chat that has to wait releases its worker to other chats,
+    and sends that got `RetryAfter` are retried (in order) instead of failing.
+    With a deadline (the end of the Lambda run), sends that would have to wait past it fail instead.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        global_rate: float = GLOBAL_RATE,
+        global_burst: float = GLOBAL_BURST,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+    ):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="send-pipeline")
+        self._lock = threading.Lock()
+        # Chats with a running (or scheduled) drain task, and the sends waiting for it.
+        self._queues: Dict[Hashable, Deque[OutboundSend]] = {}
+        self._global_bucket = TokenBucket(rate=global_rate, capacity=global_burst)
+        # An idle chat bucket is full again after `chat_burst / chat_rate` seconds, so it can be dropped by then.
+        self._chat_buckets: TTLCache = TTLCache(maxsize=MAX_TRACKED_CHATS, ttl=chat_burst / chat_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._deadline: Optional[float] = None
+
+    def set_deadline(self, seconds_left: Optional[float]):
+        """
+        Sends are not delayed for more than `seconds_left` (minus a margin), `None` removes the deadline.
+        """
+        self._deadline = None if seconds_left is None else time.monotonic() + seconds_left - DEADLINE_MARGIN_SECONDS
+
+    def get_wait_timeout(self, timeout: float) -> float:
+        """
+        The given timeout, capped to the time left until the deadline.
+        """
+        time_left = self._get_time_left()
+        if time_left is None:
+            return timeout
+        return max(0.0, min(timeout, time_left))
+
+    def _get_time_left(self) -> Optional[float]:
+        if self._deadline is None:
+            return None
+        return self._deadline - time.monotonic()
+
+    def _is_past_deadline(self, delay: float) -> bool:
+        time_left = self._get_time_left()
+        return time_left is not None and delay > time_left
+
+    def submit(self, chat_id: Hashable, send: Send, priority: SendPriority = SendPriority.INFORMATIONAL) -> Future:
+        future: Future = Future()
+        outbound_send = OutboundSend(send=send, future=future, priority=priority)
+        with self._lock:
+            queue = self._queues.get(chat_id)
+            if queue is not None:
+                queue.append(outbound_send)
+                return future
+            self._queues[chat_id] = deque([outbound_send])
+        self._executor.submit(self._drain, chat_id)
+        return future
+
+    def _drain(self, chat_id: Hashable):
+        while True:
+            with self._lock:
+                queue = self._queues[chat_id]
+                if not queue:
+                    del self._queues[chat_id]
+                    return
+                outbound_send = queue[0]
+                delay = self._acquire(chat_id=chat_id, priority=outbound_send.priority)
+                if delay and not self._is_past_deadline(delay=delay):
+                    self._schedule_drain(chat_id=chat_id, delay=delay)
+                    return
+                queue.popleft()
+            if outbound_send.attempts == 0 and not outbound_send.future.set_running_or_notify_cancel():
+                continue
+            if delay:
+                log.warning("Send would be delayed past the deadline", extra={"chat_id": chat_id, "delay": delay})
+                outbound_send.future.set_exception(SendDeadlineExceeded(f"Send delayed for {delay:.1f} seconds"))
+                continue
+            outbound_send.attempts += 1
+            try:
+                outbound_send.future.set_result(outbound_send.send())
+            except RetryAfter as e:
+                with self._lock:
+                    self._global_bucket.block(seconds=e.retry_after)
+                if outbound_send.attempts >= MAX_RETRY_AFTER_ATTEMPTS or self._is_past_deadline(delay=e.retry_after):
+                    outbound_send.future.set_exception(e)
+                    continue
+                log.warning(
+                    "Telegram rate limit reached, retrying later",
+                    extra={"chat_id": chat_id, "retry_after": e.retry_after, "attempts": outbound_send.attempts},
+                )
+                with self._lock:
+                    queue.appendleft(outbound_send)
+                self._schedule_drain(chat_id=chat_id, delay=e.retry_after)
+                return
+            except Exception as e:
+                outbound_send.future.set_exception(e)
+
+    def _acquire(self, chat_id: Hashable, priority: SendPriority) -> float:
+        """
+        Take a token from both the chat bucket and the global bucket, or return the number of seconds to wait.
+        Must be called with the lock held.
+        """
+        chat_bucket = self._chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = TokenBucket(rate=self._chat_rate, capacity=self._chat_burst)
+        self._chat_buckets[chat_id] = chat_bucket
+        chat_delay = chat_bucket.try_acquire()
+        if chat_delay:
+            return chat_delay
+        reserve = 0 if priority == SendPriority.INTERACTIVE else INTERACTIVE_RESERVE
+        global_delay = self._global_bucket.try_acquire(reserve=reserve)
+        if global_delay:
+            # The chat token was not used.
+            chat_bucket.release()
+        return global_delay
+
+    def _schedule_drain(self, chat_id: Hashable, delay: float):
+        timer = threading.Timer(delay, self._executor.submit, args=(self._drain, chat_id))
+        timer.daemon = True
+        timer.start()
+
+
+def wait_for_sends(futures: Iterable[Future], timeout: float) -> List[BaseException]:
+    """
+    Wait for the given sends to complete, and return the errors of the ones that failed (or timed out).
+    """
+    done, not_done = wait(list(futures), timeout=timeout)
+    errors: List[BaseException] = [TimeoutError("Send did not complete in time") for _ in not_done]
+    for future in done:
+        error = future.exception()
+        if error is not None:
+            errors.append(error)
+    return errors
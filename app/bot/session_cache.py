@@ -0,0 +1,62 @@
+import threading
+from typing import TYPE_CHECKING, Any, Hashable, Optional, Tuple
+
+from cachetools import LRUCache
+from dynamo_persistence.persistent_store import get_data_digest
+from the_spymaster_util.logger import get_logger
+
+if TYPE_CHECKING:
+    from bot.models import Session
+
+log = get_logger(__name__)
+
+MAX_CACHED_SESSIONS = 1024
+
+
+class SessionCache:
+    """
+    Keeps the last `Session` of each chat with the digest of its chat data, so a session that was written (or
+    already validated) by this process is not validated again when the next update of the chat arrives.
+    The persistence layer copies chat data when it is stored, so it is matched by the digest the persistence
+    tracks for the stored item. Chat data without a known digest is always validated.
+    """
+
+    def __init__(self, max_size: int = MAX_CACHED_SESSIONS):
+        self._sessions: LRUCache = LRUCache(maxsize=max_size)
+        self._lock = threading.Lock()
+
+    def load(self, chat_id: Optional[Hashable], chat_data: Any, digest: Optional[str] = None) -> Optional["Session"]:
+        if not chat_data:
+            return None
+        if digest is not None:
+            with self._lock:
+                cached: Optional[Tuple[str, "Session"]] = self._sessions.get(chat_id)
+            if cached and cached[0] == digest:
+                return cached[1]
+        # Imported on first use, models depend on the (heavy) game packages.
+        from bot.models import Session
+
+        try:
+            session = Session.model_validate(chat_data)
+        except Exception as e:
+            log.warning(f"Failed to parse session {chat_data}: {e}")
+            return None
+        if digest is not None:
+            self.store(chat_id=chat_id, digest=digest, session=session)
+        return session
+
+    def dump(self, chat_id: Optional[Hashable], session: Optional["Session"]) -> Optional[dict]:
+        """
+        Dump the session to chat data, and remember the session it was dumped from.
+        """
+        if session is None:
+            with self._lock:
+                self._sessions.pop(chat_id, None)
+            return None
+        chat_data = session.model_dump()
+        self.store(chat_id=chat_id, digest=get_data_digest(chat_data), session=session)
+        return chat_data
+
+    def store(self, chat_id: Optional[Hashable], digest: str, session: "Session"):
+        with self._lock:
+            self._sessions[chat_id] = (digest, session)
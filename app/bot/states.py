@@ -0,0 +1,18 @@
+from enum import IntEnum
+
+
+class BotState(IntEnum):
+    PLAYING = 30
+    # Config
+    CONFIG_LANGUAGE = 10
+    CONFIG_SOLVER = 11
+    CONFIG_DIFFICULTY = 12
+    CONFIG_MODEL = 13
+    # Parsing
+    PARSE_LANGUAGE = 40
+    PARSE_MAP = 41
+    PARSE_BOARD = 42
+    PARSE_FIXES = 43
+    PARSE_FIX = 44
+    # Other
+    CONTINUE_GET_ID = 20
@@ -1,30 +1,25 @@
-from typing import Any, Callable, Dict, Optional, Type
-
-from bot.handlers.custom.config_difficulty import ConfigDifficultyHandler
-from bot.handlers.custom.config_language import ConfigLanguageHandler
-from bot.handlers.custom.config_model import ConfigModelHandler
-from bot.handlers.custom.config_solvers import ConfigSolverHandler
-from bot.handlers.custom.custom import CustomHandler
-from bot.handlers.gameplay.next_move import NextMoveHandler
-from bot.handlers.gameplay.process_message import ProcessMessageHandler
-from bot.handlers.gameplay.start import StartEventHandler
-from bot.handlers.internal.testing import TestingHandler
-from bot.handlers.internal.warmup import WarmupHandler, handle_warmup
-from bot.handlers.other.error import ErrorHandler
-from bot.handlers.other.event_handler import EventHandler
-from bot.handlers.other.fallback import FallbackHandler
-from bot.handlers.other.help import HelpMessageHandler
-from bot.handlers.parse.parse_board_handler import ParseBoardHandler
-from bot.handlers.parse.parse_done_handler import ParseDoneHandler
-from bot.handlers.parse.parse_fix_word_handler import ParseFixWordHandler
-from bot.handlers.parse.parse_fixing_handler import ParseFixesHandler
-from bot.handlers.parse.parse_handler import ParseHandler
-from bot.handlers.parse.parse_language_handler import ParseLanguageHandler
-from bot.handlers.parse.parse_map_handler import ParseMapHandler
-from bot.models import BotState
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from functools import cached_property, partial
+from importlib import import_module
+from queue import Empty, Queue
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Type
+
+from bot.chat_scheduler import ChatScheduler
+from bot.config import get_config
+from bot.raw_update import UpdateFilter, get_chat_id, get_conversation_key
+from bot.send_pipeline import SendPipeline
+from bot.session_cache import SessionCache
+from bot.states import BotState
+from bot.update_dedup import UpdateDeduplicator
+from bot.update_queue import UpdateQueue
 from dynamo_persistence.persistence import DynamoPersistence
+from dynamo_persistence.persistent_store import ConversationKey
 from telegram import Update
 from telegram.ext import (
+    BasePersistence,
     CallbackContext,
     CommandHandler,
     ConversationHandler,
@@ -34,71 +29,343 @@ from telegram.ext import (
     MessageHandler,
     Updater,
 )
-from the_spymaster_api import TheSpymasterClient
 from the_spymaster_util.logger import get_logger
+from the_spymaster_util.measure_time import MeasureTime
+
+if TYPE_CHECKING:
+    from bot.handlers.internal.warmup import Warmup
+    from bot.handlers.other.event_handler import EventHandler
+    from bot.models import Session
+    from bot.parser_client import ParserClient
+    from the_spymaster_api import TheSpymasterClient
 
 log = get_logger(__name__)
 
+MAIN_CONVERSATION_NAME = "main"
+SEC_TO_MS = 1000
+HANDLERS_PACKAGE = "bot.handlers"
+Callback = Callable[[Update, CallbackContext], Any]
+
 
 class TheSpymasterBot:
-    def __init__(self, telegram_token: str, server_host: str, dynamo_persistence: bool = False):
-        self.api_client = TheSpymasterClient(server_host=server_host)
-        persistence = DynamoPersistence() if dynamo_persistence else DictPersistence()
-        self.updater = Updater(token=telegram_token, persistence=persistence)
+    def __init__(
+        self,
+        telegram_token: str,
+        server_host: str,
+        dynamo_persistence: bool = False,
+        sqlite_persistence_path: Optional[str] = None,
+        write_behind: bool = False,
+        lazy_handlers: bool = False,
+    ):
+        """
+        With `lazy_handlers`, each handler module (and the heavy dependencies it imports) is only imported when
+        its first update arrives, which keeps cold starts short. The API clients are always created on first use.
+        """
+        self.server_host = server_host
+        self.lazy_handlers = lazy_handlers
+        self.send_pipeline = SendPipeline()
+        self.session_cache = SessionCache()
+        self.persistence = self._build_persistence(
+            dynamo_persistence=dynamo_persistence,
+            sqlite_persistence_path=sqlite_persistence_path,
+            write_behind=write_behind,
+        )
+        self.handler_paths: List[str] = []
+        self.update_filter = UpdateFilter()
+        self.update_deduplicator = self._build_update_deduplicator(persistence=self.persistence)
+        self.updater = Updater(token=telegram_token, persistence=self.persistence)
         self._construct_updater()
 
+    @cached_property
+    def api_client(self) -> "TheSpymasterClient":
+        from the_spymaster_api import TheSpymasterClient
+
+        return TheSpymasterClient(server_host=self.server_host)
+
+    @cached_property
+    def parser_client(self) -> "ParserClient":
+        from bot.parser_client import ParserClient
+
+        config = get_config()
+        return ParserClient(
+            base_url=config.base_parser_url,
+            timeouts=config.parser_timeouts,
+            pool_size=config.parser_pool_size,
+        )
+
+    @staticmethod
+    def _build_persistence(
+        dynamo_persistence: bool, sqlite_persistence_path: Optional[str], write_behind: bool
+    ) -> BasePersistence:
+        if not dynamo_persistence and not sqlite_persistence_path:
+            return DictPersistence()
+        config = get_config()
+        backend = None
+        if sqlite_persistence_path:
+            from dynamo_persistence.sqlite_backend import SqliteItemBackend
+
+            backend = SqliteItemBackend(path=sqlite_persistence_path)
+        return DynamoPersistence(
+            single_item_per_chat=config.persistence_single_item_per_chat,
+            backend=backend,
+            write_behind=write_behind,
+            write_behind_queue_size=config.persistence_write_behind_queue_size,
+        )
+
+    @staticmethod
+    def _build_update_deduplicator(persistence: BasePersistence) -> UpdateDeduplicator:
+        config = get_config()
+        backend = persistence.backend if isinstance(persistence, DynamoPersistence) else None
+        return UpdateDeduplicator(
+            backend=backend, ttl_seconds=config.update_dedup_ttl_seconds, claim_seconds=config.update_claim_seconds
+        )
+
     @property
     def dispatcher(self) -> Dispatcher:
         return self.updater.dispatcher  # type: ignore
 
-    def generate_callback(self, handler_type: Type[EventHandler]) -> Callable[[Update, CallbackContext], Any]:
-        return handler_type.generate_callback(bot=self)
+    def generate_callback(self, handler_path: str) -> Callback:
+        """
+        Generate the callback of the handler class at `handler_path`, relative to `bot.handlers`
+        (e.g. "other.help.HelpMessageHandler").
+        """
+        self.handler_paths.append(handler_path)
+        if not self.lazy_handlers:
+            return _import_handler(handler_path).generate_callback(bot=self)
+        callback: Optional[Callback] = None
+
+        def lazy_callback(update: Update, context: CallbackContext) -> Any:
+            nonlocal callback
+            if callback is None:
+                callback = _import_handler(handler_path).generate_callback(bot=self)
+            return callback(update, context)
+
+        return lazy_callback
 
     def process_update(self, update: dict):
         action = update.get("action")
         if action == "warmup":
             return self.handle_warmup()
+        if self.update_filter.should_ignore(update) or self.is_duplicate(update):
+            return None
+        try:
+            with self.unit_of_work():
+                self.prefetch(update)
+                result = self.dispatch(update)
+        except Exception:
+            self.release_update(update)
+            raise
+        self.complete_update(update)
+        return result
+
+    def process_updates(self, updates: List[dict], deduplicate: bool = True) -> List[Optional[Exception]]:
+        """
+        Handle a batch of updates, and return the error of each update (`None` if it was handled).
+        Updates delivered by a deduplicating queue (SQS FIFO) should not be deduplicated again: a redelivered update
+        is one that was not handled, so it must not be dropped.
+        Updates are grouped by chat: different chats are handled concurrently, and the updates of a chat in order.
+        Once an update fails, the following updates of its chat are not handled (and fail as well), so they can be
+        retried in order. Persistence items are read once per conversation, and written once per chat (so a failed
+        write only fails the updates of its chat).
+        """
+        errors: List[Optional[Exception]] = [None] * len(updates)
+        chat_update_indices: Dict[Optional[int], List[int]] = defaultdict(list)
+        for index, update in enumerate(updates):
+            chat_update_indices[get_chat_id(update)].append(index)
+        workers = min(len(chat_update_indices), get_config().batch_workers) or 1
+        log.info(
+            "Processing update batch", extra={"update_count": len(updates), "chat_count": len(chat_update_indices)}
+        )
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for indices in chat_update_indices.values():
+                executor.submit(
+                    self._process_chat_updates,
+                    updates=updates,
+                    indices=indices,
+                    errors=errors,
+                    deduplicate=deduplicate,
+                )
+        for update, error in zip(updates, errors, strict=True):
+            if error:
+                self.release_update(update)
+            else:
+                self.complete_update(update)
+        return errors
+
+    def _process_chat_updates(
+        self, updates: List[dict], indices: List[int], errors: List[Optional[Exception]], deduplicate: bool
+    ):
+        try:
+            with self.unit_of_work():
+                self._dispatch_chat_updates(updates=updates, indices=indices, errors=errors, deduplicate=deduplicate)
+        except Exception as e:
+            # The chat's write failed, so none of its handled updates were persisted.
+            log.exception("Failed to flush chat updates", extra={"update_count": len(indices)})
+            for index in indices:
+                errors[index] = errors[index] or e
+
+    def _dispatch_chat_updates(
+        self, updates: List[dict], indices: List[int], errors: List[Optional[Exception]], deduplicate: bool
+    ):
+        prefetched: Set[Optional[ConversationKey]] = set()
+        for position, index in enumerate(indices):
+            update = updates[index]
+            try:
+                if self.update_filter.should_ignore(update) or (deduplicate and self.is_duplicate(update)):
+                    continue
+                conversation_key = get_conversation_key(update)
+                if conversation_key not in prefetched:
+                    self.prefetch(update)
+                    prefetched.add(conversation_key)
+                self.dispatch(update)
+            except Exception as e:
+                log.exception("Error handling update", extra={"update_id": update.get("update_id")})
+                for skipped_index in indices[position:]:
+                    errors[skipped_index] = e
+                return
+
+    def process_queued_updates(self, update_queue: UpdateQueue) -> int:
+        """
+        Handle queued updates (in order) until the queue is empty, and return the number of updates handled.
+        Updates are deleted from the queue once handled. Stops at the first failed batch, failed updates stay queued.
+        """
+        count = 0
+        while received_updates := update_queue.receive():
+            errors = self.process_updates([received.update for received in received_updates])
+            handled = [received for received, error in zip(received_updates, errors, strict=True) if error is None]
+            update_queue.delete(handled)
+            count += len(handled)
+            if len(handled) < len(received_updates):
+                log.warning(
+                    "Failed to handle queued updates", extra={"failed_count": len(received_updates) - len(handled)}
+                )
+                break
+        return count
+
+    def is_duplicate(self, update: dict) -> bool:
+        update_id = update.get("update_id")
+        if update_id is None or self.update_deduplicator.claim(update_id=update_id):
+            return False
+        log.info("Duplicate update, ignoring", extra={"update_id": update_id})
+        return True
+
+    def complete_update(self, update: dict):
+        """
+        Mark an update that was handled (and persisted), so its retries are dropped.
+        """
+        update_id = update.get("update_id")
+        if update_id is not None:
+            self.update_deduplicator.complete(update_id=update_id)
+
+    def release_update(self, update: dict):
+        """
+        Release the claim of an update that failed, so it is handled again when it is retried.
+        """
+        update_id = update.get("update_id")
+        if update_id is not None:
+            self.update_deduplicator.release(update_id=update_id)
+
+    def dispatch(self, update: dict):
         parsed_update = self.parse_update(update)
         return self.dispatcher.process_update(parsed_update)
 
+    def prefetch(self, update: dict) -> None:
+        if not isinstance(self.persistence, DynamoPersistence):
+            return
+        conversation_key = get_conversation_key(update)
+        if conversation_key is None:
+            return
+        chat_id = conversation_key[0]
+        try:
+            with MeasureTime() as mt:
+                reads_saved = self.persistence.prefetch(
+                    conversation_keys={MAIN_CONVERSATION_NAME: conversation_key}, chat_id=chat_id
+                )
+        except Exception as e:
+            # Not critical, items will be read on demand.
+            log.warning(f"Failed to prefetch persistence items: {e}")
+            return
+        log.info("Prefetch complete", extra={"reads_saved": reads_saved, "duration_ms": mt.delta * SEC_TO_MS})
+
+    def unit_of_work(self) -> AbstractContextManager:
+        if not isinstance(self.persistence, DynamoPersistence):
+            return nullcontext()
+        return self.persistence.unit_of_work()
+
+    def load_session(self, chat_id: Optional[int], chat_data: Any) -> Optional["Session"]:
+        digest = None
+        if chat_id is not None and isinstance(self.persistence, DynamoPersistence):
+            digest = self.persistence.get_chat_data_digest(chat_id=chat_id)
+        return self.session_cache.load(chat_id=chat_id, chat_data=chat_data, digest=digest)
+
+    @cached_property
+    def warmup(self) -> "Warmup":
+        from bot.handlers.internal.warmup import Warmup
+
+        return Warmup(bot=self)
+
     def handle_warmup(self) -> Dict[str, float]:
-        task_results = handle_warmup(self)
+        task_results = self.warmup.run()
         return {task.name: task.duration for task in task_results}
 
+    def import_handlers(self) -> int:
+        """
+        Import all handler modules (which are imported on first use with `lazy_handlers`).
+        """
+        for handler_path in self.handler_paths:
+            _import_handler(handler_path)
+        return len(self.handler_paths)
+
     def parse_update(self, update: dict) -> Optional[Update]:
         return Update.de_json(update, bot=self.updater.bot)  # type: ignore
 
     def _construct_updater(self):
         log.info("Setting up bot...")
         # Start
-        start = CommandHandler("start", self.generate_callback(StartEventHandler))
-        custom = CommandHandler("custom", self.generate_callback(CustomHandler))
+        start = CommandHandler("start", self.generate_callback("gameplay.start.StartEventHandler"))
+        custom = CommandHandler("custom", self.generate_callback("custom.custom.CustomHandler"))
         # Config
-        config_language = MessageHandler(Filters.text, self.generate_callback(ConfigLanguageHandler))
-        config_solver = MessageHandler(Filters.text, self.generate_callback(ConfigSolverHandler))
-        config_difficulty = MessageHandler(Filters.text, self.generate_callback(ConfigDifficultyHandler))
-        config_model = MessageHandler(Filters.text, self.generate_callback(ConfigModelHandler))
+        config_language = MessageHandler(
+            Filters.text, self.generate_callback("custom.config_language.ConfigLanguageHandler")
+        )
+        config_solver = MessageHandler(
+            Filters.text, self.generate_callback("custom.config_solvers.ConfigSolverHandler")
+        )
+        config_difficulty = MessageHandler(
+            Filters.text, self.generate_callback("custom.config_difficulty.ConfigDifficultyHandler")
+        )
+        config_model = MessageHandler(Filters.text, self.generate_callback("custom.config_model.ConfigModelHandler"))
         # Game
-        process_message = MessageHandler(Filters.text & ~Filters.command, self.generate_callback(ProcessMessageHandler))
-        next_move = CommandHandler("next_move", self.generate_callback(NextMoveHandler))
+        process_message = MessageHandler(
+            Filters.text & ~Filters.command, self.generate_callback("gameplay.process_message.ProcessMessageHandler")
+        )
+        next_move = CommandHandler("next_move", self.generate_callback("gameplay.next_move.NextMoveHandler"))
         # Parsing
-        parse = CommandHandler("parse", self.generate_callback(ParseHandler))
-        parse_language = MessageHandler(Filters.text, self.generate_callback(ParseLanguageHandler))
-        parse_map = MessageHandler(Filters.photo, self.generate_callback(ParseMapHandler))
-        parse_board = MessageHandler(Filters.photo, self.generate_callback(ParseBoardHandler))
-        parse_fixes = MessageHandler(Filters.text, self.generate_callback(ParseFixesHandler))
-        parse_fix = MessageHandler(Filters.text, self.generate_callback(ParseFixWordHandler))
-        parse_done = CommandHandler("done", self.generate_callback(ParseDoneHandler))
+        parse = CommandHandler("parse", self.generate_callback("parse.parse_handler.ParseHandler"))
+        parse_language = MessageHandler(
+            Filters.text, self.generate_callback("parse.parse_language_handler.ParseLanguageHandler")
+        )
+        parse_map = MessageHandler(Filters.photo, self.generate_callback("parse.parse_map_handler.ParseMapHandler"))
+        parse_board = MessageHandler(
+            Filters.photo, self.generate_callback("parse.parse_board_handler.ParseBoardHandler")
+        )
+        parse_fixes = MessageHandler(
+            Filters.text, self.generate_callback("parse.parse_fixing_handler.ParseFixesHandler")
+        )
+        parse_fix = MessageHandler(
+            Filters.text, self.generate_callback("parse.parse_fix_word_handler.ParseFixWordHandler")
+        )
+        parse_done = CommandHandler("done", self.generate_callback("parse.parse_done_handler.ParseDoneHandler"))
         # Util
-        fallback = CommandHandler("quit", self.generate_callback(FallbackHandler))
-        help_message = CommandHandler("help", self.generate_callback(HelpMessageHandler))
-        error_handler = self.generate_callback(ErrorHandler)
+        fallback = CommandHandler("quit", self.generate_callback("other.fallback.FallbackHandler"))
+        help_message = CommandHandler("help", self.generate_callback("other.help.HelpMessageHandler"))
+        error_handler = self.generate_callback("other.error.ErrorHandler")
         # Internal
-        load_models = CommandHandler("warmup", self.generate_callback(WarmupHandler))
-        testing = CommandHandler("test", self.generate_callback(TestingHandler))
+        load_models = CommandHandler("warmup", self.generate_callback("internal.warmup.WarmupHandler"))
+        testing = CommandHandler("test", self.generate_callback("internal.testing.TestingHandler"))
 
         conv_handler = ConversationHandler(
-            name="main",
+            name=MAIN_CONVERSATION_NAME,
             entry_points=[
                 help_message,
                 start,
@@ -133,5 +400,43 @@ class TheSpymasterBot:
         self.dispatcher.add_error_handler(error_handler)  # type: ignore
 
     def poll(self) -> None:
+        """
+        Updates of different chats are handled concurrently (by `polling_workers` threads),
+        updates of the same chat are handled one at a time, in order.
+        """
+        config = get_config()
+        scheduler = ChatScheduler(max_workers=config.polling_workers)
+        update_queue = self.updater.update_queue
+        # The dispatcher thread is left idle, updates are scheduled per chat instead.
+        self.dispatcher.update_queue = Queue()
+        stop_event = threading.Event()
+        scheduling_thread = threading.Thread(
+            target=self._schedule_updates,
+            kwargs={"update_queue": update_queue, "scheduler": scheduler, "stop_event": stop_event},
+            name="update-scheduler",
+            daemon=True,
+        )
+        scheduling_thread.start()
         self.updater.start_polling()
         self.updater.idle()
+        stop_event.set()
+        scheduling_thread.join()
+        scheduler.shutdown(wait=True)
+        self.persistence.flush()
+
+    def _schedule_updates(self, update_queue: Queue, scheduler: ChatScheduler, stop_event: threading.Event):
+        while not stop_event.is_set():
+            try:
+                update = update_queue.get(timeout=1)
+            except Empty:
+                continue
+            chat_id = update.effective_chat.id if isinstance(update, Update) and update.effective_chat else None
+            scheduler.submit(chat_id=chat_id, task=partial(self.dispatcher.process_update, update))
+
+
+def _import_handler(handler_path: str) -> Type["EventHandler"]:
+    module_name, _, class_name = f"{HANDLERS_PACKAGE}.{handler_path}".rpartition(".")
+    with MeasureTime() as mt:
+        module = import_module(module_name)
+    log.debug("Handler imported", extra={"handler": class_name, "duration_ms": mt.delta * SEC_TO_MS})
+    return getattr(module, class_name)
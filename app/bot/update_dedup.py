@@ -0,0 +1,139 @@
+import threading
+from datetime import timedelta
+from typing import Dict, Optional
+
+from cachetools import TTLCache
+from dynamo_persistence.backend import ItemBackend, VersionConflict
+from dynamo_persistence.persistent_item import PersistentItem
+from the_spymaster_util.logger import get_logger
+from the_spymaster_util.measure_time import MeasureTime
+
+log = get_logger(__name__)
+
+SEC_TO_MS = 1000
+UPDATE_ITEM_TYPE = "update"
+MAX_RECENT_UPDATES = 10_000
+HANDLING_STATUS = "handling"
+HANDLED_STATUS = "handled"
+
+
+class UpdateDeduplicator:
+    """
+    Telegram retries webhook calls that did not respond in time, so the same update may arrive more than once.
+    Each update id is claimed once: in memory (for retries reaching the same warm container), and with a
+    conditional put of an `update::<update_id>` item (for retries reaching other containers).
+    A claim is a short lease (`claim_seconds`), so the retries of an update whose process died while handling it
+    (e.g. a Lambda timeout) are handled once it expires. Handled updates are marked for `ttl_seconds`, and the
+    claims of updates that failed to be handled (or persisted) are released, so their retries are handled.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[ItemBackend],
+        ttl_seconds: int,
+        claim_seconds: int,
+        max_size: int = MAX_RECENT_UPDATES,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.claim_seconds = claim_seconds
+        self._recent_updates: TTLCache = TTLCache(maxsize=max_size, ttl=ttl_seconds)
+        # Updates being handled by this process, and the version of their claim item (`None` if it was not written).
+        self._claimed_versions: Dict[int, Optional[int]] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, update_id: int) -> bool:
+        """
+        Returns whether the update was claimed, `False` means it was already received.
+        A claimed update should be either completed (once handled) or released (if it failed).
+        """
+        with self._lock:
+            if update_id in self._recent_updates:
+                return False
+            self._recent_updates[update_id] = True
+        version = None
+        if self.backend is not None:
+            try:
+                with MeasureTime() as mt:
+                    version = self._write_claim(backend=self.backend, update_id=update_id)
+            except VersionConflict:
+                # Claimed by another process, which might die before handling it (so it is not remembered).
+                with self._lock:
+                    self._recent_updates.pop(update_id, None)
+                return False
+            except Exception as e:
+                # Not critical, handling a duplicate is better than dropping an update.
+                log.warning(f"Failed to claim update {update_id}: {e}")
+            else:
+                log.debug("Update claimed", extra={"update_id": update_id, "duration_ms": mt.delta * SEC_TO_MS})
+        with self._lock:
+            self._claimed_versions[update_id] = version
+        return True
+
+    def complete(self, update_id: int):
+        """
+        Mark a claimed update as handled, so its retries are dropped for `ttl_seconds`.
+        Updates that were not claimed by this process are left as they are.
+        """
+        with self._lock:
+            if update_id not in self._claimed_versions:
+                return
+            version = self._claimed_versions.pop(update_id)
+        if self.backend is None or version is None:
+            return
+        item = self._build_item(update_id=update_id, status=HANDLED_STATUS, ttl_seconds=self.ttl_seconds)
+        item.version = version
+        try:
+            self.backend.write([item])
+        except Exception as e:
+            # The claim expires, so a retry might be handled again.
+            log.warning(f"Failed to mark update {update_id} handled: {e}")
+
+    def release(self, update_id: int):
+        """
+        Release the claim of an update that failed, so it is handled when it is retried.
+        Updates that were not claimed by this process are left as they are.
+        """
+        with self._lock:
+            if update_id not in self._claimed_versions:
+                return
+            version = self._claimed_versions.pop(update_id)
+            self._recent_updates.pop(update_id, None)
+        if self.backend is None or version is None:
+            return
+        item = self._build_item(update_id=update_id, status=HANDLING_STATUS, ttl_seconds=self.claim_seconds)
+        item.version = version
+        try:
+            self.backend.delete(item)
+        except Exception as e:
+            log.warning(f"Failed to release update {update_id}: {e}")
+            return
+        log.info("Update claim released", extra={"update_id": update_id})
+
+    def _write_claim(self, backend: ItemBackend, update_id: int) -> Optional[int]:
+        """
+        Write the claim item and return its version. Raises `VersionConflict` if the update is handled
+        (or being handled) by another process.
+        """
+        # A new item (without a version) is only written if it does not exist yet.
+        item = self._build_item(update_id=update_id, status=HANDLING_STATUS, ttl_seconds=self.claim_seconds)
+        try:
+            backend.write([item])
+            return item.version
+        except VersionConflict:
+            existing = backend.get(item.item_id)
+        # Dynamo deletes expired items lazily, an expired claim (or mark) is taken over.
+        if existing is not None and not existing.is_expired:
+            raise VersionConflict(item_ids=[item.item_id])
+        if existing is not None:
+            item.version = existing.version
+        backend.write([item])
+        log.info("Expired update claim taken over", extra={"update_id": update_id})
+        return item.version
+
+    @staticmethod
+    def _build_item(update_id: int, status: str, ttl_seconds: int) -> PersistentItem:
+        item = PersistentItem(item_id=f"{UPDATE_ITEM_TYPE}::{update_id}", item_type=UPDATE_ITEM_TYPE)
+        item.data = {"status": status}
+        item.expires_at = timedelta(seconds=ttl_seconds)
+        return item
@@ -0,0 +1,141 @@
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, List
+
+from bot.raw_update import get_chat_id
+
+CREATE_TABLE = "CREATE TABLE IF NOT EXISTS queued_updates (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT)"
+INSERT_UPDATE = "INSERT INTO queued_updates (body) VALUES (?)"
+SELECT_UPDATES = "SELECT id, body FROM queued_updates ORDER BY id LIMIT ?"
+DELETE_UPDATE = "DELETE FROM queued_updates WHERE id = ?"
+# SQS limits.
+MAX_RECEIVE_COUNT = 10
+
+
+@dataclass
+class ReceivedUpdate:
+    update: dict
+    # Identifies the received update in its queue (e.g. an SQS receipt handle).
+    receipt: Any
+
+
+class UpdateQueue:
+    """
+    Raw updates waiting to be handled, so the webhook can respond before they are.
+    Updates of the same chat are received in the order they were put.
+    Received updates stay in the queue until they are deleted, so updates that failed to be handled are retried.
+    """
+
+    def put(self, update: dict):
+        raise NotImplementedError
+
+    def receive(self, max_count: int = MAX_RECEIVE_COUNT) -> List[ReceivedUpdate]:
+        """
+        Return up to `max_count` updates, oldest first. Should be deleted once handled.
+        """
+        raise NotImplementedError
+
+    def delete(self, received_updates: List[ReceivedUpdate]):
+        raise NotImplementedError
+
+
+class InProcessUpdateQueue(UpdateQueue):
+    """
+    Meant for a single consumer, received updates are returned again until they are deleted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._updates: List[ReceivedUpdate] = []
+
+    def put(self, update: dict):
+        with self._lock:
+            self._updates.append(ReceivedUpdate(update=update, receipt=object()))
+
+    def receive(self, max_count: int = MAX_RECEIVE_COUNT) -> List[ReceivedUpdate]:
+        with self._lock:
+            return self._updates[:max_count]
+
+    def delete(self, received_updates: List[ReceivedUpdate]):
+        receipts = {id(received.receipt) for received in received_updates}
+        with self._lock:
+            self._updates = [received for received in self._updates if id(received.receipt) not in receipts]
+
+
+class SqliteUpdateQueue(UpdateQueue):
+    """
+    Keeps updates in a local SQLite database, so they can be put and received by different processes.
+    Meant for a single consumer, received updates are returned again until they are deleted.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(CREATE_TABLE)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def put(self, update: dict):
+        with self._lock:
+            self._connection.execute(INSERT_UPDATE, (json.dumps(update),))
+
+    def receive(self, max_count: int = MAX_RECEIVE_COUNT) -> List[ReceivedUpdate]:
+        with self._lock:
+            rows = self._connection.execute(SELECT_UPDATES, (max_count,)).fetchall()
+        return [ReceivedUpdate(update=json.loads(body), receipt=row_id) for row_id, body in rows]
+
+    def delete(self, received_updates: List[ReceivedUpdate]):
+        if not received_updates:
+            return
+        with self._lock:
+            self._connection.executemany(DELETE_UPDATE, [(received.receipt,) for received in received_updates])
+
+
+class SqsUpdateQueue(UpdateQueue):
+    """
+    An SQS FIFO queue. Each chat is a message group (so its updates are handled in order),
+    and the update id deduplicates webhook retries within SQS's deduplication interval.
+    In Lambda, updates are usually received by an SQS event source instead of `receive`.
+    Received updates that are not deleted are received again once their visibility timeout ends.
+    """
+
+    def __init__(self, queue_url: str):
+        # Imported on first use, it is only needed in fast-ack mode.
+        import boto3
+
+        self.queue_url = queue_url
+        self._client = boto3.client("sqs")
+
+    def put(self, update: dict):
+        self._client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps(update),
+            MessageGroupId=str(_get_group_id(update)),
+            MessageDeduplicationId=str(update["update_id"]),
+        )
+
+    def receive(self, max_count: int = MAX_RECEIVE_COUNT) -> List[ReceivedUpdate]:
+        response = self._client.receive_message(
+            QueueUrl=self.queue_url, MaxNumberOfMessages=min(max_count, MAX_RECEIVE_COUNT)
+        )
+        messages = response.get("Messages", [])
+        return [
+            ReceivedUpdate(update=json.loads(message["Body"]), receipt=message["ReceiptHandle"]) for message in messages
+        ]
+
+    def delete(self, received_updates: List[ReceivedUpdate]):
+        for i in range(0, len(received_updates), MAX_RECEIVE_COUNT):
+            chunk = received_updates[i : i + MAX_RECEIVE_COUNT]
+            entries = [{"Id": str(j), "ReceiptHandle": received.receipt} for j, received in enumerate(chunk)]
+            self._client.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+
+
+def _get_group_id(update: dict) -> int:
+    # Updates without a chat (e.g. inline queries) share a single group.
+    return get_chat_id(update) or 0
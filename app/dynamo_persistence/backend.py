@@ -0,0 +1,166 @@
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from dynamo_persistence.persistent_item import PersistentItem
+from pynamodb.connection import Connection
+from pynamodb.exceptions import DeleteError
+from pynamodb.exceptions import DoesNotExist as PynamoDoesNotExist
+from pynamodb.exceptions import PutError, TransactWriteError
+from pynamodb.transactions import TransactWrite
+from the_spymaster_util.measure_time import MeasureTime
+
+log = logging.getLogger(__name__)
+
+SEC_TO_MS = 1000
+CONDITIONAL_CHECK_FAILED = "ConditionalCheckFailedException"
+TRANSACTION_CANCELED = "TransactionCanceledException"
+CONDITIONAL_CHECK_FAILED_REASON = "ConditionalCheckFailed"
+VERSION_PROJECTION = ["item_id", "version"]
+
+
+class VersionConflict(Exception):
+    def __init__(self, item_ids: List[str]):
+        super().__init__(f"Items were changed since they were read: {item_ids}")
+        self.item_ids = item_ids
+
+
+class ItemBackend:
+    """
+    Storage of `PersistentItem`s, used by the persistent stores.
+    Writes are conditioned on the version each item was read with.
+    """
+
+    def get(self, item_id: str) -> Optional[PersistentItem]:
+        raise NotImplementedError
+
+    def get_version(self, item_id: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def batch_get(self, item_ids: Iterable[str]) -> Dict[str, PersistentItem]:
+        """
+        Returns a mapping from item id to item, items that do not exist are omitted.
+        """
+        raise NotImplementedError
+
+    def batch_get_versions(self, item_ids: Iterable[str]) -> Dict[str, Optional[int]]:
+        """
+        Returns a mapping from item id to item version, items that do not exist are mapped to `None`.
+        """
+        raise NotImplementedError
+
+    def write(self, items: List[PersistentItem]):
+        """
+        Write items atomically, and increment their (local) versions.
+        Raises `VersionConflict` if any of the items was changed since it was read.
+        """
+        raise NotImplementedError
+
+    def delete(self, item: PersistentItem):
+        """
+        Delete the item, raises `VersionConflict` if it was changed since it was read (or written).
+        """
+        raise NotImplementedError
+
+
+class DynamoItemBackend(ItemBackend):
+    def get(self, item_id: str) -> Optional[PersistentItem]:
+        try:
+            return PersistentItem.get(hash_key=item_id)
+        except PynamoDoesNotExist:
+            return None
+
+    def get_version(self, item_id: str) -> Optional[int]:
+        with MeasureTime() as mt:
+            try:
+                persistence_item = PersistentItem.get(hash_key=item_id, attributes_to_get=VERSION_PROJECTION)
+            except PynamoDoesNotExist:
+                return None
+        log.debug("Version read complete", extra={"item_id": item_id, "duration_ms": mt.delta * SEC_TO_MS})
+        return persistence_item.version
+
+    def batch_get(self, item_ids: Iterable[str]) -> Dict[str, PersistentItem]:
+        """
+        Read multiple items in a single BatchGetItem call.
+        """
+        item_ids = set(item_ids)
+        if not item_ids:
+            return {}
+        log.debug("Batch reading from Dynamo", extra={"item_ids": sorted(item_ids)})
+        with MeasureTime() as mt:
+            items = {item.item_id: item for item in PersistentItem.batch_get(item_ids)}
+        log.debug(
+            "Batch read complete",
+            extra={"item_count": len(item_ids), "found_count": len(items), "duration_ms": mt.delta * SEC_TO_MS},
+        )
+        return items
+
+    def batch_get_versions(self, item_ids: Iterable[str]) -> Dict[str, Optional[int]]:
+        """
+        Read only the versions of multiple items in a single BatchGetItem call.
+        """
+        item_ids = set(item_ids)
+        if not item_ids:
+            return {}
+        with MeasureTime() as mt:
+            items = PersistentItem.batch_get(item_ids, attributes_to_get=VERSION_PROJECTION)
+            versions = {item.item_id: item.version for item in items}
+        log.debug(
+            "Batch version read complete", extra={"item_count": len(item_ids), "duration_ms": mt.delta * SEC_TO_MS}
+        )
+        return {item_id: versions.get(item_id) for item_id in item_ids}
+
+    def write(self, items: List[PersistentItem]):
+        """
+        A single item is written with PutItem, multiple items with one TransactWriteItems call.
+        """
+        if not items:
+            return
+        item_ids = [item.item_id for item in items]
+        log.debug("Writing items to Dynamo", extra={"item_ids": item_ids})
+        with MeasureTime() as mt:
+            try:
+                if len(items) == 1:
+                    items[0].save()
+                else:
+                    _transact_write(items=items)
+            except PutError as e:
+                if e.cause_response_code == CONDITIONAL_CHECK_FAILED:
+                    raise VersionConflict(item_ids=item_ids) from e
+                raise
+            except TransactWriteError as e:
+                conflicted_ids = _get_conflicted_item_ids(error=e, item_ids=item_ids)
+                if conflicted_ids:
+                    raise VersionConflict(item_ids=conflicted_ids) from e
+                raise
+        log.debug("Items write complete", extra={"item_count": len(items), "duration_ms": mt.delta * SEC_TO_MS})
+
+    def delete(self, item: PersistentItem):
+        try:
+            item.delete()
+        except DeleteError as e:
+            if e.cause_response_code == CONDITIONAL_CHECK_FAILED:
+                raise VersionConflict(item_ids=[item.item_id]) from e
+            raise
+
+
+def _get_conflicted_item_ids(error: TransactWriteError, item_ids: List[str]) -> List[str]:
+    """
+    A transaction is canceled for many reasons (throttling, conflicting transactions, validation errors),
+    only failed condition checks mean that items were changed since they were read.
+    Returns the conflicted item ids, or an empty list if the transaction was canceled for any other reason.
+    """
+    if error.cause_response_code != TRANSACTION_CANCELED:
+        return []
+    reasons = error.cancellation_reasons or []
+    codes = {reason.code for reason in reasons if reason}
+    if codes != {CONDITIONAL_CHECK_FAILED_REASON}:
+        return []
+    return [item_id for item_id, reason in zip(item_ids, reasons, strict=False) if reason]
+
+
+def _transact_write(items: List[PersistentItem]):
+    connection = Connection(region=PersistentItem.Meta.region)  # type: ignore[attr-defined]
+    with TransactWrite(connection=connection) as transaction:
+        for item in items:
+            item.touch()
+            transaction.save(item)
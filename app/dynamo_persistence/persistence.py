@@ -1,27 +1,50 @@
 import logging
-from typing import Dict, Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from dynamo_persistence.persistent_store import ConversationKey
+from dynamo_persistence.backend import DynamoItemBackend, ItemBackend
+from dynamo_persistence.persistent_item import PersistentItem
+from dynamo_persistence.persistent_store import ConversationKey, DynamoPersistentStore
 from dynamo_persistence.telegram_stores import (
+    ChatDataDict,
     DynamoStoredBotData,
     DynamoStoredChatData,
+    DynamoStoredChatState,
+    DynamoStoredChatStateConversation,
+    DynamoStoredChatStateData,
     DynamoStoredConversation,
     DynamoStoredUserData,
     UserDataDict,
 )
+from dynamo_persistence.write_behind import WriteBehindQueue
 from telegram.ext import BasePersistence
-from telegram.ext.utils.types import BD, CD, UD, CDCData
+from telegram.ext.utils.types import BD, CD, UD, CDCData, ConversationDict
+from the_spymaster_util.measure_time import MeasureTime
 
 log = logging.getLogger(__name__)
 
+SEC_TO_MS = 1000
+
 
 class DynamoPersistence(BasePersistence):
+    """
+    By default, each conversation state and each chat data is stored as a separate item.
+    With `single_item_per_chat`, all conversation states and the chat data of a chat are stored as one item,
+    and items of the default layout are migrated on first access.
+    Items are stored in Dynamo unless another `backend` is given (e.g. `SqliteItemBackend`).
+    With `write_behind`, commits outside a unit of work are written by a background thread (for polling mode).
+    """
+
     def __init__(
         self,
         store_user_data: bool = False,
         store_chat_data: bool = True,
         store_bot_data: bool = False,
         store_callback_data: bool = False,
+        single_item_per_chat: bool = False,
+        backend: Optional[ItemBackend] = None,
+        write_behind: bool = False,
+        write_behind_queue_size: int = 1000,
     ):
         super().__init__(
             store_user_data=store_user_data,
@@ -29,25 +52,217 @@ class DynamoPersistence(BasePersistence):
             store_bot_data=store_bot_data,
             store_callback_data=store_callback_data,
         )
+        self.single_item_per_chat = single_item_per_chat
+        self.backend = backend or DynamoItemBackend()
+        self.write_behind_queue: Optional[WriteBehindQueue] = None
+        if write_behind:
+            self.write_behind_queue = WriteBehindQueue(backend=self.backend, max_size=write_behind_queue_size)
         self.conversation_store_dict: Dict[str, DynamoStoredConversation] = {}
+        self.chat_state_conversation_dict: Dict[str, DynamoStoredChatStateConversation] = {}
+        self.chat_state_store = DynamoStoredChatState(backend=self.backend)
         if store_user_data:
-            self.user_data_store = DynamoStoredUserData()
+            self.user_data_store = DynamoStoredUserData(backend=self.backend)
         if store_chat_data:
-            self.chat_data_store = DynamoStoredChatData()
+            self.chat_data_store = DynamoStoredChatData(backend=self.backend)
+            self.chat_state_data = DynamoStoredChatStateData(chat_state_store=self.chat_state_store)
         if store_bot_data:
-            self.bot_data_store = DynamoStoredBotData()
+            self.bot_data_store = DynamoStoredBotData(backend=self.backend)
+
+    def insert_bot(self, obj: object) -> object:
+        # BasePersistence copies the stores returned from get_*_data, which would leave the dispatcher with
+        # a separate (and never refreshed) cache. Stored data never contains bot instances, so keep the store itself.
+        if isinstance(obj, (DynamoPersistentStore, DynamoStoredChatStateData)):
+            return obj
+        return super().insert_bot(obj)
+
+    def get_conversations(self, name: str) -> ConversationDict:
+        if self.single_item_per_chat:
+            return self._get_chat_state_conversation(name=name)
+        return self._get_conversation_store(name=name)
 
-    def get_conversations(self, name: str) -> DynamoStoredConversation:
+    def _get_conversation_store(self, name: str) -> DynamoStoredConversation:
         if name not in self.conversation_store_dict:
-            self.conversation_store_dict[name] = DynamoStoredConversation(conversation_name=name)
-        return self.conversation_store_dict[name]
+            self.conversation_store_dict[name] = DynamoStoredConversation(conversation_name=name, backend=self.backend)
+        store = self.conversation_store_dict[name]
+        self._join_unit_of_work(store=store)
+        return store
+
+    def _get_chat_state_conversation(self, name: str) -> DynamoStoredChatStateConversation:
+        if name not in self.chat_state_conversation_dict:
+            self.chat_state_conversation_dict[name] = DynamoStoredChatStateConversation(
+                conversation_name=name, chat_state_store=self.chat_state_store
+            )
+        conversation = self.chat_state_conversation_dict[name]
+        self._join_unit_of_work(store=conversation.legacy_store)
+        return conversation
+
+    def _join_unit_of_work(self, store: DynamoPersistentStore):
+        # A store created (or first used by this thread) during a unit of work joins it.
+        if self.chat_state_store.is_deferred and not store.is_deferred:
+            store.start_unit_of_work()
+
+    def prefetch(self, conversation_keys: Dict[str, ConversationKey], chat_id: Optional[int]) -> int:
+        """
+        Load all the items a single update is going to need with (at most) one BatchGetItem call,
+        and fill the stores caches. Items cached by a previous run are validated by their version first.
+        Returns the number of Dynamo reads saved (compared to reading each item separately).
+        """
+        targets = self._get_prefetch_targets(conversation_keys=conversation_keys, chat_id=chat_id)
+        round_trips = self._load_targets(targets=targets)
+        if self.single_item_per_chat:
+            # Chats that were not migrated yet start from their legacy items, read them together as well.
+            legacy_targets = self._get_legacy_prefetch_targets(conversation_keys=conversation_keys, chat_id=chat_id)
+            round_trips += self._load_targets(targets=legacy_targets)
+            targets.update(legacy_targets)
+        return len(targets) - round_trips
+
+    def _load_targets(self, targets: Dict[str, Tuple[DynamoPersistentStore, Any]]) -> int:
+        """
+        Fill the caches of the given targets, returns the number of Dynamo round trips made.
+        """
+        pending = {item_id: (store, key) for item_id, (store, key) in targets.items() if not store.is_trusted(key)}
+        round_trips = 0
+        if pending and all(store.is_cached(key) for store, key in pending.values()):
+            # Everything is cached, a cheap version check is enough.
+            versions = self.backend.batch_get_versions(item_ids=pending.keys())
+            round_trips += 1
+            pending = {
+                item_id: (store, key)
+                for item_id, (store, key) in pending.items()
+                if not store.revalidate(key=key, version=versions[item_id])
+            }
+        if pending:
+            items = self.backend.batch_get(item_ids=pending.keys())
+            round_trips += 1
+            for item_id, (store, key) in pending.items():
+                store.fill_cache(key=key, item=items.get(item_id))
+        return round_trips
+
+    def _get_prefetch_targets(
+        self, conversation_keys: Dict[str, ConversationKey], chat_id: Optional[int]
+    ) -> Dict[str, Tuple[DynamoPersistentStore, Any]]:
+        targets: Dict[str, Tuple[DynamoPersistentStore, Any]] = {}
+        if self.single_item_per_chat:
+            chat_ids = {key[0] for key in conversation_keys.values()}
+            if chat_id is not None:
+                chat_ids.add(chat_id)
+            for target_chat_id in chat_ids:
+                targets[self.chat_state_store.get_item_id(key=target_chat_id)] = (self.chat_state_store, target_chat_id)
+            return targets
+        for name, key in conversation_keys.items():
+            conversation_store = self._get_conversation_store(name=name)
+            targets[conversation_store.get_item_id(key=key)] = (conversation_store, key)
+        if self.store_chat_data and chat_id is not None:
+            targets[self.chat_data_store.get_item_id(key=chat_id)] = (self.chat_data_store, chat_id)
+        return targets
+
+    def _get_legacy_prefetch_targets(
+        self, conversation_keys: Dict[str, ConversationKey], chat_id: Optional[int]
+    ) -> Dict[str, Tuple[DynamoPersistentStore, Any]]:
+        targets: Dict[str, Tuple[DynamoPersistentStore, Any]] = {}
+        chat_state_store = self.chat_state_store
+        unmigrated_chat_ids = {
+            target_chat_id
+            for target_chat_id in {key[0] for key in conversation_keys.values()} | {chat_id}
+            if target_chat_id is not None
+            and chat_state_store.is_cached(target_chat_id)
+            and chat_state_store.get_cached(target_chat_id) is None
+        }
+        legacy_chat_data_store = chat_state_store.legacy_chat_data_store
+        for target_chat_id in unmigrated_chat_ids:
+            targets[legacy_chat_data_store.get_item_id(key=target_chat_id)] = (legacy_chat_data_store, target_chat_id)
+        for name, key in conversation_keys.items():
+            if key[0] in unmigrated_chat_ids:
+                legacy_conversation_store = self._get_chat_state_conversation(name=name).legacy_store
+                targets[legacy_conversation_store.get_item_id(key=key)] = (legacy_conversation_store, key)
+        return targets
+
+    @contextmanager
+    def unit_of_work(self) -> Iterator[None]:
+        """
+        Defer all commits made inside the context, and write only the final value of each key with a single
+        Dynamo call when the context exits. Units of work are per thread, each thread flushes its own commits.
+        """
+        for store in self._get_stores():
+            store.start_unit_of_work()
+        try:
+            yield
+        finally:
+            # Including stores that joined during the unit of work.
+            for store in self._get_stores():
+                store.end_unit_of_work()
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all dirty items (of this thread's unit of work) that changed since they were read, and log the number
+        of Dynamo writes saved (compared to writing each item separately) and skipped (items that did not change).
+        Also called by the `Updater` on shutdown, so it waits for pending write-behind writes as well.
+        """
+        if self.write_behind_queue:
+            self.write_behind_queue.join()
+        dirty: List[Tuple[DynamoPersistentStore, Any, PersistentItem]] = []
+        writes_skipped = 0
+        for store in self._get_stores():
+            for key, item in store.drain_dirty_items():
+                if store.is_unchanged(key=key):
+                    writes_skipped += 1
+                    continue
+                dirty.append((store, key, item))
+        if not dirty:
+            if writes_skipped:
+                log.info("Flush complete, nothing changed", extra={"writes_skipped": writes_skipped})
+            return
+        items = [item for _, _, item in dirty]
+        with MeasureTime() as mt:
+            try:
+                self.backend.write(items=items)
+            except Exception:
+                for store, key, _ in dirty:
+                    store.evict(key=key)
+                raise
+        for store, key, item in dirty:
+            store.fill_cache(key=key, item=item)
+        writes_saved = len(items) - 1
+        log.info(
+            "Flush complete",
+            extra={
+                "item_count": len(items),
+                "writes_saved": writes_saved,
+                "writes_skipped": writes_skipped,
+                "duration_ms": mt.delta * SEC_TO_MS,
+            },
+        )
+
+    def _get_stores(self) -> List[DynamoPersistentStore]:
+        stores: List[DynamoPersistentStore] = list(self.conversation_store_dict.values())
+        stores.append(self.chat_state_store)
+        # Legacy stores are only read (for migration), but their reads are trusted during a unit of work as well.
+        stores.append(self.chat_state_store.legacy_chat_data_store)
+        stores.extend(conversation.legacy_store for conversation in self.chat_state_conversation_dict.values())
+        for store_name in ("user_data_store", "chat_data_store", "bot_data_store"):
+            store = getattr(self, store_name, None)
+            if store is not None:
+                stores.append(store)
+        return stores
 
     def get_user_data(self) -> UserDataDict:
         raise NotImplementedError
 
-    def get_chat_data(self) -> DynamoStoredChatData:
+    def get_chat_data(self) -> ChatDataDict:
+        if self.single_item_per_chat:
+            return self.chat_state_data
         return self.chat_data_store
 
+    def get_chat_data_digest(self, chat_id: int) -> Optional[str]:
+        """
+        The digest of the chat data as it was last read or written, or `None` if it is not known.
+        Only tracked for the default layout (in the single item layout, the digest covers the whole chat state).
+        """
+        if self.single_item_per_chat or not self.store_chat_data:
+            return None
+        return self.chat_data_store.get_digest(key=chat_id)
+
     def get_bot_data(self) -> BD:  # type: ignore
         raise NotImplementedError
 
@@ -55,14 +270,30 @@ class DynamoPersistence(BasePersistence):
         raise NotImplementedError
 
     def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
-        conversation_store = self.get_conversations(name=name)
-        conversation_store.set(key=key, data=new_state, commit=True)
+        if self.single_item_per_chat:
+            self._get_chat_state_conversation(name=name)[key] = new_state
+            self._commit(store=self.chat_state_store, key=key[0])
+            return
+        conversation_store = self._get_conversation_store(name=name)
+        conversation_store.set(key=key, data=new_state)
+        self._commit(store=conversation_store, key=key)
 
     def update_user_data(self, user_id: int, data: UD) -> None:
         raise NotImplementedError
 
     def update_chat_data(self, chat_id: int, data: CD) -> None:
-        self.chat_data_store.set(key=chat_id, data=data, commit=True)
+        if self.single_item_per_chat:
+            self.chat_state_data[chat_id] = data
+            self._commit(store=self.chat_state_store, key=chat_id)
+            return
+        self.chat_data_store.set(key=chat_id, data=data)
+        self._commit(store=self.chat_data_store, key=chat_id)
+
+    def _commit(self, store: DynamoPersistentStore, key: Any):
+        if self.write_behind_queue and not store.is_deferred:
+            self.write_behind_queue.put(store=store, key=key)
+            return
+        store.commit(key=key)
 
     def update_bot_data(self, data: BD) -> None:
         raise NotImplementedError
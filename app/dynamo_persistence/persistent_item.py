@@ -1,14 +1,43 @@
+import json
 import time
+import zlib
+from datetime import datetime, timezone
 from typing import Any, Dict, Optional
 
 from bot.config import get_config
-from pynamodb.attributes import JSONAttribute, NumberAttribute, UnicodeAttribute
+from pynamodb.attributes import (
+    BinaryAttribute,
+    JSONAttribute,
+    NumberAttribute,
+    TTLAttribute,
+    UnicodeAttribute,
+    VersionAttribute,
+)
 from pynamodb.expressions.condition import Condition
 from pynamodb.models import Model
 from pynamodb.settings import OperationSettings
 
 config = get_config()
 
+ZLIB_JSON_FORMAT = b"\x01"
+
+
+class CompressedJSONAttribute(BinaryAttribute):
+    """
+    Compact JSON compressed with zlib. The first byte marks the encoding format.
+    """
+
+    def serialize(self, value: Any) -> str:
+        serialized = json.dumps(value, separators=(",", ":")).encode()
+        return super().serialize(ZLIB_JSON_FORMAT + zlib.compress(serialized))
+
+    def deserialize(self, value: Any) -> Any:
+        payload = super().deserialize(value)
+        encoding_format, body = payload[:1], payload[1:]
+        if encoding_format != ZLIB_JSON_FORMAT:
+            raise ValueError(f"Unknown item data format: {encoding_format!r}")
+        return json.loads(zlib.decompress(body))
+
 
 class PersistentItem(Model):
     class Meta:
@@ -17,7 +46,30 @@ class PersistentItem(Model):
     item_id = UnicodeAttribute(hash_key=True)
     item_type = UnicodeAttribute(null=True)
     item_data = JSONAttribute(null=True)
+    item_data_compressed = CompressedJSONAttribute(null=True)
     updated_at = NumberAttribute()
+    version = VersionAttribute()
+    expires_at = TTLAttribute(null=True)
+
+    @property
+    def is_expired(self) -> bool:
+        # Dynamo deletes expired items lazily, so they might still be returned by reads.
+        return self.expires_at is not None and self.expires_at <= datetime.now(timezone.utc)
+
+    @property
+    def data(self) -> Any:
+        if self.is_expired:
+            return None
+        if self.item_data_compressed is not None:
+            return self.item_data_compressed
+        return self.item_data
+
+    @data.setter
+    def data(self, value: Any):
+        if config.persistence_compression and value is not None:
+            self.item_data, self.item_data_compressed = None, value
+        else:
+            self.item_data, self.item_data_compressed = value, None
 
     def save(
         self,
@@ -25,5 +77,8 @@ class PersistentItem(Model):
         settings: OperationSettings = OperationSettings.default,
         **kwargs,
     ) -> Dict[str, Any]:
-        self.updated_at = float(time.time())
+        self.touch()
         return super().save(condition=condition, settings=settings, **kwargs)
+
+    def touch(self):
+        self.updated_at = float(time.time())
@@ -1,15 +1,23 @@
+import hashlib
+import json
 import logging
-from typing import Any, Optional, Tuple
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+from bot.config import get_config
+from dynamo_persistence.backend import DynamoItemBackend, ItemBackend
 from dynamo_persistence.persistent_item import PersistentItem
-from pynamodb.exceptions import DoesNotExist as PynamoDoesNotExist
 from the_spymaster_util.measure_time import MeasureTime
 
 log = logging.getLogger(__name__)
+config = get_config()
 
 ConversationKey = Tuple[int, ...]
 
 SEC_TO_MS = 1000
+DEFAULT_TTL_TYPE = "default"
 
 
 class DoesNotExist(Exception):
@@ -17,57 +25,224 @@ class DoesNotExist(Exception):
         self.item_id = item_id
 
 
+class _UnitOfWork(threading.local):
+    """
+    Unit of work state, per thread, so concurrent units of work (e.g. of different chats) are flushed separately.
+    """
+
+    def __init__(self):
+        self.is_deferred = False
+        self.trusted_since = 0.0
+        self.dirty: Set[Any] = set()
+
+
 class DynamoPersistentStore:
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, backend: Optional[ItemBackend] = None, **kwargs):
         super().__init__(*args, **kwargs)
-        self._cache = {}
+        self.backend = backend or DynamoItemBackend()
+        self._cache: Dict[Any, Any] = {}
+        self._versions: Dict[Any, Optional[int]] = {}
+        self._validated_at: Dict[Any, float] = {}
+        self._digests: Dict[Any, str] = {}
+        # Keys whose cached value was replaced (or committed) since it was last read, written or found unchanged.
+        self._modified: Set[Any] = set()
+        self._expires_at: Dict[Any, Optional[datetime]] = {}
+        self._unit_of_work = _UnitOfWork()
 
     def __getitem__(self, key: ConversationKey):
-        if key in self._cache:
-            # This might be problematic with multiple lambdas: a lambda might keep cache from an old run,
-            # while in another lambda's cache (and in dynamo) the data is already newer.
-            # That's why it's important to call clear_cache() before / after each lambda run.
+        # The cache is kept between lambda runs, so a cached value might be older than the one in Dynamo.
+        # Cached values are trusted only if they were validated recently (or during the current unit of work),
+        # otherwise their version is compared to the stored one. Writes are conditioned on the version as well,
+        # so a stale value can never override a newer one.
+        if key in self._cache and self._validate(key=key):
             return self._cache[key]
         try:
-            self._cache[key] = self._read(key=key)
-            return self._cache[key]
+            item = self._read(key=key)
         except DoesNotExist as e:
             log.info(f"Item {e.item_id} does not exist")
-            return None
+            item = None
+        self.fill_cache(key=key, item=item)
+        return self._cache[key]
 
     def __setitem__(self, key: Any, value: Any):
         self._cache[key] = value
+        self._modified.add(key)
+        self._validated_at[key] = time.time()
 
     def __copy__(self):
         return self.copy()
 
     def copy(self):
-        return self.__class__()
+        return self.__class__(backend=self.backend)
 
     def clear_cache(self):
         self._cache.clear()
+        self._versions.clear()
+        self._validated_at.clear()
+        self._digests.clear()
+        self._modified.clear()
+        self._expires_at.clear()
+
+    @property
+    def is_deferred(self) -> bool:
+        return self._unit_of_work.is_deferred
+
+    def start_unit_of_work(self):
+        self._unit_of_work.is_deferred = True
+        self._unit_of_work.trusted_since = time.time() - config.persistence_cache_trust_seconds
+
+    def end_unit_of_work(self):
+        self._unit_of_work.is_deferred = False
+
+    def is_cached(self, key: Any) -> bool:
+        return key in self._cache
+
+    def is_trusted(self, key: Any) -> bool:
+        validated_at = self._validated_at.get(key)
+        if validated_at is None:
+            return False
+        # Outside a unit of work (e.g. when polling), every read gets its own trust window.
+        trusted_since = (
+            self._unit_of_work.trusted_since
+            if self.is_deferred
+            else time.time() - config.persistence_cache_trust_seconds
+        )
+        return validated_at >= trusted_since
+
+    def fill_cache(self, key: Any, item: Optional[PersistentItem]):
+        """
+        Cache an item that was just read from (or written to) Dynamo.
+        Missing items should be filled with `None`, so they are not read again.
+        """
+        self._cache[key] = item.data if item else None
+        self._versions[key] = item.version if item else None
+        self._validated_at[key] = time.time()
+        self._digests[key] = get_data_digest(self._cache[key])
+        self._modified.discard(key)
+        self._expires_at[key] = item.expires_at if item else None
+
+    def mark_written(self, key: Any, item: PersistentItem):
+        """
+        Like `fill_cache`, but keeps the cached value (which might have changed since the item was built).
+        """
+        self._versions[key] = item.version
+        self._validated_at[key] = time.time()
+        self._digests[key] = get_data_digest(item.data)
+        if self._cache.get(key) == item.data:
+            self._modified.discard(key)
+        self._expires_at[key] = item.expires_at
+
+    def get_cached(self, key: Any) -> Any:
+        return self._cache[key]
+
+    def is_unchanged(self, key: Any) -> bool:
+        """
+        True if the cached value of `key` is identical to the value last read from (or written to) Dynamo,
+        and its expiry does not need to be extended yet.
+        """
+        digest = self._digests.get(key)
+        if digest is None or key not in self._cache or get_data_digest(self._cache[key]) != digest:
+            return False
+        self._modified.discard(key)
+        return not self._is_expiring(key=key)
+
+    def get_digest(self, key: Any) -> Optional[str]:
+        """
+        The digest of the cached value of `key` (without computing it), or `None` if it is not known,
+        e.g. when the value was replaced since it was last read or written.
+        """
+        if key not in self._cache or key in self._modified:
+            return None
+        return self._digests.get(key)
+
+    def _is_expiring(self, key: Any) -> bool:
+        """
+        True if less than half of the item's TTL is left (so a write is needed to extend it).
+        """
+        expires_at = self._expires_at.get(key)
+        if expires_at is None:
+            return False
+        ttl = self._get_ttl(data=self._cache[key])
+        if ttl is None:
+            return False
+        return expires_at - datetime.now(timezone.utc) < ttl / 2
+
+    def revalidate(self, key: Any, version: Optional[int]) -> bool:
+        """
+        Compare the cached version of `key` with its current version in Dynamo.
+        Returns True if the cached value is up-to-date, otherwise evicts it and returns False.
+        """
+        if key in self._cache and self._versions.get(key) == version:
+            self._validated_at[key] = time.time()
+            return True
+        log.debug("Cached item is stale", extra={"item_id": self.get_item_id(key=key)})
+        self.evict(key=key)
+        return False
 
-    def _read(self, key: Any) -> Optional[Any]:
+    def evict(self, key: Any):
+        self._cache.pop(key, None)
+        self._versions.pop(key, None)
+        self._validated_at.pop(key, None)
+        self._digests.pop(key, None)
+        self._modified.discard(key)
+        self._expires_at.pop(key, None)
+        self._unit_of_work.dirty.discard(key)
+
+    def _validate(self, key: Any) -> bool:
+        if self.is_trusted(key=key):
+            return True
+        version = self._read_version(key=key)
+        return self.revalidate(key=key, version=version)
+
+    def _read(self, key: Any) -> PersistentItem:
         item_id = self.get_item_id(key=key)
-        log.debug("Reading from Dynamo", extra={"item_id": item_id})
+        log.debug("Reading item", extra={"item_id": item_id})
         with MeasureTime() as mt:
-            try:
-                persistence_item = PersistentItem.get(hash_key=item_id)
-            except PynamoDoesNotExist as e:
-                raise DoesNotExist(item_id=item_id) from e
-        data = persistence_item.item_data
+            persistence_item = self.backend.get(item_id=item_id)
+        if persistence_item is None:
+            raise DoesNotExist(item_id=item_id)
+        data = persistence_item.data
         log.debug("Read complete", extra={"item_id": item_id, "duration_ms": mt.delta * SEC_TO_MS, "data": data})
-        return data
+        return persistence_item
 
-    def _write(self, key: Any, data: Any):
+    def _read_version(self, key: Any) -> Optional[int]:
         item_id = self.get_item_id(key=key)
-        item_type = self.get_item_type()
-        item = PersistentItem(item_id=item_id, item_type=item_type, item_data=data)
-        log.debug("Writing to Dynamo", extra={"item_id": item_id, "item_data": data})
+        return self.backend.get_version(item_id=item_id)
+
+    def _write(self, key: Any, data: Any):
+        item = self.build_item(key=key, data=data)
+        item_id = item.item_id
+        log.debug("Writing item", extra={"item_id": item_id, "item_data": data})
         with MeasureTime() as mt:
-            item.save()
+            try:
+                self.backend.write(items=[item])
+            except Exception:
+                self.evict(key=key)
+                raise
+        self.fill_cache(key=key, item=item)
         log.debug("Write complete", extra={"item_id": item_id, "duration_ms": mt.delta * SEC_TO_MS})
 
+    def build_item(self, key: Any, data: Any) -> PersistentItem:
+        item_id = self.get_item_id(key=key)
+        item_type = self.get_item_type()
+        item = PersistentItem(item_id=item_id, item_type=item_type)
+        item.data = data
+        version = self._versions.get(key)
+        if version is not None:
+            item.version = version
+        ttl = self._get_ttl(data=data)
+        if ttl is not None:
+            item.expires_at = ttl
+        return item
+
+    def _get_ttl(self, data: Any) -> Optional[timedelta]:
+        ttl_seconds = config.persistence_ttl_seconds
+        ttl_type = self.get_ttl_type(data=data)
+        seconds = ttl_seconds.get(ttl_type) or ttl_seconds.get(DEFAULT_TTL_TYPE)
+        if not seconds:
+            return None
+        return timedelta(seconds=seconds)
+
     def get(self, key: Any, default: Any = None) -> Any:
         try:
             return self[key]
@@ -82,11 +257,40 @@ class DynamoPersistentStore:
     def commit(self, key: Any):
         if key not in self._cache:
             raise KeyError(key)
+        # The value might have been changed in place.
+        self._modified.add(key)
+        if self.is_deferred:
+            # Unit of work mode, only the final value of the key will be written on flush.
+            self._unit_of_work.dirty.add(key)
+            return
+        if self.is_unchanged(key=key):
+            log.debug("Item did not change, skipping write", extra={"item_id": self.get_item_id(key=key)})
+            return
         self._write(key=key, data=self._cache[key])
-        del self._cache[key]
+
+    def drain_dirty_items(self) -> List[Tuple[Any, PersistentItem]]:
+        """
+        Build the items for all keys committed in unit of work mode.
+        Once written, the caller should pass each item back to `fill_cache` (or `evict` its key on failure).
+        """
+        dirty = self._unit_of_work.dirty
+        items = [(key, self.build_item(key=key, data=self._cache[key])) for key in dirty if key in self._cache]
+        dirty.clear()
+        return items
 
     def get_item_id(self, key: Any) -> str:
         return f"{self.get_item_type()}::{key}"
 
     def get_item_type(self) -> str:
         raise NotImplementedError
+
+    def get_ttl_type(self, data: Any) -> str:
+        """
+        The key of `persistence_ttl_seconds` config that sets how long this data is kept.
+        """
+        return self.get_item_type()
+
+
+def get_data_digest(data: Any) -> str:
+    serialized = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
@@ -0,0 +1,120 @@
+import json
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from dynamo_persistence.backend import ItemBackend, VersionConflict
+from dynamo_persistence.persistent_item import PersistentItem
+from the_spymaster_util.measure_time import MeasureTime
+
+log = logging.getLogger(__name__)
+
+SEC_TO_MS = 1000
+CREATE_TABLE = "CREATE TABLE IF NOT EXISTS persistent_items (item_id TEXT PRIMARY KEY, version INTEGER, item TEXT)"
+SELECT_ITEM = "SELECT item FROM persistent_items WHERE item_id = ?"
+SELECT_VERSION = "SELECT version FROM persistent_items WHERE item_id = ?"
+INSERT_ITEM = "INSERT INTO persistent_items (item_id, version, item) VALUES (?, ?, ?)"
+UPDATE_ITEM = "UPDATE persistent_items SET version = ?, item = ? WHERE item_id = ? AND version = ?"
+DELETE_ITEM = "DELETE FROM persistent_items WHERE item_id = ? AND version = ?"
+# SQLite limits the number of parameters of a single statement.
+MAX_BATCH_SIZE = 500
+
+
+class SqliteItemBackend(ItemBackend):
+    """
+    Stores items in a local SQLite database (in WAL mode), for self-hosted polling deployments and benchmarks.
+    Items are kept in their Dynamo representation, so the same item can be moved between backends.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(CREATE_TABLE)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, item_id: str) -> Optional[PersistentItem]:
+        with self._lock:
+            row = self._connection.execute(SELECT_ITEM, (item_id,)).fetchone()
+        if row is None:
+            return None
+        return _deserialize(row[0])
+
+    def get_version(self, item_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._connection.execute(SELECT_VERSION, (item_id,)).fetchone()
+        return row[0] if row else None
+
+    def batch_get(self, item_ids: Iterable[str]) -> Dict[str, PersistentItem]:
+        items = {}
+        for row in self._select_many(columns="item_id, item", item_ids=item_ids):
+            items[row[0]] = _deserialize(row[1])
+        return items
+
+    def batch_get_versions(self, item_ids: Iterable[str]) -> Dict[str, Optional[int]]:
+        item_ids = set(item_ids)
+        versions = dict(self._select_many(columns="item_id, version", item_ids=item_ids))
+        return {item_id: versions.get(item_id) for item_id in item_ids}
+
+    def write(self, items: List[PersistentItem]):
+        """
+        Write all items in a single transaction, each conditioned on its version (like Dynamo's `VersionAttribute`).
+        """
+        if not items:
+            return
+        with MeasureTime() as mt, self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                new_versions = [self._write_item(item) for item in items]
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+        for item, version in zip(items, new_versions, strict=True):
+            item.version = version
+        log.debug("Items write complete", extra={"item_count": len(items), "duration_ms": mt.delta * SEC_TO_MS})
+
+    def delete(self, item: PersistentItem):
+        with self._lock:
+            cursor = self._connection.execute(DELETE_ITEM, (item.item_id, item.version))
+        if cursor.rowcount != 1:
+            raise VersionConflict(item_ids=[item.item_id])
+
+    def _write_item(self, item: PersistentItem) -> int:
+        item.touch()
+        current_version = item.version
+        new_version = (current_version or 0) + 1
+        raw_data = item.serialize()
+        raw_data["version"] = {"N": str(new_version)}
+        serialized = json.dumps(raw_data)
+        if current_version is None:
+            try:
+                self._connection.execute(INSERT_ITEM, (item.item_id, new_version, serialized))
+            except sqlite3.IntegrityError as e:
+                raise VersionConflict(item_ids=[item.item_id]) from e
+        else:
+            cursor = self._connection.execute(UPDATE_ITEM, (new_version, serialized, item.item_id, current_version))
+            if cursor.rowcount != 1:
+                raise VersionConflict(item_ids=[item.item_id])
+        return new_version
+
+    def _select_many(self, columns: str, item_ids: Iterable[str]) -> List[tuple]:
+        item_ids = list(item_ids)
+        rows: List[tuple] = []
+        with self._lock:
+            for i in range(0, len(item_ids), MAX_BATCH_SIZE):
+                chunk = item_ids[i : i + MAX_BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                query = f"SELECT {columns} FROM persistent_items WHERE item_id IN ({placeholders})"  # nosec
+                rows.extend(self._connection.execute(query, chunk).fetchall())
+        return rows
+
+
+def _deserialize(serialized: str) -> PersistentItem:
+    return PersistentItem.from_raw_data(json.loads(serialized))
@@ -1,15 +1,28 @@
-from typing import Any, DefaultDict
+from typing import Any, DefaultDict, Optional
 
-from dynamo_persistence.persistent_store import DynamoPersistentStore
+from dynamo_persistence.backend import ItemBackend
+from dynamo_persistence.persistent_store import ConversationKey, DynamoPersistentStore
 from telegram.ext.utils.types import CD, UD, ConversationDict
 
 ChatDataDict = DefaultDict[int, CD]
 UserDataDict = DefaultDict[int, UD]
 
+CHAT_DATA = "chat_data"
+CONVERSATIONS = "conversations"
+# Chat data of a board parsing session (see `bot.models.Session`), kept for a shorter period than game sessions.
+PARSING_STATE = "parsing_state"
+PARSING_TTL_TYPE = "parsing"
+
+
+def _get_chat_data_ttl_type(chat_data: Any, default: str) -> str:
+    if isinstance(chat_data, dict) and chat_data.get(PARSING_STATE):
+        return PARSING_TTL_TYPE
+    return default
+
 
 class DynamoStoredConversation(DynamoPersistentStore, ConversationDict):  # type: ignore
-    def __init__(self, conversation_name: str):
-        super().__init__()
+    def __init__(self, conversation_name: str, backend: Optional[ItemBackend] = None):
+        super().__init__(backend=backend)
         self.conversation_name = conversation_name
 
     def __getitem__(self, item):
@@ -31,6 +44,9 @@ class DynamoStoredChatData(DynamoPersistentStore, ChatDataDict):  # type: ignore
     def get_item_type(self) -> str:
         return "chat"
 
+    def get_ttl_type(self, data: Any) -> str:
+        return _get_chat_data_ttl_type(chat_data=data, default=self.get_item_type())
+
 
 class DynamoStoredUserData(DynamoPersistentStore, UserDataDict):  # type: ignore
     def get_item_type(self) -> str:
@@ -40,3 +56,109 @@ class DynamoStoredUserData(DynamoPersistentStore, UserDataDict):  # type: ignore
 class DynamoStoredBotData(DynamoPersistentStore, dict):  # type: ignore
     def get_item_type(self) -> str:
         return "bot"
+
+
+# Single item per chat layout
+
+
+class DynamoStoredChatState(DynamoPersistentStore, dict):  # type: ignore
+    """
+    All the state of a single chat (conversation states and chat data), stored as one item.
+    Chats that were not migrated yet start from their legacy chat data item.
+    """
+
+    def __init__(self, backend: Optional[ItemBackend] = None):
+        super().__init__(backend=backend)
+        self.legacy_chat_data_store = DynamoStoredChatData(backend=self.backend)
+
+    def __getitem__(self, chat_id):
+        chat_state = super().__getitem__(chat_id)
+        if chat_state is None:
+            legacy_chat_data = self.legacy_chat_data_store[chat_id]
+            chat_state = {CHAT_DATA: legacy_chat_data, CONVERSATIONS: {}}
+            self[chat_id] = chat_state
+        return chat_state
+
+    def get_item_type(self) -> str:
+        return "chat_state"
+
+    def get_ttl_type(self, data: Any) -> str:
+        chat_data = data.get(CHAT_DATA) if isinstance(data, dict) else None
+        return _get_chat_data_ttl_type(chat_data=chat_data, default=self.get_item_type())
+
+
+class DynamoStoredChatStateConversation(ConversationDict):  # type: ignore
+    """
+    A single conversation view over `DynamoStoredChatState`.
+    Conversation states that were never recorded in the chat state are migrated from their legacy item.
+    """
+
+    def __init__(self, conversation_name: str, chat_state_store: DynamoStoredChatState):
+        super().__init__()
+        self.conversation_name = conversation_name
+        self.chat_state_store = chat_state_store
+        self.legacy_store = DynamoStoredConversation(
+            conversation_name=conversation_name, backend=chat_state_store.backend
+        )
+
+    def __getitem__(self, key: ConversationKey):
+        conversations = self._get_conversations(key=key)
+        entry_id = self._get_entry_id(key=key)
+        if entry_id not in conversations:
+            conversations[entry_id] = self.legacy_store[key] or None
+        state = conversations[entry_id]
+        if state is None:
+            return 0
+        return state
+
+    def __setitem__(self, key: ConversationKey, state: Any):
+        conversations = self._get_conversations(key=key)
+        conversations[self._get_entry_id(key=key)] = state
+
+    def __delitem__(self, key: ConversationKey):
+        self[key] = None
+
+    def __contains__(self, key: Any) -> bool:
+        return self[key] != 0
+
+    def __copy__(self):
+        return self
+
+    def get(self, key: ConversationKey, default: Any = None) -> Any:
+        state = self[key]
+        if state == 0:
+            return default
+        return state
+
+    def _get_conversations(self, key: ConversationKey) -> dict:
+        chat_id = key[0]
+        return self.chat_state_store[chat_id][CONVERSATIONS]
+
+    def _get_entry_id(self, key: ConversationKey) -> str:
+        parts_concat = ":".join([str(k) for k in key])
+        return f"{self.conversation_name}:{parts_concat}"
+
+
+class DynamoStoredChatStateData(ChatDataDict):  # type: ignore
+    """
+    Chat data view over `DynamoStoredChatState`.
+    """
+
+    def __init__(self, chat_state_store: DynamoStoredChatState):
+        super().__init__()
+        self.chat_state_store = chat_state_store
+
+    def __getitem__(self, chat_id: int):
+        return self.chat_state_store[chat_id][CHAT_DATA]
+
+    def __setitem__(self, chat_id: int, data: Any):
+        self.chat_state_store[chat_id][CHAT_DATA] = data
+
+    def __copy__(self):
+        return self
+
+    def get(self, chat_id: int, default: Any = None) -> Any:
+        data = self[chat_id]
+        if data is None:
+            return default
+        return data
@@ -0,0 +1,190 @@
+import copy
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dynamo_persistence.backend import ItemBackend, VersionConflict
+from dynamo_persistence.persistent_item import PersistentItem
+from dynamo_persistence.persistent_store import DynamoPersistentStore
+from the_spymaster_util.measure_time import MeasureTime
+
+log = logging.getLogger(__name__)
+
+SEC_TO_MS = 1000
+# Dynamo transactions are limited in the number of items they may contain.
+MAX_BATCH_SIZE = 25
+MAX_WRITE_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 0.5
+
+PendingKey = Tuple[DynamoPersistentStore, Any]
+
+
+class WriteBehindError(Exception):
+    def __init__(self, item_ids: List[str]):
+        super().__init__(f"Write-behind failed to write items: {item_ids}")
+        self.item_ids = item_ids
+
+
+class WriteBehindQueue:
+    """
+    Writes committed keys from a background thread, so update handling does not wait for the backend.
+    Each queued key holds a snapshot of its latest value, so several commits of the same key are merged
+    into a single write. When the queue is full, committing blocks until the worker catches up.
+    Failed writes are retried, keys that still fail stay pending (and cached) until they are committed again
+    or `join` is called, which retries them and raises `WriteBehindError` if they fail again.
+    Keys whose write conflicted (changed by another writer) are dropped and evicted, so they are read again.
+    """
+
+    def __init__(self, backend: ItemBackend, max_size: int = 1000):
+        self.backend = backend
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._pending: Dict[Tuple[int, Any], Any] = {}
+        # Keys whose last write failed, their values are still pending but they are not queued.
+        self._failed: Dict[Tuple[int, Any], PendingKey] = {}
+        self._last_error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+
+    def put(self, store: DynamoPersistentStore, key: Any):
+        # Stores are dicts (so they are not hashable), pending values are kept by store identity.
+        pending_key = (id(store), key)
+        with self._lock:
+            if pending_key not in self._pending and store.is_unchanged(key=key):
+                log.debug("Item did not change, skipping write", extra={"item_id": store.get_item_id(key=key)})
+                return
+            is_queued = pending_key in self._pending and pending_key not in self._failed
+            self._failed.pop(pending_key, None)
+            # Snapshot the value, handlers may keep mutating it while it waits to be written.
+            self._pending[pending_key] = copy.deepcopy(store.get_cached(key=key))
+        if is_queued:
+            return
+        self._enqueue(store=store, key=key)
+
+    def join(self):
+        """
+        Block until all queued keys are written, retrying keys that failed before.
+        Raises `WriteBehindError` if any key failed to be written.
+        """
+        with self._lock:
+            failed = list(self._failed.values())
+            self._failed.clear()
+        for store, key in failed:
+            self._enqueue(store=store, key=key)
+        self._queue.join()
+        with self._lock:
+            if not self._failed:
+                return
+            item_ids = [store.get_item_id(key=key) for store, key in self._failed.values()]
+            error = self._last_error
+        raise WriteBehindError(item_ids=item_ids) from error
+
+    def _enqueue(self, store: DynamoPersistentStore, key: Any):
+        try:
+            self._queue.put_nowait((store, key))
+        except queue.Full:
+            log.warning("Write-behind queue is full, waiting for pending writes", extra={"size": self._queue.qsize()})
+            self._queue.put((store, key))
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch=batch)
+            except Exception as e:
+                log.exception(f"Write-behind batch failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[PendingKey]):
+        entries: List[Tuple[DynamoPersistentStore, Any, Any, PersistentItem]] = []
+        with self._lock:
+            for store, key in batch:
+                pending_key = (id(store), key)
+                if pending_key not in self._pending:
+                    # Dropped after a conflict.
+                    continue
+                data = self._pending.pop(pending_key)
+                entries.append((store, key, data, store.build_item(key=key, data=data)))
+        if not entries:
+            return
+        items = [item for _, _, _, item in entries]
+        with MeasureTime() as mt:
+            try:
+                self._write_with_retries(items=items)
+            except VersionConflict as e:
+                self._drop_conflicted(entries=entries, error=e)
+                return
+            except Exception as e:
+                self._keep_failed(entries=entries, error=e)
+                raise
+        with self._lock:
+            for store, key, _, item in entries:
+                # A newer value was written, so an earlier failure of the key no longer matters.
+                self._failed.pop((id(store), key), None)
+                store.mark_written(key=key, item=item)
+        log.info(
+            "Write-behind batch complete",
+            extra={"item_count": len(items), "queue_size": self._queue.qsize(), "duration_ms": mt.delta * SEC_TO_MS},
+        )
+
+    def _write_with_retries(self, items: List[PersistentItem]):
+        for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+            try:
+                self.backend.write(items=items)
+                return
+            except VersionConflict:
+                # Writing the same versions again would conflict again.
+                raise
+            except Exception as e:
+                if attempt == MAX_WRITE_ATTEMPTS:
+                    raise
+                log.warning(f"Write-behind batch failed, retrying: {e}", extra={"attempt": attempt})
+                time.sleep(RETRY_DELAY_SECONDS * attempt)
+
+    def _drop_conflicted(
+        self, entries: List[Tuple[DynamoPersistentStore, Any, Any, PersistentItem]], error: VersionConflict
+    ):
+        """
+        Conflicted keys were changed by another writer, so their snapshots (and cached values) are stale.
+        They are dropped and evicted, so the next read gets the stored value. The other keys of the batch
+        were not written (the batch is atomic), so they are kept to be retried.
+        """
+        conflicted_ids = set(error.item_ids)
+        log.warning("Write-behind dropped conflicted items", extra={"item_ids": sorted(conflicted_ids)})
+        kept = []
+        with self._lock:
+            for entry in entries:
+                store, key, _, item = entry
+                if item.item_id not in conflicted_ids:
+                    kept.append(entry)
+                    continue
+                pending_key = (id(store), key)
+                self._pending.pop(pending_key, None)
+                self._failed.pop(pending_key, None)
+                store.evict(key=key)
+        if kept:
+            self._keep_failed(entries=kept, error=error)
+
+    def _keep_failed(self, entries: List[Tuple[DynamoPersistentStore, Any, Any, PersistentItem]], error: Exception):
+        """
+        Keep the values of failed keys pending (unless a newer value was committed meanwhile), so they are not lost.
+        The stores keep their cached values as well, since they are newer than the stored ones.
+        """
+        with self._lock:
+            self._last_error = error
+            for store, key, data, _ in entries:
+                pending_key = (id(store), key)
+                if pending_key in self._pending:
+                    # Committed again while being written, so it is already queued with a newer value.
+                    continue
+                self._pending[pending_key] = data
+                self._failed[pending_key] = (store, key)
@@ -1,8 +1,10 @@
 import json
+from typing import Any, List, Optional
 
 import sentry_sdk
 from bot.config import configure_logging, configure_sentry, get_config
 from bot.the_spymaster_bot import TheSpymasterBot
+from bot.update_queue import SqsUpdateQueue, UpdateQueue
 from the_spymaster_util.logger import get_logger
 from util import create_response, json_safe
 
@@ -15,23 +17,37 @@ bot = TheSpymasterBot(
     telegram_token=config.telegram_token,
     server_host=config.base_backend_url,
     dynamo_persistence=True,
+    lazy_handlers=config.lazy_handlers,
 )
+# Fast-ack mode: updates are queued by `handle`, and handled by `handle_queued`.
+update_queue = SqsUpdateQueue(queue_url=config.update_queue_url) if config.update_queue_url else None
 log.info("Bootstrap complete.")
 
 
 def handle(event: dict, context=None):
     try:
         log.reset_context()
-        log.info("Received event", extra={"event": event})
+        bot.send_pipeline.set_deadline(_get_seconds_left(context=context))
         body = event.get("body")
         if not body:
-            log.info("No body in event, ignoring")
+            log.info("No body in event, ignoring", extra={"event": event})
             return create_response(400, data={"message": "No body in event"})
         try:
             update_data = json.loads(body)
         except json.JSONDecodeError as e:
-            log.warning("Error decoding JSON")
+            log.warning("Error decoding JSON", extra={"event": event})
             return create_response(400, data={"message": "Error decoding JSON", "error": str(e)})
+        if not isinstance(update_data, (dict, list)):
+            log.warning("Invalid update, ignoring", extra={"event": event})
+            return create_response(400, data={"message": "Invalid update"})
+        # Irrelevant updates are dropped before they are logged, queued or parsed.
+        if isinstance(update_data, dict) and bot.update_filter.should_ignore(update_data):
+            return create_response(200, data={"result": None})
+        log.info("Received event", extra={"event": event})
+        if isinstance(update_data, list):
+            return _process_batch(updates=update_data)
+        if update_queue and "action" not in update_data:
+            return _enqueue(queue=update_queue, update_data=update_data)
         result = bot.process_update(update_data)
         return create_response(200, data={"result": json_safe(result)})
     except Exception as e:
@@ -39,3 +55,62 @@ def handle(event: dict, context=None):
         sentry_sdk.capture_exception(e)
         sentry_sdk.flush(timeout=5)
         return create_response(500, data={"message": "Error handling event"})
+
+
+def handle_queued(event: dict, context=None):
+    """
+    Handle a batch of queued updates (of an SQS event source). Failed updates are reported as batch item failures,
+    so only they (and the following updates of their chats) are retried.
+    """
+    log.reset_context()
+    bot.send_pipeline.set_deadline(_get_seconds_left(context=context))
+    records = event.get("Records", [])
+    log.info("Received queued updates", extra={"update_count": len(records)})
+    failures, parsed_records, updates = [], [], []
+    for record in records:
+        try:
+            updates.append(json.loads(record["body"]))
+        except Exception as e:
+            # Only the bad record fails, it is sent to the dead-letter queue once its retries run out.
+            log.exception("Error decoding queued update", extra={"message_id": record.get("messageId")})
+            sentry_sdk.capture_exception(e)
+            failures.append({"itemIdentifier": record.get("messageId")})
+            continue
+        parsed_records.append(record)
+    # SQS FIFO already deduplicates queued updates, a redelivered update is one that was not handled.
+    errors = _process_updates(updates=updates, deduplicate=False) if updates else []
+    failures += [
+        {"itemIdentifier": record["messageId"]} for record, error in zip(parsed_records, errors, strict=True) if error
+    ]
+    if failures:
+        sentry_sdk.flush(timeout=5)
+    return {"batchItemFailures": failures}
+
+
+def _get_seconds_left(context) -> Optional[float]:
+    if context is None:
+        return None
+    return context.get_remaining_time_in_millis() / 1000
+
+
+def _process_batch(updates: List[dict]):
+    errors = _process_updates(updates=updates)
+    failures = [{"index": index, "error": str(error)} for index, error in enumerate(errors) if error]
+    return create_response(200, data={"update_count": len(updates), "failures": failures})
+
+
+def _process_updates(updates: List[dict], deduplicate: bool = True) -> List[Optional[Exception]]:
+    errors = bot.process_updates(updates, deduplicate=deduplicate)
+    for error in set(filter(None, errors)):
+        sentry_sdk.capture_exception(error)
+    if any(errors):
+        sentry_sdk.flush(timeout=5)
+    return errors
+
+
+def _enqueue(queue: UpdateQueue, update_data: Any):
+    if not isinstance(update_data, dict) or not isinstance(update_data.get("update_id"), int):
+        log.warning("Invalid update, ignoring")
+        return create_response(400, data={"message": "Invalid update"})
+    queue.put(update_data)
+    return create_response(200, data={"result": "queued"})
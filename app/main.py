@@ -12,6 +12,8 @@ def main():
         telegram_token=config.telegram_token,
         server_host=config.base_backend_url,
         dynamo_persistence=True,
+        sqlite_persistence_path=config.persistence_sqlite_path,
+        write_behind=config.persistence_write_behind,
     )
     bot.poll()
 
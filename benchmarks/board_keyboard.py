@@ -0,0 +1,55 @@
+"""
+Per-call cost of rendering the board keyboard, before (`BeautifulTable` on every call) and after (memoized).
+Run from the repository root: `PYTHONPATH=app python benchmarks/board_keyboard.py`.
+"""
+
+import timeit
+
+from bot.handlers.other.event_handler import build_board_keyboard
+from bot.models import COMMAND_TO_INDEX
+from codenames.classic.board import ClassicBoard
+from codenames.classic.color import ClassicColor
+from codenames.classic.types import ClassicCard
+from telegram import ReplyKeyboardMarkup
+
+COLORS = [ClassicColor.BLUE] * 9 + [ClassicColor.RED] * 8 + [ClassicColor.NEUTRAL] * 7 + [ClassicColor.ASSASSIN]
+CALLS = 2000
+
+
+def _build_board() -> ClassicBoard:
+    cards = [ClassicCard(word=f"word{i}", color=color, revealed=i % 3 == 0) for i, color in enumerate(COLORS)]
+    return ClassicBoard(language="english", cards=cards)
+
+
+def _legacy_build_board_keyboard(board: ClassicBoard, is_game_over: bool) -> ReplyKeyboardMarkup:
+    board_to_send = board if is_game_over else board.censored
+    reply_keyboard = []
+    # Keep a reference to the table, its rows only hold a weak reference to it.
+    table = board_to_send.as_table
+    for row in table.rows:
+        row_keyboard = []
+        for card in row:
+            if is_game_over:
+                content = f"{card.color.emoji} {card.word}"
+            else:
+                content = card.color.emoji if card.revealed else card.word
+            row_keyboard.append(content)
+        reply_keyboard.append(row_keyboard)
+    reply_keyboard.append(list(COMMAND_TO_INDEX.keys()))
+    return ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True)
+
+
+def main():
+    board = _build_board()
+    assert (
+        _legacy_build_board_keyboard(board, is_game_over=False).keyboard
+        == build_board_keyboard(board, is_game_over=False).keyboard
+    )
+    before = timeit.timeit(lambda: _legacy_build_board_keyboard(board, is_game_over=False), number=CALLS)
+    after = timeit.timeit(lambda: build_board_keyboard(board, is_game_over=False), number=CALLS)
+    print(f"before: {before / CALLS * 1e6:.1f} us/call")
+    print(f"after:  {after / CALLS * 1e6:.1f} us/call ({before / after:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
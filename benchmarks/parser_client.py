@@ -0,0 +1,60 @@
+"""
+Per-call cost of parser requests against a local stub server, before (a new connection per `requests.get`)
+and after (`ParserClient` with a pooled keep-alive session). The stub serves plain HTTP, so only the TCP
+handshake is saved here; against the real (HTTPS) parser the TLS handshake is saved as well.
+Run from the repository root: `PYTHONPATH=app python benchmarks/parser_client.py`.
+"""
+
+import json
+import threading
+import timeit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from bot.parser_client import ParserClient
+
+CALLS = 300
+PAYLOAD = {"board_image_b64": "a" * 100_000, "language": "eng"}
+RESPONSE = json.dumps({"words": ["word"] * 25}).encode()
+
+
+class StubParserHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # noqa: N802
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubParserHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    client = ParserClient(base_url=base_url)
+
+    def legacy_call():
+        response = requests.get(url=f"{base_url}/parse-board", json=PAYLOAD, timeout=80)
+        response.raise_for_status()
+        return response.json().get("words")
+
+    def pooled_call():
+        return client.parse_board(photo_base64=PAYLOAD["board_image_b64"], language=PAYLOAD["language"])
+
+    assert legacy_call() == pooled_call()
+    before = timeit.timeit(legacy_call, number=CALLS)
+    after = timeit.timeit(pooled_call, number=CALLS)
+    server.shutdown()
+    print(f"before: {before / CALLS * 1e3:.2f} ms/call")
+    print(f"after:  {after / CALLS * 1e3:.2f} ms/call ({(before - after) / CALLS * 1e3:.2f} ms saved)")
+
+
+if __name__ == "__main__":
+    main()
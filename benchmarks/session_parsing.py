@@ -0,0 +1,53 @@
+"""
+Per-update CPU spent on loading the session from chat data, before (full validation on every update)
+and after (`SessionCache`, validating only chat data whose stored digest is not known to match a cached session).
+The chat data goes through `DynamoPersistence` (with a local SQLite backend), like it does in production.
+Run from the repository root: `PYTHONPATH=app python benchmarks/session_parsing.py`.
+"""
+
+import tempfile
+import timeit
+from pathlib import Path
+
+from bot.models import AVAILABLE_MODELS, GameConfig, ParsingState, Session
+from bot.session_cache import SessionCache
+from dynamo_persistence.persistence import DynamoPersistence
+from dynamo_persistence.sqlite_backend import SqliteItemBackend
+
+CALLS = 5000
+CHAT_ID = 1
+
+
+def _build_session() -> Session:
+    config = GameConfig(language="english", model_identifier=AVAILABLE_MODELS[0])
+    parsing_state = ParsingState(language="english", words=[f"word{i}" for i in range(25)])
+    return Session(game_id="abcd1234", config=config, parsing_state=parsing_state, last_keyboard_message_id=42)
+
+
+def _load(cache: SessionCache, persistence: DynamoPersistence, chat_data: dict) -> Session:
+    digest = persistence.get_chat_data_digest(chat_id=CHAT_ID)
+    return cache.load(chat_id=CHAT_ID, chat_data=chat_data, digest=digest)
+
+
+def main():
+    session = _build_session()
+    cache = SessionCache()
+    with tempfile.TemporaryDirectory() as directory:
+        persistence = DynamoPersistence(backend=SqliteItemBackend(path=str(Path(directory) / "persistence.db")))
+        with persistence.unit_of_work():
+            # Like the dispatcher, which stores a copy of the chat data set by the handler.
+            persistence.update_chat_data(chat_id=CHAT_ID, data=cache.dump(chat_id=CHAT_ID, session=session))
+        with persistence.unit_of_work():
+            chat_data = persistence.get_chat_data()[CHAT_ID]
+            assert _load(cache=cache, persistence=persistence, chat_data=chat_data) is session
+            assert Session.model_validate(chat_data) == session
+            before = timeit.timeit(lambda: Session.model_validate(chat_data), number=CALLS)
+            after = timeit.timeit(
+                lambda: _load(cache=cache, persistence=persistence, chat_data=chat_data), number=CALLS
+            )
+    print(f"before: {before / CALLS * 1e6:.1f} us/update")
+    print(f"after:  {after / CALLS * 1e6:.1f} us/update ({(before - after) / CALLS * 1e6:.1f} us saved)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import pytest
+from bot.handlers.other.event_handler import build_board_keyboard
+from bot.models import COMMAND_TO_INDEX
+from codenames.classic.board import ClassicBoard
+from codenames.classic.color import ClassicColor
+from codenames.classic.types import ClassicCard
+
+
+def _build_board(size: int) -> ClassicBoard:
+    colors = [ClassicColor.BLUE, ClassicColor.RED, ClassicColor.NEUTRAL]
+    cards = [ClassicCard(word=f"word{i}", color=colors[i % 3], revealed=i % 4 == 0) for i in range(size - 1)]
+    cards.append(ClassicCard(word="assassin", color=ClassicColor.ASSASSIN))
+    return ClassicBoard(language="english", cards=cards)
+
+
+def _build_table_keyboard(board: ClassicBoard, is_game_over: bool) -> list:
+    board_to_send = board if is_game_over else board.censored
+    table = board_to_send.as_table
+    keyboard = []
+    for row in table.rows:
+        if is_game_over:
+            keyboard.append([f"{card.color.emoji} {card.word}" for card in row])
+        else:
+            keyboard.append([card.color.emoji if card.revealed else card.word for card in row])
+    keyboard.append(list(COMMAND_TO_INDEX.keys()))
+    return keyboard
+
+
+def _texts(keyboard: list) -> list:
+    return [[button.text for button in row] for row in keyboard]
+
+
+@pytest.mark.parametrize("size", [20, 24, 25])
+@pytest.mark.parametrize("is_game_over", [False, True])
+def test_board_keyboard_matches_board_table(size: int, is_game_over: bool):
+    board = _build_board(size=size)
+    expected = _build_table_keyboard(board=board, is_game_over=is_game_over)
+    fresh = build_board_keyboard(board=board, is_game_over=is_game_over)
+    assert _texts(fresh.keyboard) == expected
+    memoized = build_board_keyboard(board=board, is_game_over=is_game_over)
+    assert memoized is fresh
+
+
+def test_board_keyboard_shows_words_of_unknown_colors():
+    cards = [ClassicCard(word="word", color=None), ClassicCard(word="blue", color=ClassicColor.BLUE, revealed=True)]
+    board = ClassicBoard(language="english", cards=cards)
+    keyboard = _texts(build_board_keyboard(board=board, is_game_over=True).keyboard)
+    assert keyboard[0] == ["word", f"{ClassicColor.BLUE.emoji} blue"]
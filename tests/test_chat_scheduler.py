@@ -0,0 +1,29 @@
+import threading
+
+from bot.chat_scheduler import ChatScheduler
+
+
+def test_chats_run_concurrently_and_in_order():
+    scheduler = ChatScheduler(max_workers=2)
+    slow_chat_started, release = threading.Event(), threading.Event()
+    handled = []
+
+    def handle(chat_id: int, index: int):
+        if chat_id == 1 and index == 0:
+            slow_chat_started.set()
+            release.wait(timeout=5)
+        handled.append((chat_id, index))
+
+    for index in range(3):
+        for chat_id in (1, 2):
+            scheduler.submit(chat_id=chat_id, task=lambda c=chat_id, i=index: handle(c, i))
+    assert slow_chat_started.wait(timeout=5)
+    # The slow update of chat 1 does not block chat 2.
+    for _ in range(100):
+        if len(handled) == 3:
+            break
+        threading.Event().wait(0.01)
+    assert handled == [(2, 0), (2, 1), (2, 2)]
+    release.set()
+    scheduler.shutdown(wait=True)
+    assert [index for chat_id, index in handled if chat_id == 1] == [0, 1, 2]
@@ -0,0 +1,47 @@
+from unittest.mock import MagicMock
+
+from bot.handlers.other.event_handler import EventHandler
+from bot.models import Session
+from codenames.classic.state import ClassicGameState
+
+
+def _handler(state: ClassicGameState) -> EventHandler:
+    bot = MagicMock()
+    bot.api_client.classic.get_game_state.return_value.game_state = state
+    session = Session(game_id="abc")
+    return EventHandler(bot=bot, update=MagicMock(), context=MagicMock(), chat_id=1, session=session)
+
+
+def test_cached_game_state_is_used():
+    state = ClassicGameState.from_language("english")
+    handler = _handler(state=state)
+    assert handler.get_game_state() is state
+    cached_state = handler.get_game_state()
+    assert handler.api_client.classic.get_game_state.call_count == 1
+    assert cached_state.board == state.board
+    assert cached_state.score == state.score
+    assert cached_state.current_team == state.current_team
+    assert cached_state.current_player_role == state.current_player_role
+
+
+def test_stale_game_state_is_not_used():
+    handler = _handler(state=ClassicGameState.from_language("english"))
+    handler.get_game_state()
+    # A snapshot of an earlier move, left behind by a failed handler.
+    handler.update_session(move_count=handler.session.move_count + 1)
+    handler.get_game_state()
+    assert handler.api_client.classic.get_game_state.call_count == 2
+    # Snapshots of other versions (like full game state dumps) are dropped.
+    full_dump = ClassicGameState.from_language("english").model_dump(mode="json")
+    assert Session.model_validate({"game_id": "abc", "game_state": full_dump}).game_state is None
+
+
+def test_forget_game_state():
+    handler = _handler(state=ClassicGameState.from_language("english"))
+    handler.get_game_state()
+    handler.forget_game_state()
+    assert handler.session.game_state is None
+    assert handler.session.move_count == 1
+    handler.get_game_state()
+    assert handler.api_client.classic.get_game_state.call_count == 2
+    assert handler.session.game_state.move_count == 1
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+APP_DIR = Path(__file__).parents[1] / "app"
+COLD_START_MODULE = "lambda_handler"
+# Generous, measured imports are slower than regular ones. Meant to catch big regressions, not small ones.
+IMPORT_TIME_BUDGET_SECONDS = 2
+# Only needed once an update is handled, see `TheSpymasterBot.lazy_handlers`.
+DEFERRED_MODULES = (
+    "bot.handlers",
+    "bot.models",
+    "bot.parser_client",
+    "codenames",
+    "the_spymaster_api",
+    "the_spymaster_solvers_api",
+)
+US_TO_SEC = 1 / 1_000_000
+
+
+def _import_times(module: str) -> List[Tuple[str, float]]:
+    """
+    Import the module in a fresh interpreter, and return the self import time (in seconds) of every module imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        import_times.append((name.strip(), int(self_us) * US_TO_SEC))
+    return import_times
+
+
+def _breakdown(import_times: List[Tuple[str, float]], top: int = 15) -> str:
+    by_package: Dict[str, float] = defaultdict(float)
+    for name, seconds in import_times:
+        by_package[name.split(".")[0]] += seconds
+    slowest = sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+    return "\n".join(f"{seconds * 1000:8.1f} ms  {package}" for package, seconds in slowest)
+
+
+def test_cold_start_import_time_is_within_budget():
+    import_times = _import_times(COLD_START_MODULE)
+    total = sum(seconds for _, seconds in import_times)
+    breakdown = _breakdown(import_times)
+    print(f"\nImporting {COLD_START_MODULE} took {total:.3f} seconds:\n{breakdown}")
+    assert total < IMPORT_TIME_BUDGET_SECONDS, breakdown
+    deferred = [name for name, _ in import_times if name.startswith(DEFERRED_MODULES)]
+    assert not deferred
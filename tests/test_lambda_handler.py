@@ -0,0 +1,36 @@
+import json
+from unittest.mock import patch
+
+import lambda_handler
+from lambda_handler import handle, handle_queued
+
+
+def _record(message_id: str, body: str) -> dict:
+    return {"messageId": message_id, "body": body}
+
+
+def _update(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "from": {"id": chat_id}, "text": "hi"}}
+
+
+def test_invalid_update_body_is_rejected():
+    response = handle({"body": json.dumps("not an update")})
+    assert response["statusCode"] == 400
+
+
+def test_redelivered_queued_update_is_handled():
+    update = _update(update_id=101, chat_id=1)
+    # Handling started (and timed out) in a previous invocation.
+    lambda_handler.bot.is_duplicate(update)
+    with patch.object(lambda_handler.bot, "dispatch") as dispatch:
+        result = handle_queued({"Records": [_record("1", json.dumps(update))]})
+    assert result == {"batchItemFailures": []}
+    dispatch.assert_called_once()
+
+
+def test_bad_queued_record_fails_alone():
+    records = [_record("1", "{not json"), _record("2", json.dumps(_update(update_id=102, chat_id=2)))]
+    with patch.object(lambda_handler.bot, "dispatch") as dispatch:
+        result = handle_queued({"Records": records})
+    assert result == {"batchItemFailures": [{"itemIdentifier": "1"}]}
+    dispatch.assert_called_once()
@@ -0,0 +1,23 @@
+from bot.handlers.other.message_buffer import MARKDOWN, BufferedMessage, MessageBuffer
+from telegram.constants import MAX_MESSAGE_LENGTH
+
+
+def test_adjacent_messages_are_merged():
+    buffer = MessageBuffer()
+    buffer.add("*3* remaining card(s)", parse_mode=MARKDOWN)
+    buffer.add("Blue spymaster is thinking... _")
+    buffer.add("Blue spymaster says '*word*'", parse_mode=MARKDOWN)
+    assert buffer.drain() == [
+        BufferedMessage(
+            text="*3* remaining card(s)\nBlue spymaster is thinking... \\_\nBlue spymaster says '*word*'",
+            parse_mode=MARKDOWN,
+        )
+    ]
+    assert not buffer
+
+
+def test_long_messages_are_split():
+    buffer = MessageBuffer()
+    for _ in range(3):
+        buffer.add("a" * (MAX_MESSAGE_LENGTH // 2 - 1))
+    assert [len(message.text) for message in buffer.drain()] == [MAX_MESSAGE_LENGTH - 1, MAX_MESSAGE_LENGTH // 2 - 1]
@@ -0,0 +1,291 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from bot.config import Config
+from dynamo_persistence.backend import DynamoItemBackend, VersionConflict
+from dynamo_persistence.persistence import DynamoPersistence
+from dynamo_persistence.persistent_item import PersistentItem
+from dynamo_persistence.sqlite_backend import SqliteItemBackend
+from dynamo_persistence.write_behind import WriteBehindError
+from freezegun import freeze_time
+from pynamodb.exceptions import (
+    CancellationReason,
+    TransactWriteError,
+    VerboseClientError,
+)
+
+
+def _item(item_id: str, item_data, version: int = 1) -> PersistentItem:
+    return PersistentItem(item_id=item_id, item_data=item_data, updated_at=0, version=version)
+
+
+def test_prefetch_fills_caches_with_single_batch_read():
+    persistence = DynamoPersistence()
+    items = [_item("conversation::main:1:2", 30), _item("chat::1", {"game_id": "abc"})]
+    with persistence.unit_of_work():
+        with patch.object(PersistentItem, "batch_get", return_value=items) as batch_get:
+            reads_saved = persistence.prefetch(conversation_keys={"main": (1, 2)}, chat_id=1)
+        assert batch_get.call_count == 1
+        assert reads_saved == 1
+        with patch.object(PersistentItem, "get") as get:
+            assert persistence.get_conversations("main")[(1, 2)] == 30
+            assert persistence.get_chat_data()[1] == {"game_id": "abc"}
+    get.assert_not_called()
+
+
+def test_prefetch_caches_missing_items():
+    persistence = DynamoPersistence()
+    with persistence.unit_of_work():
+        with patch.object(PersistentItem, "batch_get", return_value=[]):
+            persistence.prefetch(conversation_keys={"main": (1, 2)}, chat_id=1)
+        with patch.object(PersistentItem, "get") as get:
+            assert persistence.get_conversations("main")[(1, 2)] == 0
+            assert persistence.get_chat_data()[1] is None
+    get.assert_not_called()
+
+
+@patch.object(Config, "persistence_cache_trust_seconds", 2)
+def test_prefetch_validates_warm_cache_by_version():
+    persistence = DynamoPersistence()
+    items = [_item("conversation::main:1:2", 30, version=3), _item("chat::1", {"game_id": "abc"}, version=7)]
+    with freeze_time("2024-01-01 10:00:00"), patch.object(PersistentItem, "batch_get", return_value=items):
+        persistence.prefetch(conversation_keys={"main": (1, 2)}, chat_id=1)
+    # Next run (after the trust window): the chat data was changed by another container.
+    versions = [_item("conversation::main:1:2", None, version=3), _item("chat::1", None, version=8)]
+    fresh = [_item("chat::1", {"game_id": "def"}, version=8)]
+    with freeze_time("2024-01-01 10:00:10"), persistence.unit_of_work():
+        with patch.object(PersistentItem, "batch_get", side_effect=[versions, fresh]) as batch_get:
+            reads_saved = persistence.prefetch(conversation_keys={"main": (1, 2)}, chat_id=1)
+        assert batch_get.call_args_list[1].args[0] == {"chat::1"}
+        assert reads_saved == 0
+        assert persistence.get_conversations("main")[(1, 2)] == 30
+        assert persistence.get_chat_data()[1] == {"game_id": "def"}
+
+
+def test_unit_of_work_writes_final_values_once():
+    persistence = DynamoPersistence()
+    persistence.get_conversations("main")
+    with patch.object(DynamoItemBackend, "write") as write_items:
+        with persistence.unit_of_work():
+            persistence.update_conversation(name="main", key=(1, 2), new_state=30)
+            persistence.update_chat_data(chat_id=1, data={"game_id": "abc"})
+            persistence.update_chat_data(chat_id=1, data={"game_id": "def"})
+    assert write_items.call_count == 1
+    written = {item.item_id: item.item_data for item in write_items.call_args.kwargs["items"]}
+    assert written == {"conversation::main:1:2": 30, "chat::1": {"game_id": "def"}}
+
+
+def test_version_conflict_evicts_cached_item():
+    persistence = DynamoPersistence()
+    with patch.object(PersistentItem, "batch_get", return_value=[_item("chat::1", {"game_id": "abc"}, version=2)]):
+        persistence.prefetch(conversation_keys={}, chat_id=1)
+    conflict = VersionConflict(item_ids=["chat::1"])
+    with patch.object(DynamoItemBackend, "write", side_effect=conflict) as write_items:
+        with pytest.raises(VersionConflict):
+            with persistence.unit_of_work():
+                persistence.update_chat_data(chat_id=1, data={"game_id": "def"})
+    assert write_items.call_args.kwargs["items"][0].version == 2
+    assert not persistence.get_chat_data().is_cached(1)
+
+
+def _transaction_canceled(*codes) -> TransactWriteError:
+    reasons = [CancellationReason(code=code, message=None) if code else None for code in codes]
+    error_response = {"Error": {"Code": "TransactionCanceledException", "Message": "Transaction cancelled"}}
+    cause = VerboseClientError(error_response, "TransactWriteItems", cancellation_reasons=reasons)
+    return TransactWriteError("Failed to write transaction items", cause=cause)
+
+
+def test_canceled_transaction_is_a_conflict_only_if_a_condition_failed():
+    items = [_item("conversation::main:1:2", 30), _item("chat::1", {"game_id": "abc"})]
+    conflict = _transaction_canceled(None, "ConditionalCheckFailed")
+    with patch("dynamo_persistence.backend._transact_write", side_effect=conflict):
+        with pytest.raises(VersionConflict) as e:
+            DynamoItemBackend().write(items)
+    assert e.value.item_ids == ["chat::1"]
+    throttled = _transaction_canceled("ThrottlingError", "ConditionalCheckFailed")
+    with patch("dynamo_persistence.backend._transact_write", side_effect=throttled):
+        with pytest.raises(TransactWriteError):
+            DynamoItemBackend().write(items)
+
+
+@patch.object(Config, "persistence_cache_trust_seconds", 2)
+def test_cached_items_are_revalidated_outside_unit_of_work():
+    persistence = DynamoPersistence()
+    with freeze_time("2024-01-01 10:00:00"):
+        with patch.object(PersistentItem, "batch_get", return_value=[_item("chat::1", {"game_id": "abc"})]):
+            persistence.prefetch(conversation_keys={}, chat_id=1)
+        with patch.object(DynamoItemBackend, "get_version") as get_version:
+            assert persistence.get_chat_data()[1] == {"game_id": "abc"}
+        get_version.assert_not_called()
+    # Polling mode: no unit of work, the chat data was changed by another process.
+    with freeze_time("2024-01-01 10:00:10"):
+        with patch.object(DynamoItemBackend, "get_version", return_value=2), patch.object(
+            DynamoItemBackend, "get", return_value=_item("chat::1", {"game_id": "def"}, version=2)
+        ):
+            assert persistence.get_chat_data()[1] == {"game_id": "def"}
+
+
+def test_unchanged_items_are_not_written():
+    persistence = DynamoPersistence()
+    items = [_item("conversation::main:1:2", 30), _item("chat::1", {"game_id": "abc"})]
+    with patch.object(PersistentItem, "batch_get", return_value=items):
+        persistence.prefetch(conversation_keys={"main": (1, 2)}, chat_id=1)
+    with patch.object(DynamoItemBackend, "write") as write_items:
+        with persistence.unit_of_work():
+            persistence.update_conversation(name="main", key=(1, 2), new_state=30)
+            persistence.update_chat_data(chat_id=1, data={"game_id": "abc"})
+    write_items.assert_not_called()
+
+
+def test_compressed_item_data_round_trip():
+    data = {"game_id": "abc", "parsing_state": {"words": ["word"] * 25, "card_colors": ["BLUE"] * 25}}
+    with patch.object(Config, "persistence_compression", True):
+        item = _item("chat::1", None)
+        item.data = data
+    serialized = item.serialize()
+    assert "item_data" not in serialized
+    loaded = PersistentItem.from_raw_data(serialized)
+    assert loaded.data == data
+    legacy = PersistentItem.from_raw_data(_item("chat::1", data).serialize())
+    assert legacy.data == data
+
+
+def test_single_item_per_chat_migrates_legacy_items():
+    persistence = DynamoPersistence(single_item_per_chat=True)
+    conversations = persistence.get_conversations("main")
+    legacy_items = {"chat::1": _item("chat::1", {"game_id": "abc"}), "conversation::main:1:2": _item("", 30)}
+    with patch.object(DynamoItemBackend, "write") as write_items:
+        with persistence.unit_of_work():
+            # Not prefetched, the legacy items are read one by one.
+            persistence.chat_state_store.fill_cache(key=1, item=None)
+            with patch.object(PersistentItem, "get", side_effect=lambda hash_key: legacy_items[hash_key]):
+                assert persistence.get_chat_data()[1] == {"game_id": "abc"}
+                assert conversations.get((1, 2)) == 30
+            persistence.update_conversation(name="main", key=(1, 2), new_state=40)
+            persistence.update_chat_data(chat_id=1, data={"game_id": "abc"})
+    [item] = write_items.call_args.kwargs["items"]
+    assert item.item_id == "chat_state::1"
+    assert item.data == {"chat_data": {"game_id": "abc"}, "conversations": {"main:1:2": 40}}
+
+
+def test_single_item_per_chat_prefetches_legacy_items_of_new_chats():
+    persistence = DynamoPersistence(single_item_per_chat=True)
+    main, config = persistence.get_conversations("main"), persistence.get_conversations("config")
+    conversation_keys = {"main": (1, 2), "config": (1, 2)}
+    legacy_items = [_item("conversation::main:1:2", 30)]
+    with persistence.unit_of_work():
+        with patch.object(PersistentItem, "batch_get", side_effect=[[], legacy_items]) as batch_get:
+            reads_saved = persistence.prefetch(conversation_keys=conversation_keys, chat_id=1)
+        legacy_item_ids = {"chat::1", "conversation::main:1:2", "conversation::config:1:2"}
+        assert batch_get.call_args_list[1].args[0] == legacy_item_ids
+        assert reads_saved == 2
+        with patch.object(PersistentItem, "get") as get:
+            assert main.get((1, 2)) == 30
+            assert config.get((1, 2)) is None
+            assert config.get((1, 2), 10) == 10
+            assert persistence.get_chat_data().get(1, {}) == {}
+    get.assert_not_called()
+
+
+@patch.object(Config, "persistence_ttl_seconds", {"default": 1000, "parsing": 10})
+def test_expired_items_read_as_absent():
+    persistence = DynamoPersistence()
+    expired = _item("chat::1", {"parsing_state": {"words": []}}, version=4)
+    expired.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    with patch.object(DynamoItemBackend, "write") as write_items:
+        with persistence.unit_of_work():
+            with patch.object(PersistentItem, "batch_get", return_value=[expired]):
+                persistence.prefetch(conversation_keys={}, chat_id=1)
+            assert persistence.get_chat_data()[1] is None
+            persistence.update_chat_data(chat_id=1, data={"parsing_state": {"words": ["a"]}})
+    [item] = write_items.call_args.kwargs["items"]
+    assert item.version == 4
+    assert item.expires_at - datetime.now(timezone.utc) <= timedelta(seconds=10)
+
+
+def test_sqlite_backend_round_trip(tmp_path):
+    backend = SqliteItemBackend(path=str(tmp_path / "persistence.db"))
+    persistence = DynamoPersistence(backend=backend)
+    persistence.get_conversations("main")
+    with persistence.unit_of_work():
+        persistence.update_conversation(name="main", key=(1, 2), new_state=30)
+        persistence.update_chat_data(chat_id=1, data={"game_id": "abc"})
+    assert backend.batch_get_versions(["conversation::main:1:2", "chat::1", "chat::2"]) == {
+        "conversation::main:1:2": 1,
+        "chat::1": 1,
+        "chat::2": None,
+    }
+    reloaded = DynamoPersistence(backend=backend)
+    assert reloaded.get_chat_data()[1] == {"game_id": "abc"}
+    assert reloaded.get_conversations("main")[(1, 2)] == 30
+    stale = _item("chat::1", {"game_id": "def"}, version=0)
+    with pytest.raises(VersionConflict):
+        backend.write(items=[reloaded.chat_data_store.build_item(key=1, data={}), stale])
+    assert backend.get("chat::1").data == {"game_id": "abc"}
+
+
+@patch.object(Config, "persistence_cache_trust_seconds", 2)
+def test_write_behind_merges_pending_writes():
+    persistence = DynamoPersistence(write_behind=True)
+    persistence.get_chat_data().fill_cache(key=1, item=None)
+    writing, release = threading.Event(), threading.Event()
+    written = []
+
+    def write(items):
+        written.append([item.data for item in items])
+        writing.set()
+        release.wait(timeout=5)
+
+    with patch.object(DynamoItemBackend, "write", side_effect=write):
+        persistence.update_chat_data(chat_id=1, data={"game_id": "abc"})
+        assert writing.wait(timeout=5)
+        persistence.update_chat_data(chat_id=1, data={"game_id": "def"})
+        persistence.update_chat_data(chat_id=1, data={"game_id": "ghi"})
+        release.set()
+        persistence.flush()
+    assert written == [[{"game_id": "abc"}], [{"game_id": "ghi"}]]
+    assert persistence.get_chat_data()[1] == {"game_id": "ghi"}
+
+
+@patch("dynamo_persistence.write_behind.RETRY_DELAY_SECONDS", 0)
+@patch.object(Config, "persistence_cache_trust_seconds", 2)
+def test_write_behind_keeps_failed_writes():
+    persistence = DynamoPersistence(write_behind=True)
+    persistence.get_chat_data().fill_cache(key=1, item=None)
+    # Transient errors are retried.
+    with patch.object(DynamoItemBackend, "write", side_effect=[RuntimeError("throttled"), None]) as write_items:
+        persistence.update_chat_data(chat_id=1, data={"game_id": "abc"})
+        persistence.flush()
+    assert write_items.call_count == 2
+    # Writes that keep failing are raised, without losing the committed value.
+    with patch.object(DynamoItemBackend, "write", side_effect=RuntimeError("unavailable")):
+        persistence.update_chat_data(chat_id=1, data={"game_id": "def"})
+        with pytest.raises(WriteBehindError):
+            persistence.flush()
+    assert persistence.get_chat_data()[1] == {"game_id": "def"}
+    with patch.object(DynamoItemBackend, "write") as write_items:
+        persistence.flush()
+    [item] = write_items.call_args.kwargs["items"]
+    assert item.data == {"game_id": "def"}
+
+
+def test_write_behind_drops_conflicted_writes():
+    persistence = DynamoPersistence(write_behind=True)
+    chat_data = persistence.get_chat_data()
+    chat_data.fill_cache(key=1, item=_item("chat::1", {"game_id": "abc"}, version=2))
+    conflict = VersionConflict(item_ids=["chat::1"])
+    with patch.object(DynamoItemBackend, "write", side_effect=conflict) as write_items:
+        persistence.update_chat_data(chat_id=1, data={"game_id": "def"})
+        persistence.flush()
+    # Conflicts are not retried, and the stale value is evicted so it is read again.
+    assert write_items.call_count == 1
+    assert not chat_data.is_cached(1)
+    with patch.object(PersistentItem, "get", return_value=_item("chat::1", {"game_id": "xyz"}, version=3)):
+        assert chat_data[1] == {"game_id": "xyz"}
+    with patch.object(DynamoItemBackend, "write") as write_items:
+        persistence.update_chat_data(chat_id=1, data={"game_id": "ghi"})
+        persistence.flush()
+    [item] = write_items.call_args.kwargs["items"]
+    assert item.version == 3
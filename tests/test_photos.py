@@ -0,0 +1,44 @@
+import io
+
+from bot.handlers.parse.photos import _pick_photo, _preprocess_photo
+from PIL import Image
+from telegram import PhotoSize
+
+PARSE_BOARD_MIN_RESOLUTION = 800
+
+
+def _photo(width: int, height: int) -> PhotoSize:
+    return PhotoSize(file_id=f"{width}", file_unique_id=f"{width}", width=width, height=height)
+
+
+def _jpeg(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(output, format="JPEG")
+    return output.getvalue()
+
+
+def test_pick_photo_prefers_smallest_size_meeting_the_floor():
+    photos = [_photo(90, 67), _photo(320, 240), _photo(800, 600), _photo(1280, 960)]
+    assert _pick_photo(photos, min_resolution=320).width == 320
+    assert _pick_photo(photos, min_resolution=1000).width == 1280
+    # None is large enough, the largest one is picked.
+    assert _pick_photo(photos, min_resolution=2560).width == 1280
+
+
+def test_pick_photo_saves_a_size_of_telegram_photos():
+    # Sizes Telegram provides for landscape and portrait photos.
+    landscape = [_photo(90, 41), _photo(320, 144), _photo(800, 360), _photo(1280, 576)]
+    portrait = [_photo(41, 90), _photo(144, 320), _photo(360, 800), _photo(576, 1280)]
+    assert _pick_photo(landscape, min_resolution=PARSE_BOARD_MIN_RESOLUTION).width == 800
+    assert _pick_photo(portrait, min_resolution=PARSE_BOARD_MIN_RESOLUTION).height == 800
+    # Small photos only have small sizes.
+    assert _pick_photo([_photo(90, 60), _photo(600, 400)], min_resolution=PARSE_BOARD_MIN_RESOLUTION).width == 600
+
+
+def test_preprocess_photo_downscales_large_photos():
+    photo_bytes = _jpeg(width=1600, height=1200)
+    processed = _preprocess_photo(photo_bytes, max_resolution=800, grayscale=False)
+    with Image.open(io.BytesIO(processed)) as image:
+        assert image.size == (800, 600)
+    # Photos within the limit are sent as they are.
+    assert _preprocess_photo(photo_bytes, max_resolution=1600, grayscale=False) is photo_bytes
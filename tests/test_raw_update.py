@@ -0,0 +1,21 @@
+from bot.raw_update import UNSUPPORTED_CONTENT, UpdateFilter, get_ignore_reason
+
+CHAT = {"id": 1, "type": "private"}
+
+
+def test_get_ignore_reason():
+    assert get_ignore_reason({"update_id": 1, "message": {"chat": CHAT, "text": "/start"}}) is None
+    assert get_ignore_reason({"update_id": 1, "message": {"chat": CHAT, "photo": [{"file_id": "a"}]}}) is None
+    assert get_ignore_reason({"action": "warmup"}) is None
+    assert get_ignore_reason({"update_id": 1, "message": {"chat": CHAT, "sticker": {}}}) == UNSUPPORTED_CONTENT
+    assert get_ignore_reason({"update_id": 1, "edited_message": {"chat": CHAT, "text": "hi"}}) == "edited_message"
+    assert get_ignore_reason({"update_id": 1, "my_chat_member": {"chat": CHAT}}) == "my_chat_member"
+
+
+def test_update_filter_counts_ignored_updates_by_reason():
+    update_filter = UpdateFilter()
+    assert not update_filter.should_ignore({"update_id": 1, "message": {"chat": CHAT, "text": "hi"}})
+    assert update_filter.should_ignore({"update_id": 2, "channel_post": {"chat": CHAT, "text": "hi"}})
+    assert update_filter.should_ignore({"update_id": 3, "channel_post": {"chat": CHAT, "text": "hi"}})
+    assert update_filter.should_ignore({"update_id": 4, "message": {"chat": CHAT, "sticker": {}}})
+    assert update_filter.ignored_counts == {"channel_post": 2, UNSUPPORTED_CONTENT: 1}
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from bot.send_pipeline import (
+    SendDeadlineExceeded,
+    SendPipeline,
+    SendPriority,
+    wait_for_sends,
+)
+from telegram.error import RetryAfter
+
+
+def test_sends_keep_order_per_chat():
+    pipeline = SendPipeline(max_workers=4, chat_rate=1000, chat_burst=1000)
+    sent = []
+    blocked = threading.Event()
+
+    def send(chat_id: int, index: int):
+        if chat_id == 1 and index == 0:
+            blocked.wait(timeout=5)
+        time.sleep(0.001)
+        sent.append((chat_id, index))
+
+    futures = [
+        pipeline.submit(chat_id=chat_id, send=lambda c=chat_id, i=i: send(c, i)) for i in range(5) for chat_id in (1, 2)
+    ]
+    # Chat 2 is not held back by chat 1.
+    assert wait_for_sends([f for i, f in enumerate(futures) if i % 2 == 1], timeout=5) == []
+    blocked.set()
+    assert wait_for_sends(futures, timeout=5) == []
+    assert [index for chat_id, index in sent if chat_id == 1] == list(range(5))
+    assert [index for chat_id, index in sent if chat_id == 2] == list(range(5))
+
+
+def test_failed_sends_are_reported():
+    pipeline = SendPipeline()
+    error = ValueError("blocked")
+
+    def fail():
+        raise error
+
+    futures = [pipeline.submit(chat_id=1, send=fail), pipeline.submit(chat_id=1, send=lambda: "ok")]
+    assert wait_for_sends(futures, timeout=5) == [error]
+    assert futures[1].result() == "ok"
+
+
+def test_retry_after_is_retried_in_order():
+    pipeline = SendPipeline(chat_rate=1000, chat_burst=1000)
+    sent = []
+    attempts = []
+
+    def limited():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RetryAfter(0.01)
+        sent.append("first")
+
+    futures = [pipeline.submit(chat_id=1, send=limited), pipeline.submit(chat_id=1, send=lambda: sent.append("second"))]
+    assert wait_for_sends(futures, timeout=5) == []
+    assert sent == ["first", "second"]
+    assert len(attempts) == 2
+
+
+def test_interactive_sends_use_reserved_tokens():
+    pipeline = SendPipeline(global_rate=0.1, global_burst=6)
+    info = [pipeline.submit(chat_id=chat_id, send=lambda: None) for chat_id in (1, 2)]
+    interactive = pipeline.submit(chat_id=3, send=lambda: None, priority=SendPriority.INTERACTIVE)
+    assert wait_for_sends([info[0], interactive], timeout=5) == []
+    assert not info[1].done()
+
+
+def test_sends_are_throttled_only_over_the_limit():
+    pipeline = SendPipeline()
+    start = time.monotonic()
+    # A typical turn is sent without waiting.
+    futures = [pipeline.submit(chat_id=1, send=lambda: None) for _ in range(10)]
+    assert wait_for_sends(futures, timeout=5) == []
+    assert time.monotonic() - start < 0.5
+    pipeline = SendPipeline(chat_rate=0.5, chat_burst=1)
+    futures = [pipeline.submit(chat_id=1, send=lambda: None) for _ in range(2)]
+    assert wait_for_sends(futures[:1], timeout=5) == []
+    assert not futures[1].done()
+
+
+def test_sends_do_not_wait_past_the_deadline():
+    pipeline = SendPipeline(chat_rate=0.01, chat_burst=1)
+    pipeline.set_deadline(seconds_left=3)
+    assert pipeline.get_wait_timeout(30) <= 1
+    start = time.monotonic()
+    futures = [pipeline.submit(chat_id=1, send=lambda: None) for _ in range(2)]
+    assert wait_for_sends(futures[:1], timeout=5) == []
+    assert isinstance(futures[1].exception(timeout=5), SendDeadlineExceeded)
+
+    def limited():
+        raise RetryAfter(30)
+
+    pipeline.set_deadline(seconds_left=3)
+    retried = pipeline.submit(chat_id=2, send=limited)
+    assert isinstance(retried.exception(timeout=5), RetryAfter)
+    assert time.monotonic() - start < 1
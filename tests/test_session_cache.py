@@ -0,0 +1,52 @@
+from unittest.mock import patch
+
+from bot.models import GameConfig, Session
+from bot.session_cache import SessionCache
+from dynamo_persistence.persistence import DynamoPersistence
+from dynamo_persistence.sqlite_backend import SqliteItemBackend
+
+
+def _load(cache: SessionCache, persistence: DynamoPersistence, chat_id: int):
+    with persistence.unit_of_work():
+        chat_data = persistence.get_chat_data()[chat_id]
+        digest = persistence.get_chat_data_digest(chat_id=chat_id)
+        return cache.load(chat_id=chat_id, chat_data=chat_data, digest=digest)
+
+
+def test_stored_session_is_not_validated_again(tmp_path):
+    persistence = DynamoPersistence(backend=SqliteItemBackend(path=str(tmp_path / "persistence.db")))
+    cache = SessionCache()
+    session = Session(game_id="abc", config=GameConfig())
+    with persistence.unit_of_work():
+        chat_data = cache.dump(chat_id=1, session=session)
+        # Like the dispatcher: the handler sets the chat data, and the persistence stores a copy of it.
+        persistence.get_chat_data()[1] = chat_data
+        persistence.update_chat_data(chat_id=1, data=chat_data)
+    assert persistence.get_chat_data().get_cached(1) is not chat_data
+    with patch.object(Session, "model_validate") as model_validate:
+        assert _load(cache=cache, persistence=persistence, chat_id=1) is session
+    model_validate.assert_not_called()
+
+
+def test_changed_session_is_validated(tmp_path):
+    backend = SqliteItemBackend(path=str(tmp_path / "persistence.db"))
+    persistence = DynamoPersistence(backend=backend)
+    cache = SessionCache()
+    with persistence.unit_of_work():
+        persistence.update_chat_data(chat_id=1, data=cache.dump(chat_id=1, session=Session(game_id="abc")))
+    # Another process changed the chat data.
+    other = DynamoPersistence(backend=backend)
+    with other.unit_of_work():
+        assert other.get_chat_data()[1]["game_id"] == "abc"
+        other.update_chat_data(chat_id=1, data=Session(game_id="def").model_dump())
+    assert _load(cache=cache, persistence=persistence, chat_id=1) == Session(game_id="def")
+    # Validated once, then cached by the stored digest.
+    with patch.object(Session, "model_validate") as model_validate:
+        assert _load(cache=cache, persistence=persistence, chat_id=1) == Session(game_id="def")
+    model_validate.assert_not_called()
+
+
+def test_invalid_session_is_dropped():
+    cache = SessionCache()
+    assert cache.load(chat_id=1, chat_data={"config": "not a config"}) is None
+    assert cache.load(chat_id=1, chat_data=None) is None
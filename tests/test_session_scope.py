@@ -0,0 +1,85 @@
+from unittest.mock import MagicMock, patch
+
+from bot.handlers.gameplay.start import StartEventHandler
+from bot.handlers.other.event_handler import EventHandler
+from bot.handlers.parse.parse_map_handler import ParseMapHandler
+from bot.models import GameStateSnapshot, Session
+from bot.send_pipeline import SendPipeline
+from bot.session_cache import SessionCache
+from codenames.classic.state import ClassicGameState
+from telegram.ext import ConversationHandler
+
+
+class ConfigHandler(EventHandler):
+    def handle(self):
+        self.update_session(last_keyboard_message_id=1)
+        return self.trigger(KeyboardHandler)
+
+
+class KeyboardHandler(EventHandler):
+    def handle(self):
+        self.update_session(last_keyboard_message_id=2)
+
+
+class FailingHandler(ConfigHandler):
+    def handle(self):
+        super().handle()
+        raise RuntimeError("Handler failed")
+
+
+def _bot(session: Session) -> MagicMock:
+    bot = MagicMock()
+    bot.load_session.return_value = session
+    bot.session_cache = SessionCache()
+    bot.send_pipeline = SendPipeline()
+    bot.dispatcher.chat_data = {}
+    return bot
+
+
+def _update() -> MagicMock:
+    update = MagicMock()
+    update.effective_chat.id = 1
+    return update
+
+
+def test_session_changes_are_committed_once():
+    bot = _bot(session=Session(game_id="abc"))
+    callback = ConfigHandler.generate_callback(bot=bot)
+    with patch.object(bot.session_cache, "dump", wraps=bot.session_cache.dump) as dump:
+        callback(_update(), MagicMock())
+    dump.assert_called_once()
+    assert bot.dispatcher.chat_data[1]["last_keyboard_message_id"] == 2
+
+
+def test_session_changes_are_rolled_back_on_error():
+    bot = _bot(session=Session(game_id="abc"))
+    FailingHandler.generate_callback(bot=bot)(_update(), MagicMock())
+    assert bot.dispatcher.chat_data == {}
+    # A cached game state is dropped, the failed handler might have made a move.
+    state = ClassicGameState.from_language("english")
+    game_state = GameStateSnapshot.from_state(state=state, game_id="abc", move_count=0)
+    bot = _bot(session=Session(game_id="abc", game_state=game_state))
+    FailingHandler.generate_callback(bot=bot)(_update(), MagicMock())
+    assert bot.dispatcher.chat_data[1] == Session(game_id="abc").model_dump()
+
+
+def test_started_game_is_kept_when_the_first_move_fails():
+    bot = _bot(session=Session(game_id="old", move_count=5))
+    state = ClassicGameState.from_language("english")
+    bot.api_client.classic.start_game.return_value = MagicMock(game_id="new", game_state=state)
+    callback = StartEventHandler.generate_callback(bot=bot)
+    with patch.object(StartEventHandler, "_next_move", side_effect=RuntimeError("Next move failed")):
+        callback(_update(), MagicMock())
+    # The game was started by the backend, so the chat does not go back to the previous game.
+    session = Session(**bot.dispatcher.chat_data[1])
+    assert session.game_id == "new"
+    assert session.move_count == 0
+
+
+def test_parsing_step_ends_conversation_when_parsing_state_expired():
+    # The chat data (with the parsing state) expired, the conversation state did not.
+    bot = _bot(session=None)
+    callback = ParseMapHandler.generate_callback(bot=bot)
+    with patch.object(ParseMapHandler, "handle") as handle:
+        assert callback(_update(), MagicMock()) == ConversationHandler.END
+    handle.assert_not_called()
@@ -0,0 +1,91 @@
+import threading
+from typing import Dict, List
+from unittest.mock import patch
+
+import pytest
+from bot.the_spymaster_bot import TheSpymasterBot
+from bot.update_queue import InProcessUpdateQueue
+from dynamo_persistence.persistence import DynamoPersistence
+
+
+def _update(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "from": {"id": chat_id}, "text": "hi"}}
+
+
+def test_batch_keeps_chat_order_and_reports_partial_failures():
+    bot = TheSpymasterBot(telegram_token="12345:DUMMY_TOKEN", server_host="http://localhost", lazy_handlers=True)
+    dispatched: Dict[int, List[int]] = {}
+    lock = threading.Lock()
+
+    def dispatch(update: dict):
+        chat_id = update["message"]["chat"]["id"]
+        if update["update_id"] == 4:
+            raise RuntimeError("Handler failed")
+        with lock:
+            dispatched.setdefault(chat_id, []).append(update["update_id"])
+
+    updates = [_update(1, chat_id=1), _update(2, chat_id=2), _update(3, chat_id=1), _update(4, chat_id=2)]
+    updates += [_update(5, chat_id=1), _update(6, chat_id=2), _update(1, chat_id=1)]
+    with patch.object(bot, "dispatch", side_effect=dispatch):
+        errors = bot.process_updates(updates)
+    assert dispatched == {1: [1, 3, 5], 2: [2]}
+    # The failed update, and the following update of its chat, are reported. The duplicate update is ignored.
+    assert [update["update_id"] for update, error in zip(updates, errors, strict=True) if error] == [4, 6]
+
+
+def test_failed_update_is_handled_when_retried():
+    bot = TheSpymasterBot(telegram_token="12345:DUMMY_TOKEN", server_host="http://localhost", lazy_handlers=True)
+    update = _update(1, chat_id=1)
+    with patch.object(bot, "dispatch", side_effect=RuntimeError("Handler failed")):
+        with pytest.raises(RuntimeError):
+            bot.process_update(update)
+        [error] = bot.process_updates([update])
+    assert error
+    with patch.object(bot, "dispatch") as dispatch:
+        bot.process_update(update)
+        bot.process_update(update)
+    dispatch.assert_called_once()
+
+
+def test_failed_queued_updates_stay_queued():
+    bot = TheSpymasterBot(telegram_token="12345:DUMMY_TOKEN", server_host="http://localhost", lazy_handlers=True)
+    queue = InProcessUpdateQueue()
+    for update_id, chat_id in [(1, 1), (2, 2), (3, 1)]:
+        queue.put(_update(update_id, chat_id=chat_id))
+
+    def dispatch(update: dict):
+        if update["update_id"] == 2:
+            raise RuntimeError("Handler failed")
+
+    with patch.object(bot, "dispatch", side_effect=dispatch):
+        assert bot.process_queued_updates(queue) == 2
+    assert [received.update["update_id"] for received in queue.receive()] == [2]
+    with patch.object(bot, "dispatch"):
+        assert bot.process_queued_updates(queue) == 1
+    assert queue.receive() == []
+
+
+def test_failed_chat_write_only_fails_its_chat(tmp_path):
+    path = str(tmp_path / "persistence.db")
+    bot = TheSpymasterBot(
+        telegram_token="12345:DUMMY_TOKEN", server_host="http://localhost", sqlite_persistence_path=path
+    )
+    backend = bot.persistence.backend
+    write = backend.write
+
+    def dispatch(update: dict):
+        chat_id = update["message"]["chat"]["id"]
+        bot.persistence.update_chat_data(chat_id=chat_id, data={"last_update_id": update["update_id"]})
+
+    def write_items(items):
+        if any(item.item_id == "chat::2" for item in items):
+            raise RuntimeError("Write failed")
+        return write(items=items)
+
+    updates = [_update(1, chat_id=1), _update(2, chat_id=2), _update(3, chat_id=1)]
+    with patch.object(bot, "dispatch", side_effect=dispatch), patch.object(backend, "write", side_effect=write_items):
+        errors = bot.process_updates(updates)
+    assert [update["update_id"] for update, error in zip(updates, errors, strict=True) if error] == [2]
+    reloaded = DynamoPersistence(backend=backend)
+    assert reloaded.get_chat_data()[1] == {"last_update_id": 3}
+    assert reloaded.get_chat_data()[2] is None
@@ -0,0 +1,72 @@
+from unittest.mock import patch
+
+from bot.the_spymaster_bot import TheSpymasterBot
+from bot.update_dedup import UpdateDeduplicator
+from dynamo_persistence.sqlite_backend import SqliteItemBackend
+from freezegun import freeze_time
+
+
+def _deduplicator(backend=None) -> UpdateDeduplicator:
+    return UpdateDeduplicator(backend=backend, ttl_seconds=3600, claim_seconds=60)
+
+
+def test_update_is_claimed_once_per_container():
+    deduplicator = _deduplicator()
+    assert deduplicator.claim(update_id=1)
+    assert not deduplicator.claim(update_id=1)
+    assert deduplicator.claim(update_id=2)
+
+
+def test_update_is_claimed_once_across_containers(tmp_path):
+    backend = SqliteItemBackend(path=str(tmp_path / "persistence.db"))
+    first_container, second_container = _deduplicator(backend=backend), _deduplicator(backend=backend)
+    assert first_container.claim(update_id=1)
+    assert not second_container.claim(update_id=1)
+    assert backend.get_version("update::1") == 1
+
+
+def test_released_update_is_claimed_again(tmp_path):
+    backend = SqliteItemBackend(path=str(tmp_path / "persistence.db"))
+    first_container, second_container = _deduplicator(backend=backend), _deduplicator(backend=backend)
+    assert first_container.claim(update_id=1)
+    assert not second_container.claim(update_id=1)
+    # Only the container that claimed the update may release it.
+    second_container.release(update_id=1)
+    assert backend.get_version("update::1") == 1
+    first_container.release(update_id=1)
+    assert backend.get_version("update::1") is None
+    assert first_container.claim(update_id=1)
+
+
+def test_claim_of_a_crashed_container_expires(tmp_path):
+    backend = SqliteItemBackend(path=str(tmp_path / "persistence.db"))
+    with freeze_time("2024-01-01 10:00:00"):
+        # The first container dies while handling the update, so it is neither completed nor released.
+        assert _deduplicator(backend=backend).claim(update_id=1)
+    retrying_container = _deduplicator(backend=backend)
+    with freeze_time("2024-01-01 10:00:30"):
+        assert not retrying_container.claim(update_id=1)
+    with freeze_time("2024-01-01 10:01:30"):
+        assert retrying_container.claim(update_id=1)
+        retrying_container.complete(update_id=1)
+    # Handled updates are marked for longer.
+    with freeze_time("2024-01-01 10:30:00"):
+        assert not _deduplicator(backend=backend).claim(update_id=1)
+
+
+def test_redelivered_update_is_handled_after_a_crash(tmp_path):
+    path = str(tmp_path / "persistence.db")
+    update = {"update_id": 1, "message": {"chat": {"id": 1}, "from": {"id": 1}, "text": "hi"}}
+    with freeze_time("2024-01-01 10:00:00"):
+        crashed_bot = TheSpymasterBot(
+            telegram_token="12345:DUMMY_TOKEN", server_host="http://localhost", sqlite_persistence_path=path
+        )
+        # The process dies after the update is claimed.
+        assert not crashed_bot.is_duplicate(update)
+    bot = TheSpymasterBot(
+        telegram_token="12345:DUMMY_TOKEN", server_host="http://localhost", sqlite_persistence_path=path
+    )
+    with freeze_time("2024-01-01 10:02:00"), patch.object(bot, "dispatch") as dispatch:
+        bot.process_update(update)
+        bot.process_update(update)
+    dispatch.assert_called_once()
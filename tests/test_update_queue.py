@@ -0,0 +1,46 @@
+from bot.update_queue import InProcessUpdateQueue, SqliteUpdateQueue
+
+
+def _update(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": "hi"}}
+
+
+def _update_ids(received_updates) -> list:
+    return [received.update["update_id"] for received in received_updates]
+
+
+def test_in_process_queue_receives_in_order():
+    queue = InProcessUpdateQueue()
+    for update_id in range(5):
+        queue.put(_update(update_id=update_id, chat_id=update_id % 2))
+    received = queue.receive(max_count=3)
+    assert _update_ids(received) == [0, 1, 2]
+    queue.delete(received)
+    received = queue.receive(max_count=3)
+    assert _update_ids(received) == [3, 4]
+    queue.delete(received)
+    assert queue.receive() == []
+
+
+def test_sqlite_queue_is_shared_between_producer_and_consumer(tmp_path):
+    path = str(tmp_path / "updates.db")
+    producer, consumer = SqliteUpdateQueue(path=path), SqliteUpdateQueue(path=path)
+    for update_id in range(5):
+        producer.put(_update(update_id=update_id, chat_id=1))
+    received = consumer.receive(max_count=3)
+    assert [r.update for r in received] == [_update(update_id=i, chat_id=1) for i in range(3)]
+    consumer.delete(received)
+    received = consumer.receive()
+    assert _update_ids(received) == [3, 4]
+    consumer.delete(received)
+    assert consumer.receive() == []
+
+
+def test_sqlite_queue_keeps_updates_until_deleted(tmp_path):
+    queue = SqliteUpdateQueue(path=str(tmp_path / "updates.db"))
+    for update_id in range(3):
+        queue.put(_update(update_id=update_id, chat_id=1))
+    received = queue.receive()
+    # Only the first update was handled, the others are received again.
+    queue.delete(received[:1])
+    assert _update_ids(queue.receive()) == [1, 2]
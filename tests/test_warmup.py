@@ -0,0 +1,46 @@
+from unittest.mock import MagicMock
+
+from bot.handlers.internal.warmup import (
+    PARSER_LANGUAGES,
+    WARMUP_ITEM_ID,
+    Warmup,
+    load_parser_languages,
+    prime_connections,
+)
+from dynamo_persistence.backend import ItemBackend
+from dynamo_persistence.persistence import DynamoPersistence
+
+
+def _warmup() -> Warmup:
+    bot = MagicMock()
+    bot.persistence = DynamoPersistence(backend=MagicMock(spec=ItemBackend))
+    return Warmup(bot=bot)
+
+
+def test_prime_connections_opens_update_path_connections():
+    warmup = _warmup()
+    bot = warmup.bot
+    result = prime_connections(warmup)
+    assert result.message == "Primed connections"
+    bot.api_client.classic.session.head.assert_called_once()
+    bot.parser_client.session.head.assert_called_once()
+    bot.dispatcher.bot.get_me.assert_called_once()
+    bot.persistence.backend.get_version.assert_called_once_with(WARMUP_ITEM_ID)
+
+
+def test_prime_connections_skips_missing_api_client_session():
+    warmup = _warmup()
+    warmup.bot.api_client = MagicMock(spec=[])
+    result = prime_connections(warmup)
+    assert result.message == "Primed connections"
+    warmup.bot.parser_client.session.head.assert_called_once()
+
+
+def test_loaded_languages_are_not_loaded_again():
+    warmup = _warmup()
+    load_languages = warmup.bot.parser_client.load_languages
+    load_languages.return_value = PARSER_LANGUAGES
+    load_parser_languages(warmup)
+    result = load_parser_languages(warmup)
+    load_languages.assert_called_once_with(languages=PARSER_LANGUAGES)
+    assert result.message == f"All `{len(PARSER_LANGUAGES)}` languages are loaded"
@@ -9,4 +9,9 @@ resource "aws_dynamodb_table" "persistence_table" {
     name = "item_id"
     type = "S"
   }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
 }
@@ -71,6 +71,8 @@ locals {
   # Config
   # warmup is true if prod else false
   warmup_enabled     = local.is_prod
+  # When enabled, the webhook lambda queues updates and the queue lambda handles them (see queue.tf)
+  fast_ack_enabled   = false
 }
 
 data "aws_caller_identity" "current" {}
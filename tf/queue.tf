@@ -0,0 +1,54 @@
+# Update queue (fast-ack mode)
+
+resource "aws_sqs_queue" "update_queue" {
+  name                        = "${local.service_name}-updates.fifo"
+  fifo_queue                  = true
+  # Messages are deduplicated by update id.
+  content_based_deduplication = false
+  deduplication_scope         = "messageGroup"
+  fifo_throughput_limit       = "perMessageGroupId"
+  # At least 6 times the queue lambda timeout, as recommended for SQS event sources.
+  visibility_timeout_seconds  = 6 * aws_lambda_function.queue_lambda.timeout
+  message_retention_seconds   = 86400
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.update_dead_letter_queue.arn
+    maxReceiveCount     = 5
+  })
+}
+
+resource "aws_sqs_queue" "update_dead_letter_queue" {
+  name                      = "${local.service_name}-updates-dlq.fifo"
+  fifo_queue                = true
+  message_retention_seconds = 1209600
+}
+
+# Queue lambda
+
+resource "aws_lambda_function" "queue_lambda" {
+  function_name                  = "${local.service_name}-queue-lambda"
+  role                           = aws_iam_role.lambda_exec_role.arn
+  timeout                        = 30
+  image_uri                      = "${aws_ecr_repository.ecr_repo.repository_url}@${module.app_image.id}"
+  package_type                   = "Image"
+  memory_size                    = 200
+  reserved_concurrent_executions = 2
+  depends_on = [
+    module.app_image
+  ]
+  image_config {
+    command = ["lambda_handler.handle_queued"]
+  }
+  environment {
+    variables = {
+      ENV_FOR_DYNACONF = local.env
+    }
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "update_queue_source" {
+  event_source_arn        = aws_sqs_queue.update_queue.arn
+  function_name           = aws_lambda_function.queue_lambda.arn
+  batch_size              = 10
+  enabled                 = local.fast_ack_enabled
+  function_response_types = ["ReportBatchItemFailures"]
+}
@@ -14,6 +14,7 @@ resource "aws_lambda_function" "service_lambda" {
   environment {
     variables = {
       ENV_FOR_DYNACONF = local.env
+      UPDATE_QUEUE_URL = local.fast_ack_enabled ? aws_sqs_queue.update_queue.url : ""
     }
   }
 }
@@ -69,9 +70,21 @@ resource "aws_iam_role" "lambda_exec_role" {
             "Action" : [
               "dynamodb:DescribeTable",
               "dynamodb:GetItem",
+              "dynamodb:BatchGetItem",
               "dynamodb:PutItem",
+              "dynamodb:DeleteItem",
             ],
             "Resource" : aws_dynamodb_table.persistence_table.arn
+          },
+          {
+            "Effect" : "Allow",
+            "Action" : [
+              "sqs:SendMessage",
+              "sqs:ReceiveMessage",
+              "sqs:DeleteMessage",
+              "sqs:GetQueueAttributes",
+            ],
+            "Resource" : aws_sqs_queue.update_queue.arn
           }
         ]
       }